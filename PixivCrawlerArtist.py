@@ -1,58 +1,78 @@
 import requests
-import json
 import os
-import time
 import re
 import argparse
 import configparser
+from urllib.parse import urlencode
+from PixivCrawlerPool import default_workers
+from PixivCrawlerBase import PixivBaseCrawler
+from PixivCrawlerEvents import PAGE_FETCHED, DETAILS_FETCHED, ARTWORK_QUEUED, ORIGINAL_GUESSED
+from PixivCrawlerProgress import ProgressReporter, STATUS_INTERVAL
+from PixivCrawlerMetrics import MetricsExporter, EXPORT_INTERVAL
+from PixivCrawlerCassette import cassette_transport, close_cassette_transport
+from PixivCrawlerStore import BlobStore
 
-sleep_time = 0.5
+# 下载时用到的作品详情字段
+DETAIL_FIELDS = ('title', 'urls', 'pageCount')
 
-class PixivArtistCrawler:
-    def __init__(self, cookie, save_path=None):
-        self.session = requests.Session()
-        self.session.verify = False  # 禁用SSL验证
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36',
-            'Referer': 'https://www.pixiv.net/',
-            'Cookie': cookie
-        }
-        # 使用传入的保存路径或默认路径
-        self.save_path = save_path if save_path else 'pixiv_images'
-        if not os.path.exists(self.save_path):
-            os.makedirs(self.save_path)
+# 批量元数据接口每次请求的作品数
+BATCH_SIZE = 48
+# 缩略图地址中的上传时间路径和作品ID，原图地址与之相同
+THUMBNAIL_URL = re.compile(r'/img/(\d{4}/\d{2}/\d{2}/\d{2}/\d{2}/\d{2})/(\d+)_p0')
+# 批量接口不返回原图扩展名，按常见程度依次尝试
+ORIGINAL_EXTENSIONS = ('jpg', 'png', 'gif')
 
-    def get_artist_artworks(self, artist_id):
+class PixivArtistCrawler(PixivBaseCrawler):
+    def get_artist_artworks(self, artist_id, incremental=False):
+        """下载作者的作品；incremental为True时只下载 artist_works 表中尚未记录的新作品"""
         # 获取作者作品列表的API
         url = f'https://www.pixiv.net/ajax/user/{artist_id}/profile/all'
         
         print(f'正在获取作者 {artist_id} 的所有作品...')
-        response = self.session.get(url, headers=self.headers, verify=False)
+        try:
+            response = self.transport.get(url)
+        except requests.exceptions.RequestException as e:
+            print(f'作者 {artist_id} 作品列表请求异常: {str(e)}')
+            return 0
         
         if response.status_code == 200:
-            data = response.json()
+            try:
+                data = response.json()
+            except ValueError as e:
+                print(f'作者 {artist_id} 作品列表解析失败: {str(e)}')
+                return 0
             if data['error'] == False:
                 # 获取所有插画作品ID
-                artworks = data['body']['illusts']
+                artworks = data['body']['illusts'] or {}  # 没有作品时为空列表
                 artwork_ids = list(artworks.keys())
                 
                 print(f"共找到 {len(artwork_ids)} 个作品")
+                self.events.publish(PAGE_FETCHED, page=1, count=len(artwork_ids))
                 
-                # 下载每个作品
+                if incremental:
+                    # 与已记录的作品对比，只处理新作品
+                    recorded_ids = self.db.get_recorded_work_ids(artist_id)
+                    artwork_ids = [artwork_id for artwork_id in artwork_ids if artwork_id not in recorded_ids]
+                    last_update = self.db.get_last_update(artist_id)
+                    print(f"增量同步: 上次同步于 {last_update or '从未同步'}，新增 {len(artwork_ids)} 个作品")
+                
+                # 批量获取元数据后交给下载线程池并发下载
+                batch_details = self.get_artwork_details_batch(artist_id, artwork_ids)
+                futures = []
                 for artwork_id in artwork_ids:
-                    # 获取作品详细信息
-                    details = self.get_artwork_details(artwork_id)
+                    # 批量结果中没有的作品再单独获取详情
+                    details = batch_details.get(artwork_id) or self.get_artwork_details(artwork_id)
                     if details:
                         print(f"正在处理作品ID: {artwork_id}")
-                        # 下载作品
-                        success = self.download_artwork(artwork_id, details)
-                        if success:
-                            print(f"  ✓ 下载成功！")
-                        else:
-                            print(f"  ✗ 下载失败")
-                    
-                    # 添加延时避免请求过于频繁
-                    time.sleep(sleep_time)
+                        self.events.publish(ARTWORK_QUEUED, artwork_id=artwork_id)
+                        futures.append(self.pool.submit(self.download_and_record, artist_id, artwork_id, details))
+                    else:
+                        self.retry_queue.put(f'作品 {artwork_id} 详情', self.retry_artwork, artist_id, artwork_id)
+                
+                # 等待所有下载任务完成，再重试失败队列中的作品
+                self.pool.wait_all(futures)
+                self.retry_failed()
+                self.db.update_download_history(artist_id)
                 
                 return len(artwork_ids)
         
@@ -64,165 +84,156 @@ class PixivArtistCrawler:
         
         return 0
 
-    def get_artwork_details(self, artwork_id):
-        url = f'https://www.pixiv.net/ajax/illust/{artwork_id}'
-        response = self.session.get(url, headers=self.headers)
-        if response.status_code == 200:
-            data = response.json()
-            if data['error'] == False:
-                return data['body']
-        return None
+    def get_artwork_details_batch(self, artist_id, artwork_ids):
+        """通过 profile/illusts 接口每次获取 BATCH_SIZE 个作品的元数据，返回 {作品ID: 详情}
 
-    def download_artwork(self, artwork_id, details=None):
-        if details is None:
-            details = self.get_artwork_details(artwork_id)
-        
-        if details:
+        缓存中已有的作品直接使用缓存；请求失败的作品不在返回结果中，由调用方单独获取详情。
+        """
+        results = {}
+        missing = []
+        for artwork_id in artwork_ids:
+            details = self.db.get_artwork_details(artwork_id, DETAIL_FIELDS)
+            if details is not None:
+                results[artwork_id] = details
+                self.events.publish(DETAILS_FETCHED, artwork_id=artwork_id, cached=True)
+            else:
+                missing.append(artwork_id)
+
+        for start in range(0, len(missing), BATCH_SIZE):
+            batch = missing[start:start + BATCH_SIZE]
+            params = [('ids[]', artwork_id) for artwork_id in batch]
+            params += [('work_category', 'illustManga'), ('is_first_page', 0), ('lang', 'zh')]
+            url = f'https://www.pixiv.net/ajax/user/{artist_id}/profile/illusts?{urlencode(params)}'
+            print(f'批量获取作品信息 {start + 1}-{start + len(batch)}/{len(missing)}...')
             try:
-                # 检查是否为多页作品
-                if details.get('pageCount', 1) > 1:
-                    # 多页作品需要使用不同的API端点
-                    return self.download_multi_page_artwork(artwork_id, details)
-                else:
-                    # 单页作品直接下载原图
-                    original_url = details['urls']['original']
-                    
-                    # 打印URL以便调试
-                    print(f"  原始图片URL: {original_url}")
-                    
-                    # 确保Referer头部正确设置
-                    custom_headers = {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36',
-                        'Referer': f'https://www.pixiv.net/artworks/{artwork_id}',
-                        'Accept': 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8',
-                        'Accept-Language': 'zh-CN,zh;q=0.9,en-US;q=0.8,en;q=0.7,ja;q=0.6',
-                        'sec-ch-ua': '"Chromium";v="96", "Google Chrome";v="96", ";Not A Brand";v="99"',
-                        'sec-ch-ua-mobile': '?0',
-                        'sec-ch-ua-platform': '"Windows"',
-                        'sec-fetch-dest': 'image',
-                        'sec-fetch-mode': 'no-cors',
-                        'sec-fetch-site': 'cross-site'
-                    }
-                    
-                    # 添加原始Cookie
-                    for key, value in [item.split('=', 1) for item in self.headers.get('Cookie', '').split('; ') if '=' in item]:
-                        custom_headers[key] = value
-                    
-                    title = details.get('title', artwork_id)
-                    # 移除文件名中的非法字符
-                    safe_title = re.sub(r'[\\/*?:"<>|]', "", title)
-                    filename = f"{artwork_id}_{safe_title}.{original_url.split('.')[-1]}"
-                    
-                    # 限制文件名长度
-                    if len(filename) > 200:
-                        filename = f"{artwork_id}.{original_url.split('.')[-1]}"
-                    
-                    print(f"  尝试下载: {filename}")
-                    try:
-                        # 使用会话保持cookie
-                        with requests.Session() as session:
-                            for key, value in custom_headers.items():
-                                session.headers[key] = value
-                                
-                            response = session.get(original_url, timeout=30)
-                            if response.status_code == 200:
-                                file_path = os.path.join(self.save_path, filename)
-                                with open(file_path, 'wb') as f:
-                                    f.write(response.content)
-                                print(f'  下载完成: {filename}, 大小: {len(response.content)} 字节')
-                                return True
-                            else:
-                                print(f'  下载失败: HTTP状态码 {response.status_code}')
-                                print(f'  响应头: {response.headers}')
-                                if response.status_code == 403:
-                                    print('  可能是Referer检查失败或Cookie无效')
-                    except requests.exceptions.RequestException as e:
-                        print(f'  请求异常: {str(e)}')
-            except Exception as e:
-                print(f'处理作品 {artwork_id} 时出错: {str(e)}')
-                import traceback
-                traceback.print_exc()
-        return False
+                response = self.transport.get(url)
+                data = response.json() if response.status_code == 200 else None
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print(f'批量获取作品信息异常: {str(e)}')
+                continue
+            if not data or data['error'] != False:
+                print(f'批量获取作品信息失败: {response.status_code}')
+                continue
 
-    def download_multi_page_artwork(self, artwork_id, details):
-        try:
-            # 获取多页作品的所有页面
-            page_count = details.get('pageCount', 0)
-            title = details.get('title', artwork_id)
-            safe_title = re.sub(r'[\\/*?:"<>|]', "", title)
-            
-            # 打印调试信息
-            print(f"  多页作品, 共 {page_count} 页")
-            
-            # 确保Referer头部正确设置
-            custom_headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36',
-                'Referer': f'https://www.pixiv.net/artworks/{artwork_id}',
-                'Accept': 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8',
-                'Accept-Language': 'zh-CN,zh;q=0.9,en-US;q=0.8,en;q=0.7,ja;q=0.6',
-                'sec-ch-ua': '"Chromium";v="96", "Google Chrome";v="96", ";Not A Brand";v="99"',
-                'sec-ch-ua-mobile': '?0',
-                'sec-ch-ua-platform': '"Windows"',
-                'sec-fetch-dest': 'image',
-                'sec-fetch-mode': 'no-cors',
-                'sec-fetch-site': 'cross-site'
-            }
-            
-            # 添加原始Cookie
-            for key, value in [item.split('=', 1) for item in self.headers.get('Cookie', '').split('; ') if '=' in item]:
-                custom_headers[key] = value
-            
-            # 获取多页作品的图片URL模式
-            original_url = details['urls']['original']
-            print(f"  原始URL: {original_url}")
-            
-            base_url_parts = original_url.rsplit('_p0', 1)
-            if len(base_url_parts) != 2:  # 无法拆分URL
-                print(f"  无法获取多页作品 {artwork_id} 的URL模式")
-                return False
-            
-            base_url = base_url_parts[0]
-            extension = base_url_parts[1]  # 包括.jpg/.png等扩展名
-            
-            success = False
-            for i in range(page_count):
-                page_url = f"{base_url}_p{i}{extension}"
-                short_filename = f"{artwork_id}_p{i}{extension}"
-                
-                print(f"  尝试下载第 {i+1}/{page_count} 页: {page_url}")
-                
+            for artwork_id, work in (data['body'].get('works') or {}).items():
+                details = self.details_from_batch(work)
+                if details:
+                    results[artwork_id] = details
+                    self.events.publish(DETAILS_FETCHED, artwork_id=artwork_id, cached=False)
+        return results
+
+    def details_from_batch(self, work):
+        """把批量接口的作品条目转换成下载所需的详情；原图地址由缩略图地址推出，扩展名待下载时确定"""
+        match = THUMBNAIL_URL.search(work.get('url') or '')
+        if not match:
+            return None
+        original_url = f'https://i.pximg.net/img-original/img/{match.group(1)}/{match.group(2)}_p0.{ORIGINAL_EXTENSIONS[0]}'
+        return {
+            'title': work.get('title'),
+            'pageCount': work.get('pageCount', 1),
+            'urls': {'original': original_url},
+            'tags': {'tags': [{'tag': tag} for tag in work.get('tags', [])]},
+            'createDate': work.get('createDate'),
+            'width': work.get('width'),
+            'height': work.get('height'),
+            'guessed_original': True,
+        }
+
+    def download_guessed_original(self, artist_id, artwork_id, details):
+        """单页作品依次尝试 ORIGINAL_EXTENSIONS 下载原图；成功返回True，所有扩展名都不存在时返回None"""
+        with self.claim('file', artwork_id, 0):
+            base_url = details['urls']['original'].rsplit('.', 1)[0]
+            existing = self.find_downloaded(artwork_id, 0)
+            if existing:
+                # 已有文件的扩展名就是原图的扩展名
+                details['urls']['original'] = f"{base_url}.{existing.rsplit('.', 1)[-1]}"
+                _, filename = self.build_download_jobs(artwork_id, details)[0]
+                self.link_downloaded(existing, os.path.join(self.save_path, filename))
+                return True
+            for misses, extension in enumerate(ORIGINAL_EXTENSIONS):
+                details['urls']['original'] = f'{base_url}.{extension}'
+                url, filename = self.build_download_jobs(artwork_id, details)[0]
+                file_path = os.path.join(self.save_path, filename)
                 try:
-                    with requests.Session() as session:
-                        for key, value in custom_headers.items():
-                            session.headers[key] = value
-                        
-                        response = session.get(page_url, timeout=30)
-                        if response.status_code == 200:
-                            file_path = os.path.join(self.save_path, short_filename)
-                            with open(file_path, 'wb') as f:
-                                f.write(response.content)
-                            print(f'  下载完成: {short_filename}, 大小: {len(response.content)} 字节')
-                            success = True
-                        else:
-                            print(f'  下载失败: HTTP状态码 {response.status_code}')
-                            if response.status_code == 403:
-                                print('  可能是Referer检查失败或Cookie无效')
+                    # 扩展名猜错的404不计为下载失败
+                    response, size = self.transport.download(url, file_path, artwork_id, missing_ok=True)
                 except requests.exceptions.RequestException as e:
                     print(f'  请求异常: {str(e)}')
-                
-                time.sleep(sleep_time)  # 避免请求过快
-            
-            return success
-        except Exception as e:
-            print(f'处理多页作品 {artwork_id} 时出错: {str(e)}')
-            import traceback
-            traceback.print_exc()
+                    self.retry_queue.put(f'作品 {artwork_id} 详情', self.retry_artwork, artist_id, artwork_id)
+                    return False
+                if size is not None:
+                    self.record_downloaded(artwork_id, 0, file_path, size)
+                    print(f'  下载完成: {filename}, 大小: {size} 字节')
+                    self.events.publish(ORIGINAL_GUESSED, artwork_id=artwork_id, misses=misses, success=True)
+                    return True
+                if response.status_code != 404:
+                    print(f'  下载失败: HTTP状态码 {response.status_code}')
+                    self.retry_queue.put(f'作品 {artwork_id} 详情', self.retry_artwork, artist_id, artwork_id)
+                    return False
+            self.events.publish(ORIGINAL_GUESSED, artwork_id=artwork_id, misses=len(ORIGINAL_EXTENSIONS), success=False)
+            return None
+
+    def download_and_record(self, artist_id, artwork_id, details):
+        """下载作品，成功后记录到 artist_works 表供增量同步使用"""
+        if details.get('guessed_original') and details.get('pageCount', 1) <= 1:
+            # 多页作品由 pages 接口得到准确地址，单页作品需要猜测原图扩展名
+            success = self.download_guessed_original(artist_id, artwork_id, details)
+            if success is None:
+                print(f'  作品 {artwork_id} 的原图扩展名无法确定，获取完整详情')
+                details = self.get_artwork_details(artwork_id)
+                if not details:
+                    self.retry_queue.put(f'作品 {artwork_id} 详情', self.retry_artwork, artist_id, artwork_id)
+                success = bool(details) and self.download_artwork(artwork_id, details)
+            self.report_artwork(artwork_id, success)
+        else:
+            success = self.download_and_report(artwork_id, details)
+        if success:
+            self.db.record_artist_work(artist_id, artwork_id, details)
+        return success
+
+    def retry_artwork(self, artist_id, artwork_id):
+        """重新获取详情失败的作品并下载"""
+        details = self.get_artwork_details(artwork_id)
+        if not details:
+            self.retry_queue.put(f'作品 {artwork_id} 详情', self.retry_artwork, artist_id, artwork_id)
             return False
+        self.events.publish(ARTWORK_QUEUED, artwork_id=artwork_id)
+        return self.download_and_record(artist_id, artwork_id, details)
+
+    def get_artwork_details(self, artwork_id):
+        with self.claim('details', artwork_id):
+            # 画师模式不需要收藏数等统计数据，缓存中的详情长期有效
+            details = self.db.get_artwork_details(artwork_id, DETAIL_FIELDS)
+            if details is not None:
+                self.events.publish(DETAILS_FETCHED, artwork_id=artwork_id, cached=True)
+                return details
+        
+            url = f'https://www.pixiv.net/ajax/illust/{artwork_id}'
+            try:
+                response = self.transport.get(url)
+            except requests.exceptions.RequestException as e:
+                print(f'作品 {artwork_id} 详情请求异常: {str(e)}')
+                return None
+            if response.status_code == 200:
+                data = response.json()
+                if data['error'] == False:
+                    self.db.save_artwork_details(artwork_id, data['body'])
+                    self.events.publish(DETAILS_FETCHED, artwork_id=artwork_id, cached=False)
+                    return data['body']
+            return None
 
 def main():
     # 创建命令行参数解析器
     parser = argparse.ArgumentParser(description='Pixiv作者作品爬虫 - 爬取指定作者的所有作品')
     parser.add_argument('--cookie', '-c', type=str, help='Pixiv的Cookie，留空则使用配置文件中的值')
+    parser.add_argument('--incremental', '-i', action='store_true', help='增量同步：只下载上次同步后新增的作品')
+    parser.add_argument('--workers', '-w', type=int, default=default_workers, help=f'并发下载线程数（默认: {default_workers}）')
+    parser.add_argument('--progress-interval', type=float, default=STATUS_INTERVAL, help=f'在标准错误输出进度状态行的间隔秒数，0为不输出（默认: {STATUS_INTERVAL:g}）')
+    parser.add_argument('--metrics', type=str, help='指标文件路径，.json为JSON快照，其他扩展名为Prometheus文本格式')
+    parser.add_argument('--record', type=str, metavar='DIR', help='录制模式：把所有API和图片响应保存到指定目录，供之后离线回放')
+    parser.add_argument('--replay', type=str, metavar='DIR', help='回放模式：从录制目录返回响应，不访问Pixiv')
+    parser.add_argument('--replay-speed', type=float, default=1.0, help='回放速度倍数，1为按录制时的耗时，0为不等待（默认: 1）')
+    parser.add_argument('--metrics-interval', type=float, default=EXPORT_INTERVAL, help=f'爬取过程中写出指标文件的间隔秒数，0为只在结束时写出（默认: {EXPORT_INTERVAL:g}）')
     
     # 解析命令行参数
     args = parser.parse_args()
@@ -248,16 +259,37 @@ def main():
     # 使用命令行参数或配置文件中的值
     cookie = args.cookie if args.cookie else default_cookie
     
-    if not cookie:
+    if not cookie and not args.replay:
         print('错误：未找到Cookie配置。请在config.ini文件中设置cookie，或通过命令行参数提供。')
         return
     
+    # 录制或回放时使用单独的传输层和空数据库
+    transport = db = workdir = save_path = store = None
+    if args.record or args.replay:
+        transport, db, workdir = cassette_transport(cookie, args.record, args.replay, args.replay_speed)
+        if args.replay:
+            save_path = os.path.join(workdir, 'images')
+            store = BlobStore(os.path.join(workdir, '.blobs'))
+    
     # 初始化爬虫
-    crawler = PixivArtistCrawler(cookie)
+    crawler = PixivArtistCrawler(cookie, save_path, workers=args.workers, transport=transport, db=db, store=store)
     
     # 开始爬取
     print(f'\n开始爬取作者 {artist_id} 的作品...')
-    artwork_count = crawler.get_artist_artworks(artist_id)
+    reporter = ProgressReporter(args.progress_interval).start() if args.progress_interval > 0 else None
+    # 按接口类别统计延迟、响应大小、状态码和限速等待时间
+    exporter = MetricsExporter(args.metrics, args.metrics_interval).start() if args.metrics else None
+    try:
+        artwork_count = crawler.get_artist_artworks(artist_id, incremental=args.incremental)
+    finally:
+        # 爬取出错时也要停止进度和指标线程，并写出最后一次指标
+        crawler.shutdown()
+        if reporter:
+            reporter.stop()
+        if exporter:
+            exporter.stop()
+        if workdir:
+            close_cassette_transport(transport, db, workdir)
     
     # 显示爬取结果
     print(f'\n爬取完成！共处理了 {artwork_count} 个作品')
@@ -0,0 +1,258 @@
+import os
+import re
+import time
+
+import requests
+
+from PixivCrawlerPool import DownloadPool, default_workers, get_shared_inflight
+from PixivCrawlerTransport import get_shared_transport
+from PixivCrawlerDB import get_shared_database, file_sha1
+from PixivCrawlerStore import get_shared_store, link_file
+from PixivCrawlerRetry import RetryQueue
+from PixivCrawlerEvents import get_event_bus, FILE_WRITTEN, ARTWORK_FINISHED
+
+# 爬取结束后重试失败任务的最大轮数
+RETRY_ROUNDS = 3
+
+class PixivBaseCrawler:
+    """画师爬虫和标签爬虫共用的初始化与下载逻辑"""
+
+    def __init__(self, cookie, save_path=None, workers=default_workers, transport=None, db=None, store=None):
+        # 共享的HTTP传输层（连接池、请求头、Cookie）
+        self.transport = transport if transport else get_shared_transport(cookie)
+        self.session = self.transport.session
+        self.headers = self.transport.api_headers
+        # 使用传入的保存路径或默认路径
+        self.save_path = save_path if save_path else 'pixiv_images'
+        if not os.path.exists(self.save_path):
+            os.makedirs(self.save_path)
+        # 下载线程池；多页作品的各页在单独的线程池中并发下载，避免作品任务等待页面任务时占满线程
+        self.pool = DownloadPool(workers)
+        self.page_pool = DownloadPool(workers, name='pixiv-page')
+        # 作品详情缓存与已下载文件索引（pixiv_data.db）
+        self.db = db if db else get_shared_database()
+        # 按内容哈希保存图片，各保存目录中的文件是指向它的硬链接
+        self.store = store if store else get_shared_store()
+        # 同一进程中多个爬虫同时处理的作品
+        self.inflight = get_shared_inflight()
+        # 重试后仍失败的任务，爬取结束时再处理一轮
+        self.retry_queue = RetryQueue()
+        # 下载进度等事件的发布通道（图形界面订阅）
+        self.events = get_event_bus()
+
+    def claim(self, *key):
+        """其他爬虫正在处理同一作品时等待其完成，之后命中详情缓存或已下载文件索引，不再重复请求"""
+        return self.inflight.hold(key)
+
+    def filename_suffix(self, details):
+        """单页作品文件名中标题之后的附加部分，由子类决定"""
+        return ''
+
+    def build_download_jobs(self, artwork_id, details):
+        """根据作品详情生成待下载的 (图片URL, 文件名) 列表，无法解析URL时返回空列表"""
+        page_count = details.get('pageCount', 1)
+        original_url = details['urls']['original']
+
+        if page_count <= 1:
+            suffix = self.filename_suffix(details)
+            title = details.get('title', artwork_id)
+            # 移除文件名中的非法字符
+            safe_title = re.sub(r'[\\/*?:"<>|]', "", title)
+            filename = f"{artwork_id}_{safe_title}{suffix}.{original_url.split('.')[-1]}"
+
+            # 限制文件名长度
+            if len(filename) > 200:
+                filename = f"{artwork_id}{suffix}.{original_url.split('.')[-1]}"
+            return [(original_url, filename)]
+
+        # 多页作品优先使用 pages 接口返回的每页URL，各页扩展名可以不同
+        pages = self.get_artwork_pages(artwork_id, details)
+        if pages:
+            return [(page_url, f"{artwork_id}_p{i}.{page_url.split('.')[-1]}") for i, page_url in enumerate(pages)]
+
+        # 接口失败时按第一页的URL推测其余页面
+        base_url_parts = original_url.rsplit('_p0', 1)
+        if len(base_url_parts) != 2:  # 无法拆分URL
+            return []
+
+        base_url = base_url_parts[0]
+        extension = base_url_parts[1]  # 包括.jpg/.png等扩展名
+        return [(f"{base_url}_p{i}{extension}", f"{artwork_id}_p{i}{extension}") for i in range(page_count)]
+
+    def get_artwork_pages(self, artwork_id, details):
+        """通过 /ajax/illust/{id}/pages 一次获取多页作品每一页的原图URL，并写入详情缓存；失败时返回None"""
+        if 'pages' in details:
+            return details['pages']
+        cached = self.db.get_artwork_details(artwork_id, ('pages',))
+        if cached is not None:
+            details['pages'] = cached['pages']
+            return details['pages']
+        url = f'https://www.pixiv.net/ajax/illust/{artwork_id}/pages'
+        try:
+            response = self.transport.get(url)
+            data = response.json() if response.status_code == 200 else None
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f'  获取作品 {artwork_id} 的分页信息异常: {str(e)}')
+            return None
+        if not data or data['error'] != False:
+            print(f'  获取作品 {artwork_id} 的分页信息失败')
+            return None
+        return self.save_artwork_pages(artwork_id, details, data['body'])
+
+    def save_artwork_pages(self, artwork_id, details, pages_body):
+        """从 pages 接口的返回中取出原图URL；缓存中只写入分页列表，details可能是由批量接口推测的"""
+        pages = [page['urls']['original'] for page in pages_body]
+        details['pages'] = pages
+        self.db.save_artwork_details(artwork_id, {'pages': pages})
+        return pages
+
+    def find_downloaded(self, artwork_id, page, file_path=None):
+        """查询已下载文件索引，文件仍然存在时返回其路径；指定file_path时在该位置创建指向已有文件的链接"""
+        existing = self.db.find_downloaded_file(artwork_id, page)
+        if existing:
+            if file_path:
+                self.link_downloaded(existing, file_path)
+            else:
+                print(f'  第 {page} 页已下载过，跳过: {existing}')
+        return existing
+
+    def link_downloaded(self, existing, file_path):
+        """已在其他目录下载过的图片不再下载，在本次的保存目录中创建硬链接"""
+        if os.path.exists(file_path):
+            print(f'  已下载过，跳过: {file_path}')
+            return
+        try:
+            method = link_file(existing, file_path)
+        except OSError as e:
+            print(f'  已下载过，链接失败: {file_path} {str(e)}')
+            return
+        print(f'  已下载过，{"复制" if method == "copy" else "链接"}自: {existing}')
+
+    def record_downloaded(self, artwork_id, page, file_path, size):
+        """放入内容存储并记录到已下载文件索引，然后发布文件写入事件"""
+        started = time.monotonic()
+        sha1 = file_sha1(file_path)
+        try:
+            self.store.add(file_path, sha1)
+        except OSError as e:
+            print(f'  放入内容存储失败: {str(e)}')
+        self.db.record_downloaded_file(artwork_id, page, file_path, size, sha1)
+        self.events.publish(FILE_WRITTEN, artwork_id=artwork_id, page=page, path=file_path, size=size,
+                            latency=time.monotonic() - started)
+
+    def download_file(self, artwork_id, url, filename, page=0):
+        """下载单个图片文件，成功（或索引中已有）返回True"""
+        with self.claim('file', artwork_id, page):
+            file_path = os.path.join(self.save_path, filename)
+            if self.find_downloaded(artwork_id, page, file_path):
+                return True
+            try:
+                # 使用共享传输层复用连接，流式写入临时文件后原子重命名
+                response, size = self.transport.download(url, file_path, artwork_id)
+                if size is not None:
+                    self.record_downloaded(artwork_id, page, file_path, size)
+                    print(f'  下载完成: {filename}, 大小: {size} 字节')
+                    return True
+                print(f'  下载失败: HTTP状态码 {response.status_code}')
+                if response.status_code == 403:
+                    print('  可能是Referer检查失败或Cookie无效')
+            except requests.exceptions.RequestException as e:
+                print(f'  请求异常: {str(e)}')
+            self.retry_queue.put(f'作品 {artwork_id} 第 {page} 页', self.download_file, artwork_id, url, filename, page)
+            return False
+
+    def shutdown(self):
+        """等待并关闭下载线程池"""
+        self.pool.shutdown()
+        self.page_pool.shutdown()
+
+    def retry_failed(self, rounds=RETRY_ROUNDS):
+        """爬取结束后把重试队列中的任务再执行最多rounds轮，返回成功的任务数
+
+        重试的任务返回True才算成功；重试中再次失败或新加入队列的任务留到下一轮，
+        最后一轮后仍在队列中的任务列为失败。
+        """
+        succeeded = 0
+        for round_number in range(1, rounds + 1):
+            items = self.retry_queue.drain()
+            if not items:
+                return succeeded
+            print(f'第 {round_number} 轮重试 {len(items)} 个失败的任务...')
+            round_succeeded = 0
+            for description, func, args in items:
+                try:
+                    if func(*args) is True:
+                        round_succeeded += 1
+                except Exception as e:
+                    print(f'重试 {description} 时出错: {str(e)}')
+            succeeded += round_succeeded
+            print(f'第 {round_number} 轮重试完成，成功 {round_succeeded} 个')
+
+        remaining = self.retry_queue.drain()
+        if remaining:
+            print(f'仍有 {len(remaining)} 个任务失败:')
+            for description, _, _ in remaining:
+                print(f'  {description}')
+        return succeeded
+
+    def download_and_report(self, artwork_id, details):
+        """在下载线程中下载作品并输出结果"""
+        success = self.download_artwork(artwork_id, details)
+        self.report_artwork(artwork_id, success)
+        return success
+
+    def report_artwork(self, artwork_id, success):
+        """输出作品的下载结果并发布完成事件"""
+        if success:
+            print(f"  ✓ 作品 {artwork_id} 下载成功！")
+        else:
+            print(f"  ✗ 作品 {artwork_id} 下载失败")
+        self.events.publish(ARTWORK_FINISHED, artwork_id=artwork_id, success=success)
+
+    def download_artwork(self, artwork_id, details=None):
+        if details is None:
+            details = self.get_artwork_details(artwork_id)
+
+        if details:
+            try:
+                # 检查是否为多页作品
+                if details.get('pageCount', 1) > 1:
+                    return self.download_multi_page_artwork(artwork_id, details)
+
+                # 单页作品直接下载原图
+                original_url, filename = self.build_download_jobs(artwork_id, details)[0]
+
+                # 打印URL以便调试
+                print(f"  原始图片URL: {original_url}")
+                print(f"  尝试下载: {filename}")
+                return self.download_file(artwork_id, original_url, filename)
+            except Exception as e:
+                print(f'处理作品 {artwork_id} 时出错: {str(e)}')
+                import traceback
+                traceback.print_exc()
+        return False
+
+    def download_multi_page_artwork(self, artwork_id, details):
+        try:
+            page_count = details.get('pageCount', 0)
+
+            # 打印调试信息
+            print(f"  多页作品, 共 {page_count} 页")
+            print(f"  原始URL: {details['urls']['original']}")
+
+            jobs = self.build_download_jobs(artwork_id, details)
+            if not jobs:
+                print(f"  无法获取多页作品 {artwork_id} 的URL模式")
+                return False
+
+            # 各页同时下载，并发数由页面线程池、主机并发上限和限速器共同约束
+            futures = []
+            for i, (page_url, short_filename) in enumerate(jobs):
+                print(f"  尝试下载第 {i+1}/{len(jobs)} 页: {page_url}")
+                futures.append(self.page_pool.submit(self.download_file, artwork_id, page_url, short_filename, i))
+            return self.page_pool.wait_all(futures) > 0
+        except Exception as e:
+            print(f'处理多页作品 {artwork_id} 时出错: {str(e)}')
+            import traceback
+            traceback.print_exc()
+            return False
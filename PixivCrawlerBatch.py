@@ -0,0 +1,241 @@
+import argparse
+import configparser
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from PixivCrawlerPool import default_workers, FairScheduler
+from PixivCrawlerTag import PixivTagCrawler, DEFAULT_SEARCH_OPTIONS
+from PixivCrawlerArtist import PixivArtistCrawler
+from PixivCrawlerTransport import get_shared_transport
+from PixivCrawlerProgress import ProgressReporter, STATUS_INTERVAL, format_duration
+from PixivCrawlerMetrics import MetricsExporter, EXPORT_INTERVAL
+
+# 任务的默认参数
+DEFAULT_MIN_BOOKMARKS = 1000
+DEFAULT_MAX_PAGES = 5
+# 同时运行的任务数
+DEFAULT_CONCURRENT_JOBS = 2
+
+STATE_NAMES = {
+    'waiting': '等待中',
+    'running': '运行中',
+    'done': '已完成',
+    'failed': '出错',
+}
+
+class BatchJob:
+    """任务文件中的一个标签或画师"""
+
+    def __init__(self, kind, target, min_bookmarks=DEFAULT_MIN_BOOKMARKS, max_pages=DEFAULT_MAX_PAGES,
+                 incremental=False, search_options=None):
+        self.kind = kind
+        self.target = str(target)
+        self.min_bookmarks = min_bookmarks
+        self.max_pages = max_pages
+        self.incremental = incremental
+        self.search_options = search_options or {}
+        self.name = f'{kind}:{self.target}'
+        self.state = 'waiting'
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.lane = None
+
+    def save_dir(self, root, date):
+        """与图形界面相同的保存目录命名"""
+        return os.path.join(root, f'{self.kind}_{self.target}_{date}')
+
+def parse_job(item):
+    """解析任务文件中的一项，格式错误时抛出ValueError"""
+    if 'tag' in item:
+        search_options = {key: item[key] for key in DEFAULT_SEARCH_OPTIONS if key in item}
+        return BatchJob('tag', item['tag'], int(item.get('min_bookmarks', DEFAULT_MIN_BOOKMARKS)),
+                        int(item.get('max_pages', DEFAULT_MAX_PAGES)), search_options=search_options)
+    if 'artist' in item:
+        return BatchJob('artist', item['artist'], incremental=bool(item.get('incremental', False)))
+    raise ValueError(f'任务缺少 tag 或 artist 字段: {item}')
+
+def load_jobs(path):
+    """读取JSON任务文件：任务列表，或包含 jobs 列表的对象"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('jobs', [])
+    jobs = [parse_job(item) for item in data]
+    names = [job.name for job in jobs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f'任务重复: {", ".join(duplicates)}')
+    return jobs
+
+class BatchRunner:
+    """在一个进程中并发运行多个标签和画师任务
+
+    所有任务共用一个传输层（连接池、限速器、熔断器）和已下载文件索引；
+    作品和分页的下载在两个公平调度的线程池中按任务轮转执行；
+    两个任务遇到同一作品时由爬虫的 claim 保证只请求和下载一次。
+    """
+
+    def __init__(self, cookie, jobs, concurrent_jobs=DEFAULT_CONCURRENT_JOBS, workers=default_workers, save_root='pixiv_images',
+                 transport=None, db=None, store=None):
+        self.cookie = cookie
+        self.jobs = jobs
+        self.concurrent_jobs = max(1, int(concurrent_jobs))
+        self.workers = workers
+        self.save_root = save_root
+        self.transport = transport if transport else get_shared_transport(cookie)
+        self.db = db
+        self.store = store
+        self.date = datetime.now().strftime('%Y%m%d')
+        self.artwork_scheduler = None
+        self.page_scheduler = None
+
+    def create_crawler(self, job):
+        save_path = job.save_dir(self.save_root, self.date)
+        if job.kind == 'tag':
+            crawler = PixivTagCrawler(self.cookie, save_path, workers=1, transport=self.transport, db=self.db,
+                                      search_options=job.search_options, store=self.store)
+        else:
+            crawler = PixivArtistCrawler(self.cookie, save_path, workers=1, transport=self.transport, db=self.db, store=self.store)
+        # 用公平调度器中该任务的队列代替爬虫自己的线程池
+        crawler.shutdown()
+        job.lane = self.artwork_scheduler.lane(job.name)
+        crawler.pool = job.lane
+        crawler.page_pool = self.page_scheduler.lane(job.name)
+        return crawler
+
+    def run_job(self, job):
+        job.state = 'running'
+        job.started = time.monotonic()
+        try:
+            crawler = self.create_crawler(job)
+            print(f'\n[任务] 开始 {job.name}')
+            if job.kind == 'tag':
+                crawler.crawl_tag_artworks(tag=job.target, min_bookmarks=job.min_bookmarks, max_pages=job.max_pages)
+            else:
+                crawler.get_artist_artworks(job.target, incremental=job.incremental)
+            job.state = 'done'
+        except Exception as e:
+            job.state = 'failed'
+            job.error = str(e)
+            print(f'[任务] {job.name} 出错: {str(e)}')
+        finally:
+            job.finished = time.monotonic()
+
+    def run(self):
+        # 作品任务会等待其分页任务，两类任务使用不同的线程池，避免互相占满线程
+        self.artwork_scheduler = FairScheduler(self.workers, name='pixiv-batch')
+        self.page_scheduler = FairScheduler(self.workers, name='pixiv-batch-page')
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrent_jobs, thread_name_prefix='pixiv-job') as executor:
+                list(executor.map(self.run_job, self.jobs))
+        finally:
+            self.artwork_scheduler.shutdown()
+            self.page_scheduler.shutdown()
+
+    def status_lines(self):
+        """每个任务一行的进度：状态、已完成/已提交的作品数和用时"""
+        lines = []
+        for job in self.jobs:
+            parts = [f'{job.name} {STATE_NAMES[job.state]}']
+            if job.lane is not None:
+                stats = job.lane.stats()
+                parts.append(f"作品 {stats.get('succeeded', 0)}/{stats.get('submitted', 0)}")
+                pending = stats.get('submitted', 0) - stats.get('finished', 0)
+                if pending:
+                    parts.append(f'排队 {pending}')
+            if job.started is not None:
+                parts.append(f'用时 {format_duration((job.finished or time.monotonic()) - job.started)}')
+            if job.error:
+                parts.append(job.error)
+            lines.append(' | '.join(parts))
+        return lines
+
+class BatchReporter:
+    """定时在标准错误输出每个任务的进度"""
+
+    def __init__(self, runner, interval=STATUS_INTERVAL, stream=None):
+        self.runner = runner
+        self.interval = interval
+        self.stream = stream if stream else sys.stderr
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='pixiv-batch-progress', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def report(self):
+        for line in self.runner.status_lines():
+            print(f'[任务] {line}', file=self.stream)
+        self.stream.flush()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.report()
+
+def main():
+    parser = argparse.ArgumentParser(description='Pixiv批量爬虫 - 按任务文件同时爬取多个标签和画师')
+    parser.add_argument('jobs', type=str, help='JSON任务文件，如 [{"tag": "喜多郁代", "min_bookmarks": 1000, "max_pages": 5}, {"artist": "114514"}]')
+    parser.add_argument('--cookie', '-c', type=str, help='Pixiv的Cookie，留空则使用配置文件中的值')
+    parser.add_argument('--jobs', '-j', dest='concurrent_jobs', type=int, default=DEFAULT_CONCURRENT_JOBS, help=f'同时运行的任务数（默认: {DEFAULT_CONCURRENT_JOBS}）')
+    parser.add_argument('--workers', '-w', type=int, default=default_workers, help=f'所有任务共用的下载线程数（默认: {default_workers}）')
+    parser.add_argument('--save-root', type=str, default='pixiv_images', help='保存目录，每个任务保存在其中的 tag_标签_日期 或 artist_画师ID_日期 目录（默认: pixiv_images）')
+    parser.add_argument('--progress-interval', type=float, default=STATUS_INTERVAL, help=f'在标准错误输出进度的间隔秒数，0为不输出（默认: {STATUS_INTERVAL:g}）')
+    parser.add_argument('--metrics', type=str, help='指标文件路径，.json为JSON快照，其他扩展名为Prometheus文本格式')
+    parser.add_argument('--metrics-interval', type=float, default=EXPORT_INTERVAL, help=f'爬取过程中写出指标文件的间隔秒数，0为只在结束时写出（默认: {EXPORT_INTERVAL:g}）')
+    args = parser.parse_args()
+
+    try:
+        jobs = load_jobs(args.jobs)
+    except (OSError, ValueError) as e:
+        print(f'错误：无法读取任务文件 {args.jobs} ({str(e)})')
+        return
+    if not jobs:
+        print('任务文件中没有任务')
+        return
+
+    # 从配置文件读取cookie
+    config = configparser.ConfigParser()
+    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.ini')
+    default_cookie = ''
+    if os.path.exists(config_path):
+        config.read(config_path)
+        default_cookie = config.get('Pixiv', 'cookie', fallback='')
+    cookie = args.cookie if args.cookie else default_cookie
+    if not cookie:
+        print('错误：未找到Cookie配置。请在config.ini文件中设置cookie，或通过命令行参数提供。')
+        return
+
+    runner = BatchRunner(cookie, jobs, args.concurrent_jobs, args.workers, args.save_root)
+    print(f'共 {len(jobs)} 个任务，同时运行 {runner.concurrent_jobs} 个，共用 {args.workers} 个下载线程')
+    reporter = job_reporter = None
+    if args.progress_interval > 0:
+        reporter = ProgressReporter(args.progress_interval).start()
+        job_reporter = BatchReporter(runner, args.progress_interval).start()
+    exporter = MetricsExporter(args.metrics, args.metrics_interval).start() if args.metrics else None
+    try:
+        runner.run()
+    finally:
+        if reporter:
+            reporter.stop()
+            job_reporter.stop()
+        if exporter:
+            exporter.stop()
+
+    failed = [job for job in jobs if job.state == 'failed']
+    print(f'\n全部任务完成，{len(jobs) - len(failed)} 个成功，{len(failed)} 个出错')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,417 @@
+import argparse
+import collections
+import contextlib
+import http.server
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+from PixivCrawlerPool import default_workers
+from PixivCrawlerDB import PixivDatabase
+from PixivCrawlerStore import BlobStore
+from PixivCrawlerTransport import PixivTransport
+from PixivCrawlerRateLimit import AdaptiveRateLimiter, ENDPOINT_RATES, classify_endpoint
+from PixivCrawlerProgress import ProgressAggregator, format_bytes
+
+# 模拟服务器的默认设置
+MOCK_WORKS = 200
+MOCK_LATENCY = 0.05
+MOCK_IMAGE_SIZE = (100 * 1024, 1000 * 1024)
+MOCK_MULTI_PAGE_RATIO = 0.2
+# 合成图片内容的随机数据块大小
+BLOCK_SIZE = 256 * 1024
+# 搜索接口每页的作品数，与Pixiv一致
+SEARCH_PAGE_SIZE = 60
+# 模拟的画师ID和标签，任意画师ID和标签都返回同一批作品
+BENCHMARK_ARTIST = '1'
+BENCHMARK_TAG = 'benchmark'
+BENCHMARK_BOOKMARKS = 1000
+# 不限速时限速器的速率（每秒请求数），只测量爬虫本身的开销
+UNLIMITED_RATES = {endpoint: {'rate': 10000.0, 'max_rate': 10000.0} for endpoint in ENDPOINT_RATES}
+
+IMAGE_PATH = re.compile(r'/img-original/img/[\d/]+/(\d+)_p(\d+)\.(\w+)$')
+FIRST_ARTWORK_ID = 100000
+
+class MockArtwork:
+    """模拟作品：收藏数、页数、扩展名和图片大小都由作品ID确定，每次运行结果相同"""
+
+    def __init__(self, artwork_id, seed, multi_page_ratio, image_size):
+        rng = random.Random(seed * 1000003 + artwork_id)
+        self.id = str(artwork_id)
+        self.bookmarks = rng.randint(0, 5000)
+        self.page_count = rng.randint(2, 5) if rng.random() < multi_page_ratio else 1
+        self.extensions = [rng.choice(('jpg', 'png')) for _ in range(self.page_count)]
+        self.sizes = [rng.randint(*image_size) for _ in range(self.page_count)]
+
+    def image_url(self, page):
+        return f'https://i.pximg.net/img-original/img/2024/01/01/00/00/00/{self.id}_p{page}.{self.extensions[page]}'
+
+    def search_item(self):
+        return {'id': self.id, 'title': f'作品{self.id}', 'aiType': 1, 'pageCount': self.page_count,
+                'tags': ['オリジナル'], 'userId': BENCHMARK_ARTIST}
+
+    def details(self):
+        return {
+            'id': self.id,
+            'illustId': self.id,
+            'title': f'作品{self.id}',
+            'userId': BENCHMARK_ARTIST,
+            'bookmarkCount': self.bookmarks,
+            'viewCount': self.bookmarks * 10,
+            'pageCount': self.page_count,
+            'aiType': 1,
+            'createDate': '2024-01-01T00:00:00+09:00',
+            'width': 1200,
+            'height': 1600,
+            'tags': {'tags': [{'tag': 'オリジナル'}]},
+            'urls': {'original': self.image_url(0)},
+        }
+
+    def batch_item(self):
+        return {
+            'id': self.id,
+            'title': f'作品{self.id}',
+            'pageCount': self.page_count,
+            'tags': ['オリジナル'],
+            'createDate': '2024-01-01T00:00:00+09:00',
+            'width': 1200,
+            'height': 1600,
+            'url': f'https://i.pximg.net/c/250x250_80_a2/img-master/img/2024/01/01/00/00/00/{self.id}_p0_square1200.jpg',
+        }
+
+    def pages(self):
+        return [{'urls': {'original': self.image_url(page)}, 'width': 1200, 'height': 1600}
+                for page in range(self.page_count)]
+
+class MockRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        path = urlparse(self.path).path
+        endpoint = server.classify(path)
+        if server.latency:
+            time.sleep(random.uniform(0.5, 1.5) * server.latency)
+
+        roll = random.random()
+        if roll < server.throttle_rate:
+            return self.send_json(endpoint, 429, {'error': True, 'message': 'Too Many Requests'},
+                                  {'Retry-After': f'{server.retry_after:g}'})
+        if roll < server.throttle_rate + server.error_rate:
+            return self.send_json(endpoint, 503, {'error': True, 'message': 'Service Unavailable'})
+
+        if endpoint == 'image':
+            return self.send_image(path)
+        body = server.api_body(path, parse_qs(urlparse(self.path).query))
+        if body is None:
+            return self.send_json(endpoint, 404, {'error': True, 'message': 'Not Found', 'body': []})
+        self.send_json(endpoint, 200, {'error': False, 'message': '', 'body': body})
+
+    def send_json(self, endpoint, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.write_body(body)
+        self.server.record(endpoint, status, len(body))
+
+    def send_image(self, path):
+        match = IMAGE_PATH.search(path)
+        artwork = self.server.artworks.get(match.group(1)) if match else None
+        page = int(match.group(2)) if match else 0
+        if artwork is None or page >= artwork.page_count or artwork.extensions[page] != match.group(3):
+            # 画师模式猜测的扩展名不对时返回404，与真实CDN一致
+            return self.send_json('image', 404, {'error': True})
+
+        size = artwork.sizes[page]
+        start = 0
+        range_match = re.match(r'bytes=(\d+)-', self.headers.get('Range') or '')
+        if range_match and int(range_match.group(1)) < size:
+            start = int(range_match.group(1))
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{size - 1}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'image/png' if match.group(3) == 'png' else 'image/jpeg')
+        self.send_header('Content-Length', str(size - start))
+        self.send_header('ETag', f'"{artwork.id}-{page}-{size}"')
+        self.end_headers()
+        self.write_body(self.server.image_body(artwork.id, page, size), start)
+        self.server.record('image', 206 if start else 200, size - start)
+
+    def write_body(self, body, start=0):
+        """按带宽限制分块发送响应体"""
+        bandwidth = self.server.bandwidth
+        chunk_size = 64 * 1024
+        started = time.monotonic()
+        sent = 0
+        for offset in range(start, len(body), chunk_size):
+            chunk = body[offset:offset + chunk_size]
+            self.wfile.write(chunk)
+            sent += len(chunk)
+            if bandwidth:
+                delay = sent / bandwidth - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+class MockPixivServer(http.server.ThreadingHTTPServer):
+    """模拟Pixiv的本地HTTP服务器，提供爬虫用到的搜索、作品、画师接口和图片CDN
+
+    latency为每个响应的平均延迟（秒），bandwidth为每个连接的带宽（字节/秒，0为不限），
+    error_rate和throttle_rate分别为返回503和429的概率；图片内容按作品ID合成，大小在image_size范围内。
+    """
+
+    daemon_threads = True
+
+    def __init__(self, works=MOCK_WORKS, latency=MOCK_LATENCY, bandwidth=0, error_rate=0.0, throttle_rate=0.0,
+                 retry_after=1.0, image_size=MOCK_IMAGE_SIZE, multi_page_ratio=MOCK_MULTI_PAGE_RATIO, seed=1, port=0):
+        super().__init__(('127.0.0.1', port), MockRequestHandler)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.artworks = collections.OrderedDict()
+        for artwork_id in range(FIRST_ARTWORK_ID, FIRST_ARTWORK_ID + works):
+            artwork = MockArtwork(artwork_id, seed, multi_page_ratio, image_size)
+            self.artworks[artwork.id] = artwork
+        # 图片内容由随机数据块重复组成，开头写入作品ID和页码，不同图片内容不同
+        self.block = random.Random(seed).getrandbits(8 * BLOCK_SIZE).to_bytes(BLOCK_SIZE, 'little')
+        self.counts = collections.Counter()
+        self.bytes_sent = collections.Counter()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name='pixiv-mock-server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # 爬虫关闭连接或放弃下载时不输出错误
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def classify(self, path):
+        if path.startswith('/img-original/'):
+            return 'image'
+        return classify_endpoint(f'https://www.pixiv.net{path}') or 'other'
+
+    def record(self, endpoint, status, size):
+        with self.lock:
+            self.counts[(endpoint, status)] += 1
+            self.bytes_sent[endpoint] += size
+
+    def reset_counts(self):
+        with self.lock:
+            self.counts.clear()
+            self.bytes_sent.clear()
+
+    def api_body(self, path, query):
+        """返回API响应的body部分，不存在的作品返回None"""
+        match = re.match(r'/ajax/search/artworks/[^/]+$', path)
+        if match:
+            page = int(query.get('p', ['1'])[0])
+            artworks = list(self.artworks.values())[(page - 1) * SEARCH_PAGE_SIZE:page * SEARCH_PAGE_SIZE]
+            data = [artwork.search_item() for artwork in artworks]
+            return {'illustManga': {'data': data, 'total': len(self.artworks)}}
+        match = re.match(r'/ajax/user/\d+/profile/all$', path)
+        if match:
+            return {'illusts': {artwork_id: None for artwork_id in self.artworks}, 'manga': {}}
+        match = re.match(r'/ajax/user/\d+/profile/illusts$', path)
+        if match:
+            works = {artwork_id: self.artworks[artwork_id].batch_item()
+                     for artwork_id in query.get('ids[]', []) if artwork_id in self.artworks}
+            return {'works': works}
+        match = re.match(r'/ajax/illust/(\d+)(/pages)?$', path)
+        if match and match.group(1) in self.artworks:
+            artwork = self.artworks[match.group(1)]
+            return artwork.pages() if match.group(2) else artwork.details()
+        return None
+
+    def image_body(self, artwork_id, page, size):
+        header = f'\xff\xd8PIXIVBENCH {artwork_id} {page}\n'.encode('latin-1')
+        repeats = size // len(self.block) + 1
+        return (header + self.block * repeats)[:size]
+
+def peak_rss():
+    """进程的峰值常驻内存（字节），无法获取时返回None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux单位为KB，macOS为字节
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+def run_benchmark(server, mode='tag', engine='sync', workers=default_workers, unlimited=False, verbose=False):
+    """用模拟服务器端到端运行一次爬虫，返回吞吐量、内存和请求数统计
+
+    每次运行使用新的临时目录和数据库，不会命中之前的详情缓存和已下载文件索引。
+    """
+    from PixivCrawlerTag import PixivTagCrawler
+    from PixivCrawlerArtist import PixivArtistCrawler
+
+    server.reset_counts()
+    with tempfile.TemporaryDirectory(prefix='pixiv-benchmark-') as workdir:
+        db = PixivDatabase(os.path.join(workdir, 'pixiv_data.db'))
+        limiter = AdaptiveRateLimiter(UNLIMITED_RATES if unlimited else None)
+        transport = PixivTransport('PHPSESSID=benchmark', limiter=limiter, host_overrides={
+            'www.pixiv.net': server.url,
+            'i.pximg.net': server.url,
+        })
+        save_path = os.path.join(workdir, 'images')
+        store = BlobStore(os.path.join(workdir, '.blobs'))
+        if mode == 'artist':
+            crawler = PixivArtistCrawler(transport.cookie, save_path, workers=workers, transport=transport, db=db, store=store)
+        elif engine == 'async':
+            from PixivCrawlerTagAsync import AsyncPixivTagCrawler
+            crawler = AsyncPixivTagCrawler(transport.cookie, save_path, concurrency=workers, transport=transport, db=db, store=store)
+        else:
+            crawler = PixivTagCrawler(transport.cookie, save_path, workers=workers, transport=transport, db=db, store=store)
+
+        aggregator = ProgressAggregator()
+        pages = (len(server.artworks) + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+        started = time.monotonic()
+        with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+            if mode == 'artist':
+                crawler.get_artist_artworks(BENCHMARK_ARTIST)
+            elif engine == 'pipeline':
+                from PixivCrawlerPipeline import TagPipeline
+                TagPipeline(crawler, download_workers=workers).run(BENCHMARK_TAG, BENCHMARK_BOOKMARKS, pages)
+            else:
+                crawler.crawl_tag_artworks(BENCHMARK_TAG, BENCHMARK_BOOKMARKS, pages)
+        elapsed = time.monotonic() - started
+        crawler.shutdown()
+        transport.close()
+        db.close()
+
+        aggregator.update()
+        stats = aggregator.snapshot()
+        aggregator.close()
+
+    with server.lock:
+        counts = dict(server.counts)
+        bytes_sent = dict(server.bytes_sent)
+    requests_by_endpoint = collections.Counter()
+    for (endpoint, status), count in counts.items():
+        requests_by_endpoint[endpoint] += count
+    return {
+        'mode': mode,
+        'engine': engine if mode == 'tag' else 'sync',
+        'works': len(server.artworks),
+        'elapsed': elapsed,
+        'succeeded': stats['succeeded'],
+        'failed': stats['failed'],
+        'works_per_second': stats['succeeded'] / elapsed if elapsed else 0.0,
+        'bytes': stats['bytes'],
+        'mb_per_second': stats['bytes'] / elapsed / 1024 / 1024 if elapsed else 0.0,
+        'peak_rss': peak_rss(),
+        'requests': sum(requests_by_endpoint.values()),
+        'requests_by_endpoint': dict(requests_by_endpoint),
+        'statuses': {f'{endpoint} {status}': count for (endpoint, status), count in sorted(counts.items())},
+        'bytes_sent': bytes_sent,
+    }
+
+# 与基准结果对比的指标，以及数值越大是否越好
+COMPARED_METRICS = (
+    ('works_per_second', '作品/秒', True),
+    ('mb_per_second', 'MB/秒', True),
+    ('elapsed', '用时(秒)', False),
+    ('requests', '请求数', False),
+    ('peak_rss', '峰值内存', False),
+)
+
+def print_result(result, baseline=None):
+    print(f"\n[{result['mode']} / {result['engine']}] {result['works']} 个模拟作品")
+    print(f"  完成 {result['succeeded']} 个作品，失败 {result['failed']} 个，用时 {result['elapsed']:.2f} 秒")
+    print(f"  吞吐量: {result['works_per_second']:.2f} 作品/秒, {result['mb_per_second']:.2f} MB/秒"
+          f"（共 {format_bytes(result['bytes'])}）")
+    if result['peak_rss'] is not None:
+        print(f"  进程峰值内存: {format_bytes(result['peak_rss'])}")
+    endpoints = ', '.join(f'{endpoint} {count}' for endpoint, count in sorted(result['requests_by_endpoint'].items()))
+    print(f"  请求数: {result['requests']} ({endpoints})")
+    errors = {key: count for key, count in result['statuses'].items() if not key.endswith((' 200', ' 206'))}
+    if errors:
+        print(f"  非200响应: {', '.join(f'{key}: {count}' for key, count in errors.items())}")
+    if baseline:
+        for key, name, higher_is_better in COMPARED_METRICS:
+            old, new = baseline.get(key), result.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            better = change > 0 if higher_is_better else change < 0
+            mark = '' if abs(change) < 1 else ('（变好）' if better else '（变差）')
+            print(f"  与基准对比 {name}: {old:.4g} -> {new:.4g} ({change:+.1f}%){mark}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Pixiv爬虫离线性能测试 - 用本地模拟服务器端到端运行爬虫')
+    parser.add_argument('--mode', choices=['tag', 'artist', 'all'], default='all', help='测试的爬虫：tag为标签爬虫，artist为画师爬虫，all为全部（默认: all）')
+    parser.add_argument('--engine', choices=['sync', 'async', 'pipeline'], default='sync', help='标签爬虫使用的引擎（默认: sync）')
+    parser.add_argument('--workers', '-w', type=int, default=default_workers, help=f'并发下载线程数（默认: {default_workers}）')
+    parser.add_argument('--works', type=int, default=MOCK_WORKS, help=f'模拟的作品数量（默认: {MOCK_WORKS}）')
+    parser.add_argument('--latency', type=float, default=MOCK_LATENCY, help=f'每个响应的平均延迟秒数（默认: {MOCK_LATENCY:g}）')
+    parser.add_argument('--bandwidth', type=float, default=0, help='每个连接的带宽（MB/秒），0为不限（默认: 0）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回503的概率（默认: 0）')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='返回429的概率（默认: 0）')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='429响应的Retry-After秒数（默认: 1）')
+    parser.add_argument('--image-size', type=int, nargs=2, metavar=('MIN', 'MAX'), default=[size // 1024 for size in MOCK_IMAGE_SIZE], help='图片大小范围（KB，默认: 100 1000）')
+    parser.add_argument('--multi-page-ratio', type=float, default=MOCK_MULTI_PAGE_RATIO, help=f'多页作品的比例（默认: {MOCK_MULTI_PAGE_RATIO:g}）')
+    parser.add_argument('--seed', type=int, default=1, help='生成模拟作品的随机种子（默认: 1）')
+    parser.add_argument('--unlimited', action='store_true', help='不使用默认的限速速率，只测量爬虫本身的开销')
+    parser.add_argument('--output', '-o', type=str, help='把结果保存为JSON文件，可作为之后的基准')
+    parser.add_argument('--baseline', '-b', type=str, help='与之前保存的JSON结果对比')
+    parser.add_argument('--verbose', '-v', action='store_true', help='显示爬虫的输出')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = {(result['mode'], result['engine']): result for result in json.load(f)}
+
+    server = MockPixivServer(
+        works=args.works, latency=args.latency, bandwidth=int(args.bandwidth * 1024 * 1024),
+        error_rate=args.error_rate, throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+        image_size=(args.image_size[0] * 1024, args.image_size[1] * 1024),
+        multi_page_ratio=args.multi_page_ratio, seed=args.seed,
+    ).start()
+    print(f'模拟服务器已启动: {server.url}')
+
+    modes = ['tag', 'artist'] if args.mode == 'all' else [args.mode]
+    results = []
+    try:
+        for mode in modes:
+            result = run_benchmark(server, mode, args.engine, args.workers, args.unlimited, args.verbose)
+            results.append(result)
+            print_result(result, baseline.get((result['mode'], result['engine'])))
+    finally:
+        server.stop()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f'\n结果已保存到: {args.output}')
+
+if __name__ == '__main__':
+    main()
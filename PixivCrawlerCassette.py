@@ -0,0 +1,240 @@
+import collections
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from PixivCrawlerDB import PixivDatabase
+from PixivCrawlerTransport import PixivTransport
+from PixivCrawlerRateLimit import UnlimitedRateLimiter
+from PixivCrawlerRetry import RetryPolicy
+
+# 录制文件中的响应记录和二进制响应体目录
+INDEX_FILE = 'responses.jsonl.gz'
+BLOB_DIR = 'blobs'
+# 录制时保留的响应头；响应体已经解压，不保留 Content-Encoding
+RECORDED_HEADERS = ('Content-Type', 'Content-Length', 'Content-Range', 'ETag', 'Last-Modified', 'Retry-After')
+# 回放时可以还原的网络异常
+REPLAYABLE_ERRORS = {
+    'ConnectionError': requests.exceptions.ConnectionError,
+    'Timeout': requests.exceptions.Timeout,
+    'ReadTimeout': requests.exceptions.ReadTimeout,
+    'ConnectTimeout': requests.exceptions.ConnectTimeout,
+    'ChunkedEncodingError': requests.exceptions.ChunkedEncodingError,
+}
+
+def is_text(content_type):
+    return (content_type or '').startswith(('application/json', 'text/'))
+
+class Cassette:
+    """磁盘上的录制文件
+
+    目录中的 responses.jsonl.gz 按顺序记录每个响应的状态码、响应头和耗时，JSON响应体直接内嵌；
+    图片等二进制响应体按SHA1存放在 blobs 目录，内容相同的图片只保存一份。请求头（含Cookie）不会被记录。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.index = None
+        self.entries = None
+        self.closed = False
+        self.stats = collections.Counter()
+
+    def blob_path(self, digest):
+        return os.path.join(self.path, BLOB_DIR, digest[:2], digest)
+
+    def open_for_record(self):
+        os.makedirs(os.path.join(self.path, BLOB_DIR), exist_ok=True)
+        self.index = gzip.open(os.path.join(self.path, INDEX_FILE), 'wt', encoding='utf-8')
+        return self
+
+    def record(self, request, response=None, body=None, latency=0.0, duration=0.0, error=None):
+        """追加一条响应记录；error为网络异常的类名"""
+        entry = {'method': request.method, 'url': request.url, 'latency': latency, 'duration': duration}
+        if error is not None:
+            entry['error'] = error
+        else:
+            headers = {name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers}
+            if 'Content-Length' in headers:
+                headers['Content-Length'] = str(len(body))
+            entry.update(status=response.status_code, reason=response.reason, headers=headers)
+            if is_text(headers.get('Content-Type')):
+                entry['body'] = body.decode('utf-8', errors='replace')
+            elif body:
+                entry['blob'] = self.save_blob(body)
+        line = json.dumps(entry, ensure_ascii=False)
+        with self.lock:
+            self.index.write(line + '\n')
+            self.stats['responses'] += 1
+
+    def save_blob(self, body):
+        digest = hashlib.sha1(body).hexdigest()
+        blob_path = self.blob_path(digest)
+        with self.lock:
+            if os.path.exists(blob_path):
+                self.stats['duplicate_blobs'] += 1
+                self.stats['duplicate_bytes'] += len(body)
+                return digest
+            self.stats['blobs'] += 1
+            self.stats['blob_bytes'] += len(body)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        tmp_path = f'{blob_path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, blob_path)
+        return digest
+
+    def load(self):
+        """读取全部响应记录，按 (方法, URL) 分组，同一URL的多次响应按录制顺序回放"""
+        self.entries = collections.defaultdict(collections.deque)
+        with gzip.open(os.path.join(self.path, INDEX_FILE), 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    entry = json.loads(line)
+                    self.entries[(entry['method'], entry['url'])].append(entry)
+            except (EOFError, ValueError):
+                # 录制中断时最后一条记录可能不完整
+                print('录制文件末尾不完整，已忽略')
+        return self
+
+    def next_entry(self, method, url):
+        """取出该请求的下一条记录；录制的次数用完后重复最后一条，没有录制过时返回None"""
+        with self.lock:
+            entries = self.entries.get((method, url))
+            if not entries:
+                self.stats['misses'] += 1
+                return None
+            self.stats['replayed'] += 1
+            return entries.popleft() if len(entries) > 1 else entries[0]
+
+    def read_body(self, entry):
+        if 'body' in entry:
+            return entry['body'].encode('utf-8')
+        if 'blob' in entry:
+            with open(self.blob_path(entry['blob']), 'rb') as f:
+                return f.read()
+        return b''
+
+    def close(self):
+        # 同一个适配器挂载在 http:// 和 https:// 上，关闭会话时会被调用两次
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            index, self.index = self.index, None
+        if index is not None:
+            index.close()
+            stats = self.stats
+            print(f"录制完成: {stats['responses']} 个响应，{stats['blobs']} 个二进制文件"
+                  f"（{stats['blob_bytes'] / 1024 / 1024:.1f} MB），去重 {stats['duplicate_blobs']} 个"
+                  f"（节省 {stats['duplicate_bytes'] / 1024 / 1024:.1f} MB）: {self.path}")
+        elif self.entries is not None and self.stats['misses']:
+            print(f"回放文件中没有录制的请求: {self.stats['misses']} 个")
+
+class RecordingAdapter(HTTPAdapter):
+    """正常发送请求，并把完整响应写入录制文件；流式响应体先读入内存，调用方仍可以按块读取"""
+
+    def __init__(self, cassette, **kwargs):
+        super().__init__(**kwargs)
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        started = time.monotonic()
+        try:
+            response = super().send(request, **kwargs)
+            latency = time.monotonic() - started
+            body = response.content
+        except requests.exceptions.RequestException as e:
+            elapsed = time.monotonic() - started
+            self.cassette.record(request, latency=elapsed, duration=elapsed, error=type(e).__name__)
+            raise
+        self.cassette.record(request, response, body, latency, time.monotonic() - started)
+        return response
+
+    def close(self):
+        super().close()
+        self.cassette.close()
+
+class ReplayAdapter(BaseAdapter):
+    """从录制文件返回响应，不访问网络
+
+    speed为回放速度：1按录制时的耗时返回，2为两倍速，0为不等待。
+    """
+
+    def __init__(self, cassette, speed=1.0):
+        super().__init__()
+        self.cassette = cassette
+        self.speed = speed
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        entry = self.cassette.next_entry(request.method, request.url)
+        if entry is None:
+            print(f'回放文件中没有该请求: {request.method} {request.url}')
+            entry = {'status': 404, 'reason': 'Not Recorded', 'headers': {}}
+        if self.speed > 0 and entry.get('duration'):
+            time.sleep(entry['duration'] / self.speed)
+        if 'error' in entry:
+            error = REPLAYABLE_ERRORS.get(entry['error'], requests.exceptions.ConnectionError)
+            raise error(f"回放录制的网络异常: {entry['error']}", request=request)
+
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.reason = entry.get('reason')
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = io.BytesIO(self.cassette.read_body(entry))
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        self.cassette.close()
+
+def use_cassette(transport, path, mode, speed=1.0):
+    """在传输层的会话上安装录制（record）或回放（replay）适配器，返回录制文件对象；关闭传输层时录制文件随之关闭"""
+    if mode == 'record':
+        cassette = Cassette(path).open_for_record()
+        adapter = RecordingAdapter(cassette, pool_maxsize=transport.pool_size)
+    else:
+        cassette = Cassette(path).load()
+        adapter = ReplayAdapter(cassette, speed)
+    transport.session.mount('https://', adapter)
+    transport.session.mount('http://', adapter)
+    return cassette
+
+def cassette_transport(cookie, record=None, replay=None, speed=1.0):
+    """命令行的 --record / --replay：创建安装了录制或回放适配器的传输层，以及临时目录中的空数据库
+
+    使用空数据库保证录制和回放时都不会命中详情缓存或已下载文件索引，两次运行发出相同的请求。
+    回放时不限速，重试和熔断的等待按回放速度缩短，耗时只由录制的耗时和speed决定。
+    返回 (传输层, 数据库, 临时目录)；回放时图片也保存在临时目录中。
+    """
+    workdir = tempfile.mkdtemp(prefix='pixiv-cassette-')
+    if record:
+        transport = PixivTransport(cookie)
+        use_cassette(transport, record, 'record')
+        print(f'录制模式: 所有响应将保存到 {record}')
+    else:
+        retry = RetryPolicy(time_scale=1.0 / speed if speed > 0 else 0.0)
+        transport = PixivTransport(cookie, limiter=UnlimitedRateLimiter(), retry=retry)
+        use_cassette(transport, replay, 'replay', speed)
+        print(f'回放模式: 从 {replay} 回放（{speed:g} 倍速）')
+    return transport, PixivDatabase(os.path.join(workdir, 'pixiv_data.db')), workdir
+
+def close_cassette_transport(transport, db, workdir):
+    """关闭传输层（同时写完录制文件）和临时数据库，删除临时目录"""
+    transport.close()
+    db.close()
+    shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,283 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+DEFAULT_DB_PATH = 'pixiv_data.db'
+
+# 作品详情缓存中各字段的有效期（秒）：统计数据会过时，未列出的字段（标题、图片URL、标签等）几乎不会变化
+FIELD_TTLS = {
+    'bookmarkCount': 24 * 3600,
+    'likeCount': 24 * 3600,
+    'viewCount': 24 * 3600,
+    'commentCount': 24 * 3600,
+}
+IMMUTABLE_TTL = 30 * 24 * 3600
+
+# 从下载目录重建索引时识别的文件名：多页作品 {id}_p{页码}.扩展名，单页作品 {id}_标题….扩展名
+MULTI_PAGE_FILENAME = re.compile(r'^(\d+)_p(\d+)\.\w+$')
+SINGLE_PAGE_FILENAME = re.compile(r'^(\d+)[_.]')
+# 未完成下载留下的临时文件
+PARTIAL_SUFFIXES = ('.part', '.part.json', '.tmp')
+
+# 详情中与下载无关的大字段，不写入缓存
+DROPPED_FIELDS = ('userIllusts', 'noLoginData', 'zoneConfig', 'extraData', 'fanboxPromotion')
+
+def file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def parse_artwork_filename(filename):
+    """从下载的文件名解析 (作品ID, 页码)，无法识别时返回None"""
+    if filename.endswith(PARTIAL_SUFFIXES):
+        return None
+    match = MULTI_PAGE_FILENAME.match(filename)
+    if match:
+        return match.group(1), int(match.group(2))
+    match = SINGLE_PAGE_FILENAME.match(filename)
+    if match:
+        return match.group(1), 0
+    return None
+
+def field_ttl(field):
+    return FIELD_TTLS.get(field, IMMUTABLE_TTL)
+
+class PixivDatabase:
+    """pixiv_data.db 的访问封装，多个下载线程共用一个连接"""
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.create_tables()
+
+    def create_tables(self):
+        with self.lock, self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS download_history (
+                    artist_id INTEGER PRIMARY KEY,
+                    last_update TEXT NOT NULL
+                )
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS artist_works (
+                    work_id TEXT PRIMARY KEY,
+                    title TEXT,
+                    user_id TEXT,
+                    tags TEXT,
+                    create_date TEXT,
+                    width INTEGER,
+                    height INTEGER,
+                    bookmarks INTEGER,
+                    views INTEGER,
+                    image_urls TEXT
+                )
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS downloaded_files (
+                    work_id TEXT NOT NULL,
+                    page INTEGER NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    sha1 TEXT NOT NULL,
+                    PRIMARY KEY (work_id, page)
+                )
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS artwork_details (
+                    work_id TEXT PRIMARY KEY,
+                    body TEXT NOT NULL,
+                    fetched_at REAL NOT NULL
+                )
+            ''')
+            # 旧版本的缓存表没有逐字段的获取时间
+            columns = [row[1] for row in self.conn.execute('PRAGMA table_info(artwork_details)')]
+            if 'field_times' not in columns:
+                self.conn.execute('ALTER TABLE artwork_details ADD COLUMN field_times TEXT')
+
+    def load_artwork_details(self, work_id):
+        """返回缓存的 (详情, 各字段获取时间)，没有缓存时返回 (None, {})；调用者需持有self.lock"""
+        row = self.conn.execute(
+            'SELECT body, fetched_at, field_times FROM artwork_details WHERE work_id = ?', (str(work_id),)
+        ).fetchone()
+        if row is None:
+            return None, {}
+        body, fetched_at, field_times = row
+        body = json.loads(body)
+        if body.get('guessed_original'):
+            # 旧版本可能写入过由批量接口推测的详情，视为没有缓存
+            return None, {}
+        # 旧记录只有整条的获取时间
+        times = json.loads(field_times) if field_times else dict.fromkeys(body, fetched_at)
+        return body, times
+
+    def get_artwork_details(self, work_id, fields=None):
+        """读取缓存的作品详情；所需字段中任一字段缺失或过期时返回None，fields为None表示缓存中的全部字段"""
+        with self.lock:
+            body, times = self.load_artwork_details(work_id)
+        if body is None:
+            return None
+        now = time.time()
+        for field in (body if fields is None else fields):
+            if field not in body or now - times.get(field, 0) > field_ttl(field):
+                return None
+        return body
+
+    def save_artwork_details(self, work_id, details):
+        """把详情合并进缓存，只更新本次写入字段的获取时间；由批量接口推测的详情不写入"""
+        if details.get('guessed_original'):
+            return
+        now = time.time()
+        with self.lock, self.conn:
+            body, times = self.load_artwork_details(work_id)
+            body = body or {}
+            for key, value in details.items():
+                if key not in DROPPED_FIELDS:
+                    body[key] = value
+                    times[key] = now
+            self.conn.execute(
+                'INSERT OR REPLACE INTO artwork_details (work_id, body, fetched_at, field_times) VALUES (?, ?, ?, ?)',
+                (str(work_id), json.dumps(body, ensure_ascii=False), now, json.dumps(times))
+            )
+
+    def get_recorded_work_ids(self, artist_id):
+        """返回已记录为下载过的该画师作品ID集合"""
+        with self.lock:
+            rows = self.conn.execute('SELECT work_id FROM artist_works WHERE user_id = ?', (str(artist_id),)).fetchall()
+        return {row[0] for row in rows}
+
+    def record_artist_work(self, artist_id, work_id, details):
+        """把下载完成的作品记录到 artist_works 表"""
+        tags = [tag.get('tag', '') for tag in details.get('tags', {}).get('tags', [])]
+        with self.lock, self.conn:
+            self.conn.execute(
+                '''INSERT OR REPLACE INTO artist_works
+                   (work_id, title, user_id, tags, create_date, width, height, bookmarks, views, image_urls)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                (
+                    str(work_id),
+                    details.get('title'),
+                    str(artist_id),
+                    json.dumps(tags, ensure_ascii=False),
+                    details.get('createDate'),
+                    details.get('width'),
+                    details.get('height'),
+                    details.get('bookmarkCount'),
+                    details.get('viewCount'),
+                    json.dumps(details.get('urls', {})),
+                )
+            )
+
+    def get_last_update(self, artist_id):
+        with self.lock:
+            row = self.conn.execute('SELECT last_update FROM download_history WHERE artist_id = ?', (int(artist_id),)).fetchone()
+        return row[0] if row else None
+
+    def update_download_history(self, artist_id):
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO download_history (artist_id, last_update) VALUES (?, ?)',
+                (int(artist_id), datetime.now().isoformat(timespec='seconds'))
+            )
+
+    def find_downloaded_file(self, work_id, page):
+        """查询已下载文件索引；文件已被删除或大小不符时清除记录并返回None"""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT path, size FROM downloaded_files WHERE work_id = ? AND page = ?', (str(work_id), page)
+            ).fetchone()
+        if row is None:
+            return None
+        path, size = row
+        if os.path.isfile(path) and os.path.getsize(path) == size:
+            return path
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM downloaded_files WHERE work_id = ? AND page = ?', (str(work_id), page))
+        return None
+
+    def record_downloaded_file(self, work_id, page, path, size, sha1):
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO downloaded_files (work_id, page, path, size, sha1) VALUES (?, ?, ?, ?, ?)',
+                (str(work_id), page, path, size, sha1)
+            )
+
+    def get_referenced_sha1s(self):
+        """返回已下载文件索引中文件仍然存在的SHA1集合"""
+        with self.lock:
+            rows = self.conn.execute('SELECT path, sha1 FROM downloaded_files').fetchall()
+        return {sha1 for path, sha1 in rows if os.path.isfile(path)}
+
+    def rebuild_file_index(self, root='pixiv_images'):
+        """扫描下载目录，根据文件名重建已下载文件索引，返回索引的文件数"""
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM downloaded_files')
+        count = 0
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                parsed = parse_artwork_filename(filename)
+                if parsed is None:
+                    continue
+                work_id, page = parsed
+                path = os.path.join(dirpath, filename)
+                self.record_downloaded_file(work_id, page, path, os.path.getsize(path), file_sha1(path))
+                count += 1
+        return count
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+_shared_databases = {}
+_shared_lock = threading.Lock()
+
+def get_shared_database(db_path=DEFAULT_DB_PATH):
+    """按路径返回进程内共享的数据库对象"""
+    with _shared_lock:
+        db = _shared_databases.get(db_path)
+        if db is None:
+            db = PixivDatabase(db_path)
+            _shared_databases[db_path] = db
+        return db
+
+def main():
+    parser = argparse.ArgumentParser(description='Pixiv爬虫数据库维护')
+    parser.add_argument('--db', type=str, default=DEFAULT_DB_PATH, help=f'数据库文件路径（默认: {DEFAULT_DB_PATH}）')
+    parser.add_argument('--rebuild-index', action='store_true', help='扫描下载目录，重建已下载文件索引')
+    parser.add_argument('--dedupe', action='store_true', help='把下载目录中内容相同的文件转换为指向内容存储的硬链接，并清除不再被引用的内容')
+    parser.add_argument('--root', type=str, default='pixiv_images', help='下载目录（默认: pixiv_images）')
+    args = parser.parse_args()
+
+    db = PixivDatabase(args.db)
+    if args.rebuild_index:
+        print(f'正在扫描 {args.root} 重建已下载文件索引...')
+        count = db.rebuild_file_index(args.root)
+        print(f'索引重建完成，共 {count} 个文件')
+    if args.dedupe:
+        from PixivCrawlerStore import BlobStore
+        store = BlobStore(os.path.join(args.root, '.blobs'))
+        print(f'正在扫描 {args.root} 合并重复文件...')
+        # reflink不增加链接数，用索引和扫描到的文件判断内容是否仍被引用
+        referenced = db.get_referenced_sha1s()
+        stats = store.dedupe_tree(args.root, referenced)
+        removed, freed = store.prune(referenced)
+        print(f"去重完成: 共 {stats['files']} 个文件，新存入 {stats['stored']} 个，合并重复 {stats['deduplicated']} 个，"
+              f"释放 {stats['saved_bytes'] / 1024 / 1024:.1f} MB")
+        if stats['failed']:
+            print(f"  {stats['failed']} 个文件无法建立链接（可能与 {store.root} 不在同一文件系统）")
+        if removed:
+            print(f'  清除不再被引用的内容 {removed} 个，释放 {freed / 1024 / 1024:.1f} MB')
+    if not args.rebuild_index and not args.dedupe:
+        parser.print_help()
+    db.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import queue
+import threading
+import time
+
+# 图片文件下载完成并重命名到最终路径，数据: artwork_id, page, path, size, latency（计算哈希并写入索引的耗时）
+FILE_WRITTEN = 'file_written'
+# 一次下载尝试把数据写入磁盘，数据: path, bytes, latency（累计写入耗时）
+DISK_WRITE = 'disk_write'
+
+# 爬取进度事件
+# 一次HTTP请求返回响应头或失败，数据: url, endpoint, status（失败时为None）, latency, bytes（响应体大小，未知时为None）
+REQUEST_FINISHED = 'request_finished'
+# 获取到一页搜索结果或作品列表，数据: page, count
+PAGE_FETCHED = 'page_fetched'
+# 获取到作品详情，数据: artwork_id, cached
+DETAILS_FETCHED = 'details_fetched'
+# 作品被筛掉，数据: artwork_id, reason, stage（search为搜索结果初筛，details为详情筛选）
+ARTWORK_FILTERED = 'artwork_filtered'
+# 作品通过筛选进入下载队列 / 作品的所有页面处理完毕，数据: artwork_id（, success）
+ARTWORK_QUEUED = 'artwork_queued'
+ARTWORK_FINISHED = 'artwork_finished'
+# 单个文件开始下载 / 下载结束，数据: artwork_id, url（, bytes, latency, success）
+DOWNLOAD_STARTED = 'download_started'
+DOWNLOAD_FINISHED = 'download_finished'
+# 画师模式按批量信息猜测单页作品的原图扩展名，数据: artwork_id, misses（猜错的次数）,
+# success（False表示所有扩展名都不存在，改为请求完整详情）
+ORIGINAL_GUESSED = 'original_guessed'
+
+class Subscription(queue.Queue):
+    """一个订阅者的事件队列，dropped 为队列满时被丢弃的事件数"""
+
+    def __init__(self, maxsize=0):
+        super().__init__(maxsize)
+        self.dropped = 0
+        self.dropped_lock = threading.Lock()
+
+    def count_dropped(self):
+        with self.dropped_lock:
+            self.dropped += 1
+
+class EventBus:
+    """线程安全的事件通道：爬虫线程发布事件，每个订阅者从自己的队列中取出，互不影响"""
+
+    def __init__(self):
+        self.subscribers = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, maxsize=1000):
+        """注册一个订阅者，返回其事件队列；队列满时丢弃最旧的事件并计入 dropped，发布方不会被阻塞"""
+        subscriber = Subscription(maxsize=maxsize)
+        with self.lock:
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def publish(self, event_type, **data):
+        event = dict(data, type=event_type, time=time.time())
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            while True:
+                try:
+                    subscriber.put_nowait(event)
+                    break
+                except queue.Full:
+                    try:
+                        subscriber.get_nowait()
+                        subscriber.count_dropped()
+                    except queue.Empty:
+                        pass
+
+def drain(subscriber):
+    """非阻塞地取出队列中已有的全部事件"""
+    events = []
+    while True:
+        try:
+            events.append(subscriber.get_nowait())
+        except queue.Empty:
+            return events
+
+_shared_bus = None
+_shared_lock = threading.Lock()
+
+def get_event_bus():
+    """返回进程内共享的事件通道"""
+    global _shared_bus
+    with _shared_lock:
+        if _shared_bus is None:
+            _shared_bus = EventBus()
+        return _shared_bus
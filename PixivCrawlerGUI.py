@@ -3,40 +3,125 @@ from tkinter import ttk, scrolledtext, messagebox
 import threading
 from PixivCrawlerArtist import PixivArtistCrawler
 from PixivCrawlerTag import PixivTagCrawler
-import queue
+from PixivCrawlerPool import default_workers
+from PixivCrawlerEvents import get_event_bus, drain, FILE_WRITTEN
+from PixivCrawlerThumbs import ThumbnailLoader
+from PixivCrawlerProgress import ProgressAggregator
+import collections
+import logging
+from logging.handlers import RotatingFileHandler
 import sys
-from PIL import Image, ImageTk
+from PIL import ImageTk
 import os
-import time
-import re
 from datetime import datetime
-import glob
 import subprocess  # 添加这行
 import json
 
-class RedirectText:
-    def __init__(self, text_widget):
+# 日志窗口最多保留的行数
+MAX_LOG_LINES = 5000
+# 完整日志文件，按大小轮转
+LOG_FILE = 'pixiv_crawler.log'
+LOG_FILE_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
+
+# 日志窗口的级别筛选
+LOG_LEVELS = {
+    '全部': logging.INFO,
+    '警告及以上': logging.WARNING,
+    '仅错误': logging.ERROR,
+}
+ERROR_KEYWORDS = ('失败', '异常', '出错', '错误')
+WARNING_KEYWORDS = ('✗', '跳过', '重试', '暂停')
+
+def guess_level(line):
+    """爬虫输出的是普通文本，按关键字推断日志级别"""
+    if any(keyword in line for keyword in ERROR_KEYWORDS):
+        return logging.ERROR
+    if any(keyword in line for keyword in WARNING_KEYWORDS):
+        return logging.WARNING
+    return logging.INFO
+
+class LogConsole:
+    """替代标准输出的日志窗口
+
+    任意线程写入的文本按行缓存，主线程每次定时刷新时批量插入；
+    窗口和内存中最多保留 MAX_LOG_LINES 行，完整日志写入轮转的日志文件。
+    """
+
+    def __init__(self, text_widget, level=logging.INFO, interval=100):
         self.text_widget = text_widget
-        self.queue = queue.Queue()
-        self.update_timer = None
+        self.level = level
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.partial = ''
+        self.pending = []
+        self.lines = collections.deque(maxlen=MAX_LOG_LINES)
+
+        self.logger = logging.getLogger('pixiv_crawler')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        if not self.logger.handlers:
+            try:
+                handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_FILE_BYTES, backupCount=LOG_FILE_BACKUPS, encoding='utf-8')
+                handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+                self.logger.addHandler(handler)
+            except OSError:
+                pass
+
+        self.text_widget.after(self.interval, self.tick)
 
     def write(self, string):
-        self.queue.put(string)
-        if self.update_timer is None:
-            self.update_timer = self.text_widget.after(100, self.update_text)
-
-    def update_text(self):
-        while not self.queue.empty():
-            string = self.queue.get()
-            self.text_widget.configure(state='normal')
-            self.text_widget.insert(tk.END, string)
-            self.text_widget.see(tk.END)
-            self.text_widget.configure(state='disabled')
-        self.update_timer = None
+        with self.lock:
+            self.partial += string
+            *complete, self.partial = self.partial.split('\n')
+            for line in complete:
+                level = guess_level(line)
+                self.pending.append((level, line))
+                self.logger.log(level, line)
 
     def flush(self):
         pass
 
+    def tick(self):
+        """主线程定时把缓存的行一次性插入窗口"""
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if batch:
+            self.lines.extend(batch)
+            self.insert([line for level, line in batch if level >= self.level])
+        self.text_widget.after(self.interval, self.tick)
+
+    def insert(self, lines):
+        if not lines:
+            return
+        self.text_widget.configure(state='normal')
+        self.text_widget.insert(tk.END, ''.join(line + '\n' for line in lines[-MAX_LOG_LINES:]))
+        # 删除超出上限的最早的行
+        line_count = int(self.text_widget.index('end-1c').split('.')[0]) - 1
+        if line_count > MAX_LOG_LINES:
+            self.text_widget.delete('1.0', f'{line_count - MAX_LOG_LINES + 1}.0')
+        self.text_widget.see(tk.END)
+        self.text_widget.configure(state='disabled')
+
+    def set_level(self, level):
+        """切换筛选级别，用缓存的行重新填充窗口"""
+        self.level = level
+        self.text_widget.configure(state='normal')
+        self.text_widget.delete('1.0', tk.END)
+        self.text_widget.configure(state='disabled')
+        self.insert([line for line_level, line in self.lines if line_level >= level])
+
+    def clear(self):
+        with self.lock:
+            self.pending = []
+        self.lines.clear()
+        self.text_widget.configure(state='normal')
+        self.text_widget.delete('1.0', tk.END)
+        self.text_widget.configure(state='disabled')
+
+# 预览支持的图片格式
+PREVIEW_EXTENSIONS = ('.jpg', '.png', '.jpeg')
+
 class PixivCrawlerGUI:
     def __init__(self, root):
         self.root = root
@@ -103,21 +188,50 @@ class PixivCrawlerGUI:
         self.artist_id_entry = ttk.Entry(self.artist_frame, textvariable=self.artist_id_var, width=30)
         self.artist_id_entry.grid(row=0, column=1, sticky=(tk.W, tk.E))
         
+        # 增量同步
+        self.incremental_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.artist_frame, text="增量同步（只下载新作品）",
+                        variable=self.incremental_var).grid(row=1, column=1, sticky=tk.W)
+        
+        # 通用设置框架
+        self.options_frame = ttk.LabelFrame(self.control_frame, text="下载设置", padding="5")
+        self.options_frame.grid(row=5, column=0, columnspan=2, sticky=(tk.W, tk.E))
+        
+        # 并发下载线程数
+        ttk.Label(self.options_frame, text="下载线程数:").grid(row=0, column=0, sticky=tk.W)
+        self.workers_var = tk.StringVar(value=str(default_workers))
+        self.workers_entry = ttk.Entry(self.options_frame, textvariable=self.workers_var, width=10)
+        self.workers_entry.grid(row=0, column=1, sticky=tk.W)
+        
+        # 日志窗口显示的级别
+        ttk.Label(self.options_frame, text="日志级别:").grid(row=1, column=0, sticky=tk.W)
+        self.log_level_var = tk.StringVar(value='全部')
+        self.log_level_combo = ttk.Combobox(self.options_frame, textvariable=self.log_level_var,
+                                            values=list(LOG_LEVELS), state='readonly', width=10)
+        self.log_level_combo.grid(row=1, column=1, sticky=tk.W)
+        self.log_level_combo.bind('<<ComboboxSelected>>', self.change_log_level)
+        
         # 控制按钮框架
         self.button_frame = ttk.Frame(self.control_frame)
-        self.button_frame.grid(row=5, column=0, columnspan=2, pady=10)
+        self.button_frame.grid(row=6, column=0, columnspan=2, pady=10)
         
         # 开始/暂停按钮
         self.start_button = ttk.Button(self.button_frame, text="开始爬取", command=self.toggle_crawling)
         self.start_button.grid(row=0, column=0, padx=5)
         
+        # 实时进度状态行
+        self.status_var = tk.StringVar(value="")
+        ttk.Label(self.button_frame, textvariable=self.status_var).grid(row=0, column=1, padx=5, sticky=tk.W)
+        self.progress = None
+        self.progress_active = False
+        
         # 暂停标志
         self.is_paused = False
         self.is_running = False
         
         # 输出框
         self.output_text = scrolledtext.ScrolledText(self.control_frame, height=15, width=80)
-        self.output_text.grid(row=6, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.output_text.grid(row=7, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S))
         self.output_text.configure(state='disabled')
         
         # 右侧预览面板
@@ -147,8 +261,9 @@ class PixivCrawlerGUI:
         self.main_frame.grid_columnconfigure(1, weight=1)
         self.main_frame.grid_rowconfigure(0, weight=1)
         
-        # 重定向标准输出到文本框
-        sys.stdout = RedirectText(self.output_text)
+        # 重定向标准输出到日志窗口
+        self.log_console = LogConsole(self.output_text)
+        sys.stdout = self.log_console
         
         # 初始化显示
         self.toggle_mode()
@@ -158,9 +273,12 @@ class PixivCrawlerGUI:
         self.tag_entry.insert(0, "喜多郁代")
         self.filter_tags_text.insert(tk.END, "AIイラスト")
         
-        # 添加预览刷新定时器
+        # 添加预览刷新定时器，预览只处理爬虫发布的文件写入事件
         self.preview_timer = None
         self.last_preview_path = None
+        self.file_events = get_event_bus().subscribe()
+        # 缩略图在后台线程中解码，带内存和磁盘缓存
+        self.thumbnails = ThumbnailLoader()
         
         # 开始预览刷新
         self.start_preview_refresh()
@@ -238,55 +356,61 @@ class PixivCrawlerGUI:
         self.start_button.configure(text="继续爬取" if self.is_paused else "暂停爬取")
         print(f"爬虫已{'暂停' if self.is_paused else '继续'}")
 
+    def change_log_level(self, event=None):
+        self.log_console.set_level(LOG_LEVELS[self.log_level_var.get()])
+
     def start_preview_refresh(self):
         """开始定期刷新预览"""
         self.refresh_preview()
-        self.preview_timer = self.root.after(1000, self.start_preview_refresh)  # 每秒刷新一次
+        self.preview_timer = self.root.after(200, self.start_preview_refresh)
 
     def refresh_preview(self):
-        """刷新预览图片"""
+        """取出新的文件写入事件，预览其中最新的一张图片；开销与图库大小无关"""
         try:
-            # 获取最新的图片文件
-            image_files = []
-            for ext in ['*.jpg', '*.png', '*.jpeg']:
-                image_files.extend(glob.glob(os.path.join('pixiv_images', '**', ext), recursive=True))
+            latest_image = None
+            for event in drain(self.file_events):
+                if event['type'] == FILE_WRITTEN and event['path'].lower().endswith(PREVIEW_EXTENSIONS):
+                    latest_image = event['path']
             
-            if image_files:
-                # 按修改时间排序，获取最新的图片
-                latest_image = max(image_files, key=os.path.getmtime)
-                
-                # 如果图片路径发生变化，更新预览
-                if latest_image != self.last_preview_path:
-                    self.last_preview_path = latest_image
-                    self.update_preview(latest_image)
+            # 如果图片路径发生变化，更新预览
+            if latest_image and latest_image != self.last_preview_path:
+                self.last_preview_path = latest_image
+                self.update_preview(latest_image)
+            self.show_thumbnails()
+            # 爬取结束后再刷新一次状态行，之后保持不变
+            if self.progress and (self.is_running or self.progress_active):
+                self.progress.update()
+                self.status_var.set(self.progress.status_line())
+                self.progress_active = self.is_running
         except Exception as e:
             print(f"预览刷新失败: {str(e)}")
 
     def update_preview(self, image_path):
-        """更新预览图片"""
-        try:
-            # 打开并调整图片大小
-            image = Image.open(image_path)
-            # 计算调整后的尺寸，保持宽高比
-            width, height = image.size
-            max_size = (400, 400)
-            ratio = min(max_size[0]/width, max_size[1]/height)
-            new_size = (int(width*ratio), int(height*ratio))
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
-            
-            # 转换为PhotoImage
-            photo = ImageTk.PhotoImage(image)
-            
-            # 更新预览
-            self.preview_label.configure(image=photo)
-            self.preview_label.image = photo  # 保持引用
-            
-            # 更新预览信息
-            filename = os.path.basename(image_path)
-            folder = os.path.basename(os.path.dirname(image_path))
-            self.preview_info.configure(text=f"文件夹: {folder}\n文件名: {filename}")
-        except Exception as e:
-            print(f"预览更新失败: {str(e)}")
+        """请求后台线程生成缩略图，完成后由 show_thumbnails 显示"""
+        self.thumbnails.request(image_path)
+
+    def show_thumbnails(self):
+        """在主线程中显示后台线程生成好的缩略图"""
+        for image_path, image, error in drain(self.thumbnails.results):
+            if image_path != self.last_preview_path:
+                continue
+            if error:
+                print(f"预览更新失败: {error}")
+                continue
+            try:
+                # 转换为PhotoImage
+                photo = ImageTk.PhotoImage(image)
+                
+                # 更新预览
+                self.preview_label.configure(image=photo)
+                self.preview_label.image = photo  # 保持引用
+                
+                # 更新预览信息
+                filename = os.path.basename(image_path)
+                folder = os.path.basename(os.path.dirname(image_path))
+                self.preview_info.configure(text=f"文件夹: {folder}\n文件名: {filename}")
+            except Exception as e:
+                print(f"预览更新失败: {str(e)}")
 
     def open_current_folder(self):
         """打开当前下载文件夹"""
@@ -317,9 +441,12 @@ class PixivCrawlerGUI:
         self.is_running = True
         self.is_paused = False
         self.start_button.configure(text="暂停爬取")
-        self.output_text.configure(state='normal')
-        self.output_text.delete("1.0", tk.END)
-        self.output_text.configure(state='disabled')
+        self.log_console.clear()
+        
+        # 每次爬取重新统计进度
+        if self.progress:
+            self.progress.close()
+        self.progress = ProgressAggregator()
         
         # 禁用打开文件夹按钮，直到新的下载开始
         self.open_folder_button.configure(state='disabled')
@@ -334,6 +461,8 @@ class PixivCrawlerGUI:
             cookie = self.cookie_text.get("1.0", tk.END).strip()
             mode = self.mode_var.get()
             
+            workers = int(self.workers_var.get())
+            
             # 创建保存目录
             current_date = datetime.now().strftime("%Y%m%d")
             if mode == "tag":
@@ -346,7 +475,7 @@ class PixivCrawlerGUI:
                 min_bookmarks = int(self.min_bookmarks_var.get())
                 max_pages = int(self.max_pages_var.get())
                 
-                crawler = PixivTagCrawler(cookie, self.current_save_dir)
+                crawler = PixivTagCrawler(cookie, self.current_save_dir, workers=workers)
                 # 启用打开文件夹按钮
                 self.open_folder_button.configure(state='normal')
                 crawler.crawl_tag_artworks(tag=tag, min_bookmarks=min_bookmarks, max_pages=max_pages)
@@ -357,10 +486,12 @@ class PixivCrawlerGUI:
                     return
                 
                 self.current_save_dir = f"pixiv_images/artist_{artist_id}_{current_date}"
-                crawler = PixivArtistCrawler(cookie, self.current_save_dir)
+                crawler = PixivArtistCrawler(cookie, self.current_save_dir, workers=workers)
                 # 启用打开文件夹按钮
                 self.open_folder_button.configure(state='normal')
-                crawler.get_artist_artworks(artist_id)
+                crawler.get_artist_artworks(artist_id, incremental=self.incremental_var.get())
+            
+            crawler.shutdown()
                 
         except Exception as e:
             print(f"发生错误: {str(e)}")
@@ -373,6 +504,7 @@ class PixivCrawlerGUI:
         """清理定时器并保存配置"""
         if self.preview_timer:
             self.root.after_cancel(self.preview_timer)
+        get_event_bus().unsubscribe(self.file_events)
         self.save_config()
 
 def main():
@@ -0,0 +1,242 @@
+import bisect
+import collections
+import json
+import os
+import threading
+import time
+
+from PixivCrawlerEvents import get_event_bus, drain, REQUEST_FINISHED, DOWNLOAD_FINISHED, DISK_WRITE, FILE_WRITTEN, ORIGINAL_GUESSED
+from PixivCrawlerRateLimit import get_shared_limiter
+
+# 直方图的桶上限
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1024, 10240, 102400, 524288, 1048576, 2097152, 5242880, 10485760, 52428800)
+DISK_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+# 定时导出指标文件的间隔（秒）
+EXPORT_INTERVAL = 30.0
+
+METRIC_HELP = {
+    'pixiv_request_latency_seconds': ('histogram', '从发送请求到收到响应头的耗时，按接口类别'),
+    'pixiv_response_bytes': ('histogram', '响应体大小，按接口类别'),
+    'pixiv_responses_total': ('counter', '响应数量，按接口类别和状态码（error为网络错误）'),
+    'pixiv_download_seconds': ('histogram', '单个图片文件的完整传输耗时（含重试）'),
+    'pixiv_disk_write_seconds': ('histogram', '写入图片分段文件并重命名的耗时'),
+    'pixiv_file_index_seconds': ('histogram', '计算文件哈希并写入已下载文件索引的耗时'),
+    'pixiv_limiter_sleep_seconds_total': ('counter', '因限速累计等待的秒数，按接口类别'),
+    'pixiv_limiter_rate': ('gauge', '限速器当前允许的每秒请求数，按接口类别'),
+    'pixiv_guessed_originals_total': ('counter', '画师模式猜测原图扩展名的单页作品数，result为hit（猜中）或fallback（改为请求完整详情）'),
+    'pixiv_guess_misses_total': ('counter', '猜测原图扩展名时猜错（CDN返回404）的请求数'),
+    'pixiv_events_dropped_total': ('counter', '指标收集跟不上、因事件队列已满而未计入以上指标的事件数'),
+}
+
+class Histogram:
+    """固定桶的累积直方图"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """返回 [(桶上限, 累计数量)]，最后一个桶上限为 +Inf"""
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q):
+        """按桶估算分位数，返回所在桶的上限；落在最后一个桶时返回最大的有限上限"""
+        if not self.count:
+            return None
+        target = q * self.count
+        for bound, total in self.cumulative():
+            if total >= target:
+                return bound if bound != float('inf') else self.buckets[-1]
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'average': self.sum / self.count if self.count else None,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': {format_bound(bound): total for bound, total in self.cumulative()},
+        }
+
+def format_bound(bound):
+    return '+Inf' if bound == float('inf') else f'{bound:g}'
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+class MetricsCollector:
+    """订阅爬虫事件，按接口类别统计延迟、响应大小、状态码和磁盘写入耗时，并读取限速器的等待时间
+
+    判断瓶颈在搜索接口、作品详情、CDN传输还是磁盘写入。update() 只应在一个线程中调用。
+    """
+
+    def __init__(self, bus=None, limiter=None):
+        self.bus = bus if bus else get_event_bus()
+        self.subscriber = self.bus.subscribe(maxsize=100000)
+        self.limiter = limiter if limiter else get_shared_limiter()
+        self.started = time.time()
+        # 指标名 -> {标签元组: Histogram或计数}
+        self.histograms = collections.defaultdict(dict)
+        self.counters = collections.defaultdict(collections.Counter)
+        self.lock = threading.Lock()
+
+    def observe(self, name, labels, value, buckets):
+        histogram = self.histograms[name].get(labels)
+        if histogram is None:
+            histogram = self.histograms[name][labels] = Histogram(buckets)
+        histogram.observe(value)
+
+    def update(self):
+        events = drain(self.subscriber)
+        with self.lock:
+            for event in events:
+                self.handle(event)
+
+    def handle(self, event):
+        event_type = event['type']
+        if event_type == REQUEST_FINISHED:
+            labels = (('endpoint', event['endpoint'] or 'other'),)
+            status = 'error' if event['status'] is None else str(event['status'])
+            self.counters['pixiv_responses_total'][labels + (('status', status),)] += 1
+            self.observe('pixiv_request_latency_seconds', labels, event['latency'], LATENCY_BUCKETS)
+            # 图片大小按下载完成事件统计，包含续传前已下载的部分
+            if event.get('bytes') is not None and event['endpoint'] != 'image':
+                self.observe('pixiv_response_bytes', labels, event['bytes'], SIZE_BUCKETS)
+        elif event_type == DOWNLOAD_FINISHED:
+            if event['success']:
+                self.observe('pixiv_download_seconds', (), event['latency'], LATENCY_BUCKETS)
+                self.observe('pixiv_response_bytes', (('endpoint', 'image'),), event['bytes'], SIZE_BUCKETS)
+        elif event_type == DISK_WRITE:
+            self.observe('pixiv_disk_write_seconds', (), event['latency'], DISK_BUCKETS)
+        elif event_type == FILE_WRITTEN:
+            if event.get('latency') is not None:
+                self.observe('pixiv_file_index_seconds', (), event['latency'], DISK_BUCKETS)
+        elif event_type == ORIGINAL_GUESSED:
+            result = 'hit' if event['success'] else 'fallback'
+            self.counters['pixiv_guessed_originals_total'][(('result', result),)] += 1
+            self.counters['pixiv_guess_misses_total'][()] += event['misses']
+
+    def limiter_gauges(self):
+        with self.limiter.lock:
+            sleep_seconds = dict(self.limiter.sleep_seconds)
+        return sleep_seconds, self.limiter.rates()
+
+    def to_json(self):
+        """返回JSON格式的指标快照"""
+        sleep_seconds, rates = self.limiter_gauges()
+        with self.lock:
+            snapshot = {
+                'started': self.started,
+                'time': time.time(),
+                'histograms': {
+                    name: {format_labels(labels) or 'all': histogram.to_dict() for labels, histogram in series.items()}
+                    for name, series in self.histograms.items()
+                },
+                'counters': {
+                    name: {format_labels(labels): count for labels, count in series.items()}
+                    for name, series in self.counters.items()
+                },
+            }
+        snapshot['limiter'] = {'sleep_seconds': sleep_seconds, 'rates': rates}
+        snapshot['events_dropped'] = self.subscriber.dropped
+        return json.dumps(snapshot, ensure_ascii=False, indent=2)
+
+    def to_prometheus(self):
+        """返回Prometheus文本格式的指标，可供node_exporter的textfile收集器读取"""
+        sleep_seconds, rates = self.limiter_gauges()
+        lines = []
+
+        def header(name):
+            metric_type, help_text = METRIC_HELP[name]
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+
+        with self.lock:
+            for name, series in sorted(self.histograms.items()):
+                header(name)
+                for labels, histogram in sorted(series.items()):
+                    for bound, total in histogram.cumulative():
+                        lines.append(f'{name}_bucket{format_labels(labels + (("le", format_bound(bound)),))} {total}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum:g}')
+                    lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+            for name, series in sorted(self.counters.items()):
+                header(name)
+                for labels, count in sorted(series.items()):
+                    lines.append(f'{name}{format_labels(labels)} {count}')
+
+        header('pixiv_limiter_sleep_seconds_total')
+        for endpoint, seconds in sorted(sleep_seconds.items()):
+            lines.append(f'pixiv_limiter_sleep_seconds_total{{endpoint="{endpoint}"}} {seconds:g}')
+        header('pixiv_limiter_rate')
+        for endpoint, rate in sorted(rates.items()):
+            lines.append(f'pixiv_limiter_rate{{endpoint="{endpoint}"}} {rate:g}')
+        header('pixiv_events_dropped_total')
+        lines.append(f'pixiv_events_dropped_total {self.subscriber.dropped}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """按扩展名写出指标文件：.json为JSON快照，其他为Prometheus文本格式；先写临时文件再原子替换"""
+        self.update()
+        content = self.to_json() if path.endswith('.json') else self.to_prometheus()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def close(self):
+        self.bus.unsubscribe(self.subscriber)
+
+class MetricsExporter:
+    """爬取过程中定时把指标写到文件，停止时再写一次最终结果"""
+
+    def __init__(self, path, interval=EXPORT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.collector = MetricsCollector()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='pixiv-metrics', daemon=True)
+
+    def start(self):
+        if self.interval > 0:
+            self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.export()
+
+    def export(self):
+        try:
+            self.collector.write(self.path)
+        except OSError as e:
+            print(f'指标文件写入失败: {str(e)}')
+
+    def stop(self):
+        """停止定时导出，写出最终指标"""
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.export()
+        self.collector.close()
+        print(f'指标已写入: {self.path}')
+        if self.collector.subscriber.dropped:
+            print(f'  警告: {self.collector.subscriber.dropped} 个事件因队列已满被丢弃，指标偏少')
@@ -0,0 +1,205 @@
+import os
+import queue
+import threading
+
+import requests
+
+from PixivCrawlerPool import default_workers
+from PixivCrawlerEvents import PAGE_FETCHED, ARTWORK_QUEUED, ARTWORK_FINISHED
+
+# 每个搜索页最多返回的作品数
+PAGE_SIZE = 60
+
+# 队列结束标记
+_STOP = object()
+
+class TagPipeline:
+    """标签爬取流水线：搜索 → 详情 → 下载 → 写入
+
+    各阶段在独立的线程中运行，并发数分别设置；阶段之间用有界队列连接，
+    下游处理不过来时上游会阻塞等待，内存占用保持有界。
+    下载阶段把图片流式写入 .part 分段文件，写入阶段负责校验后重命名到最终文件。
+    每一页从下载开始到写入完成都占用共享的正在处理作品集合中的 ('file', 作品ID, 页码)，
+    同一图片不会被两个线程同时写入同一个分段文件。
+    """
+
+    def __init__(self, crawler, detail_workers=2, download_workers=default_workers, write_workers=1, prefetch_pages=2):
+        self.crawler = crawler
+        self.detail_workers = max(1, int(detail_workers))
+        self.download_workers = max(1, int(download_workers))
+        self.write_workers = max(1, int(write_workers))
+
+        # 搜索结果最多预取 prefetch_pages 页
+        self.id_queue = queue.Queue(maxsize=max(1, int(prefetch_pages)) * PAGE_SIZE)
+        self.download_queue = queue.Queue(maxsize=self.download_workers * 4)
+        self.write_queue = queue.Queue(maxsize=self.write_workers * 16)
+
+        self.lock = threading.Lock()
+        self.downloaded = set()
+        # 已经交给下载阶段的作品，同一作品出现在多个搜索页时只处理一次
+        self.queued = set()
+        self.total = 0
+        # 每个作品尚未处理完的页数，以及是否至少有一页成功
+        self.pending_pages = {}
+        self.page_success = {}
+
+    def run(self, tag, min_bookmarks=1000, max_pages=5):
+        print(f'开始获取标签 "{tag}" 下收藏数超过 {min_bookmarks} 的非AI作品（流水线模式）...')
+
+        search = self.start_stage('search', self.search_stage, 1, tag, min_bookmarks, max_pages)
+        details = self.start_stage('details', self.detail_stage, self.detail_workers, min_bookmarks)
+        downloads = self.start_stage('download', self.download_stage, self.download_workers)
+        writers = self.start_stage('write', self.write_stage, self.write_workers)
+
+        # 上游阶段结束后，向下游队列放入结束标记
+        self.close_stage(search, self.id_queue, self.detail_workers)
+        self.close_stage(details, self.download_queue, self.download_workers)
+        self.close_stage(downloads, self.write_queue, self.write_workers)
+        for thread in writers:
+            thread.join()
+
+        # 重试各阶段失败的作品和图片
+        self.crawler.retry_failed()
+        print(f'该标签下共有 {self.total} 个作品')
+        print(f'爬取完成！共下载 {len(self.downloaded)} 个作品')
+        return len(self.downloaded)
+
+    def start_stage(self, name, target, count, *args):
+        threads = []
+        for i in range(count):
+            thread = threading.Thread(target=target, args=args, name=f'pixiv-{name}-{i}', daemon=True)
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def close_stage(self, threads, next_queue, next_count):
+        for thread in threads:
+            thread.join()
+        for _ in range(next_count):
+            next_queue.put(_STOP)
+
+    def search_stage(self, tag, min_bookmarks, max_pages):
+        """逐页获取搜索结果，作品ID放入详情队列"""
+        for page in range(1, max_pages + 1):
+            print(f'正在获取第{page}页的作品...')
+            data = None
+            try:
+                response = self.crawler.transport.get(self.crawler.search_url(tag, page))
+                data = response.json() if response.status_code == 200 else None
+                if not data or data['error'] != False:
+                    print(f'第 {page} 页请求失败: {response.status_code}')
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print(f'第 {page} 页请求异常: {str(e)}')
+            if not data or data['error'] != False:
+                # 失败的页面在流水线结束后用同步方式重试
+                self.crawler.retry_queue.put(
+                    f'第 {page} 页搜索结果', self.crawler.retry_search_page, tag, min_bookmarks, page
+                )
+                continue
+
+            artworks = data['body']['illustManga']['data']
+            if page == 1:
+                self.total = data['body']['illustManga']['total']
+            print(f"第 {page} 页共找到 {len(artworks)} 个作品")
+            self.crawler.events.publish(PAGE_FETCHED, page=page, count=len(artworks))
+            for artwork_id in self.crawler.select_candidates(artworks):
+                self.id_queue.put(artwork_id)
+
+    def detail_stage(self, min_bookmarks):
+        """获取作品详情并筛选，符合条件的作品拆成逐页的下载任务"""
+        while True:
+            artwork_id = self.id_queue.get()
+            if artwork_id is _STOP:
+                return
+            try:
+                details = self.crawler.get_artwork_details(artwork_id)
+                if not details:
+                    self.crawler.retry_queue.put(
+                        f'作品 {artwork_id} 详情', self.crawler.retry_artwork, artwork_id, min_bookmarks
+                    )
+                elif self.crawler.check_artwork(artwork_id, details, min_bookmarks) is None:
+                    with self.lock:
+                        if artwork_id in self.queued:
+                            print(f"  作品 {artwork_id} 已在下载队列中，跳过")
+                            continue
+                        self.queued.add(artwork_id)
+                    jobs = self.crawler.build_download_jobs(artwork_id, details)
+                    if not jobs:
+                        print(f"  无法获取多页作品 {artwork_id} 的URL模式")
+                    else:
+                        with self.lock:
+                            self.pending_pages[artwork_id] = len(jobs)
+                            self.page_success[artwork_id] = False
+                        self.crawler.events.publish(ARTWORK_QUEUED, artwork_id=artwork_id)
+                    for page, (url, filename) in enumerate(jobs):
+                        self.download_queue.put((artwork_id, page, url, filename))
+            except Exception as e:
+                print(f'处理作品 {artwork_id} 时出错: {str(e)}')
+
+    def download_stage(self):
+        """把图片传输到分段文件，完成后交给写入阶段"""
+        while True:
+            job = self.download_queue.get()
+            if job is _STOP:
+                return
+            artwork_id, page, url, filename = job
+            file_path = os.path.join(self.crawler.save_path, filename)
+            # 由写入阶段（或本阶段失败时）释放
+            key, owner = ('file', artwork_id, page), object()
+            self.crawler.inflight.acquire(key, owner)
+            try:
+                # 已下载文件索引中存在的图片不再传输
+                if self.crawler.find_downloaded(artwork_id, page, file_path):
+                    self.crawler.inflight.release(key, owner)
+                    self.page_done(artwork_id, True)
+                    continue
+                response, size = self.crawler.transport.download(url, file_path, artwork_id, finalize=False)
+                if size is not None:
+                    self.write_queue.put((artwork_id, page, url, filename, file_path, size, owner))
+                    continue
+                print(f'  下载失败: {filename}, HTTP状态码 {response.status_code}')
+            except requests.exceptions.RequestException as e:
+                print(f'  请求异常: {filename} {str(e)}')
+            except Exception as e:
+                print(f'  下载出错: {filename} {str(e)}')
+            self.crawler.inflight.release(key, owner)
+            self.retry_page(artwork_id, page, url, filename)
+
+    def write_stage(self):
+        """把完成的分段文件重命名为最终文件，并记录到已下载文件索引"""
+        while True:
+            job = self.write_queue.get()
+            if job is _STOP:
+                return
+            artwork_id, page, url, filename, file_path, size, owner = job
+            try:
+                self.crawler.transport.finalize_download(file_path)
+                self.crawler.record_downloaded(artwork_id, page, file_path, size)
+            except OSError as e:
+                print(f'  写入失败: {filename} {str(e)}')
+                self.crawler.inflight.release(('file', artwork_id, page), owner)
+                self.retry_page(artwork_id, page, url, filename)
+                continue
+            self.crawler.inflight.release(('file', artwork_id, page), owner)
+            print(f'  下载完成: {filename}, 大小: {size} 字节')
+            self.page_done(artwork_id, True)
+
+    def retry_page(self, artwork_id, page, url, filename):
+        """下载或写入失败的页面在流水线结束后用同步方式重试，已写入的分段文件会被续传"""
+        self.crawler.retry_queue.put(
+            f'作品 {artwork_id} 第 {page} 页', self.crawler.download_file, artwork_id, url, filename, page
+        )
+        self.page_done(artwork_id, False)
+
+    def page_done(self, artwork_id, success):
+        """记录一页的处理结果，作品的所有页面都处理完时发布完成事件"""
+        with self.lock:
+            if success:
+                self.downloaded.add(artwork_id)
+                self.page_success[artwork_id] = True
+            self.pending_pages[artwork_id] -= 1
+            if self.pending_pages[artwork_id] > 0:
+                return
+            del self.pending_pages[artwork_id]
+            artwork_success = self.page_success.pop(artwork_id)
+        self.crawler.events.publish(ARTWORK_FINISHED, artwork_id=artwork_id, success=artwork_success)
@@ -0,0 +1,188 @@
+import collections
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+default_workers = 4
+
+def wait_all(futures):
+    """等待所有任务完成，返回成功（结果为真）的任务数"""
+    wait(futures)
+    success_count = 0
+    for future in futures:
+        try:
+            if future.result():
+                success_count += 1
+        except Exception as e:
+            print(f'  下载任务异常: {str(e)}')
+    return success_count
+
+class DownloadPool:
+    """有界的下载线程池，每个主机的并发数由共享传输层限制"""
+
+    def __init__(self, workers=default_workers, name='pixiv-download'):
+        self.workers = max(1, int(workers))
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=name)
+
+    def submit(self, fn, *args, **kwargs):
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def wait_all(self, futures):
+        return wait_all(futures)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+class FairScheduler:
+    """多个爬取任务共用的线程池：各任务提交的下载按轮转顺序交给工作线程，一个任务排队再多也不会占满所有线程"""
+
+    def __init__(self, workers=default_workers, name='pixiv-batch'):
+        self.lanes = collections.OrderedDict()
+        self.condition = threading.Condition()
+        self.pending = 0
+        self.stopped = False
+        self.threads = [
+            threading.Thread(target=self.worker, name=f'{name}-{i}', daemon=True) for i in range(max(1, int(workers)))
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def lane(self, name):
+        """返回一个任务的提交入口，接口与 DownloadPool 相同"""
+        with self.condition:
+            self.lanes.setdefault(name, collections.deque())
+        return FairLane(self, name)
+
+    def submit(self, name, fn, args, kwargs):
+        future = Future()
+        with self.condition:
+            self.lanes[name].append((future, fn, args, kwargs))
+            self.pending += 1
+            self.condition.notify()
+        return future
+
+    def next_item(self):
+        """按轮转顺序取出下一个任务，被取出任务的队列移到末尾；停止且没有任务时返回None"""
+        with self.condition:
+            while not self.pending and not self.stopped:
+                self.condition.wait()
+            if not self.pending:
+                return None
+            for name, items in self.lanes.items():
+                if items:
+                    self.lanes.move_to_end(name)
+                    self.pending -= 1
+                    return items.popleft()
+
+    def worker(self):
+        while True:
+            item = self.next_item()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def shutdown(self):
+        """执行完已提交的任务后停止工作线程"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+class FairLane:
+    """FairScheduler 中一个爬取任务的提交入口，并统计该任务提交和完成的数量"""
+
+    def __init__(self, scheduler, name):
+        self.scheduler = scheduler
+        self.name = name
+        self.lock = threading.Lock()
+        self.counts = collections.Counter()
+
+    def submit(self, fn, *args, **kwargs):
+        with self.lock:
+            self.counts['submitted'] += 1
+        future = self.scheduler.submit(self.name, fn, args, kwargs)
+        future.add_done_callback(self.task_done)
+        return future
+
+    def task_done(self, future):
+        succeeded = not future.cancelled() and future.exception() is None and bool(future.result())
+        with self.lock:
+            self.counts['finished'] += 1
+            if succeeded:
+                self.counts['succeeded'] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def wait_all(self, futures):
+        return wait_all(futures)
+
+    def shutdown(self):
+        # 工作线程由调度器统一关闭
+        pass
+
+class InflightSet:
+    """进程内正在处理的作品：多个爬取任务同时遇到同一作品时，后来的任务等先开始的任务处理完
+
+    之后再执行时会命中作品详情缓存或已下载文件索引，同一作品只请求和下载一次。
+    持有者默认为当前线程（同一线程可以重复获取）；跨线程传递的任务（如流水线中由下载线程获取、
+    写入线程释放）可以传入自己的owner对象。
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        # 键 -> [持有者, 重复获取次数]
+        self.entries = {}
+
+    @contextmanager
+    def hold(self, key, owner=None):
+        self.acquire(key, owner)
+        try:
+            yield
+        finally:
+            self.release(key, owner)
+
+    def acquire(self, key, owner=None):
+        if owner is None:
+            owner = threading.get_ident()
+        with self.condition:
+            while True:
+                entry = self.entries.get(key)
+                if entry is None:
+                    self.entries[key] = [owner, 1]
+                    return
+                if entry[0] == owner:
+                    entry[1] += 1
+                    return
+                self.condition.wait()
+
+    def release(self, key, owner=None):
+        if owner is None:
+            owner = threading.get_ident()
+        with self.condition:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != owner:
+                raise RuntimeError(f'释放未持有的作品: {key}')
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.entries[key]
+                self.condition.notify_all()
+
+_shared_inflight = None
+_shared_lock = threading.Lock()
+
+def get_shared_inflight():
+    """返回进程内共享的正在处理作品集合"""
+    global _shared_inflight
+    with _shared_lock:
+        if _shared_inflight is None:
+            _shared_inflight = InflightSet()
+        return _shared_inflight
@@ -0,0 +1,168 @@
+import collections
+import sys
+import threading
+import time
+
+from PixivCrawlerEvents import (
+    get_event_bus, drain, REQUEST_FINISHED, PAGE_FETCHED, DETAILS_FETCHED, ARTWORK_FILTERED,
+    ARTWORK_QUEUED, ARTWORK_FINISHED, DOWNLOAD_STARTED, DOWNLOAD_FINISHED,
+)
+
+# 计算实时速率的滑动窗口（秒）
+RATE_WINDOW = 10.0
+# 命令行输出状态行的间隔（秒）
+STATUS_INTERVAL = 5.0
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GB'
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f'{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+    return f'{seconds // 60:02d}:{seconds % 60:02d}'
+
+class ProgressAggregator:
+    """订阅爬虫的进度事件，汇总计数并按滑动窗口计算实时吞吐量
+
+    update() 取出新事件，只应在一个线程中调用；snapshot() 和 status_line() 返回当前状态。
+    """
+
+    def __init__(self, bus=None, window=RATE_WINDOW):
+        self.bus = bus if bus else get_event_bus()
+        self.subscriber = self.bus.subscribe(maxsize=100000)
+        self.window = window
+        self.started = time.monotonic()
+        # 滑动窗口内的 (事件发布时间, 类别, 数量)，时间为事件自带的 time.time()
+        self.recent = collections.deque()
+        self.counts = collections.Counter()
+        self.filtered = collections.Counter()
+        self.bytes = 0
+        self.latencies = collections.deque(maxlen=200)
+
+    def update(self):
+        for event in drain(self.subscriber):
+            self.handle(event)
+        self.trim()
+
+    def trim(self):
+        """丢弃滑动窗口之外的事件"""
+        now = time.time()
+        while self.recent and now - self.recent[0][0] > self.window:
+            self.recent.popleft()
+
+    def handle(self, event):
+        event_type = event['type']
+        # 按事件发布的时间计入窗口，而不是取出事件的时间，吞吐量不会随输出间隔跳变
+        now = event['time']
+        if event_type == REQUEST_FINISHED:
+            self.counts['requests'] += 1
+            if event['status'] is None or event['status'] >= 400:
+                self.counts['request_errors'] += 1
+            self.recent.append((now, 'request', 1))
+        elif event_type == PAGE_FETCHED:
+            self.counts['pages'] += 1
+            self.counts['listed'] += event['count']
+        elif event_type == DETAILS_FETCHED:
+            self.counts['details'] += 1
+            if event['cached']:
+                self.counts['cached_details'] += 1
+        elif event_type == ARTWORK_FILTERED:
+            self.filtered[event['reason']] += 1
+        elif event_type == ARTWORK_QUEUED:
+            self.counts['queued'] += 1
+        elif event_type == ARTWORK_FINISHED:
+            self.counts['finished'] += 1
+            self.counts['succeeded' if event['success'] else 'failed'] += 1
+            self.recent.append((now, 'artwork', 1))
+        elif event_type == DOWNLOAD_STARTED:
+            self.counts['downloads_started'] += 1
+        elif event_type == DOWNLOAD_FINISHED:
+            self.counts['downloads_finished'] += 1
+            if event['success']:
+                self.bytes += event['bytes']
+                self.latencies.append(event['latency'])
+                self.recent.append((now, 'bytes', event['bytes']))
+
+    def rate(self, kind):
+        """kind类事件在滑动窗口内的每秒数量"""
+        elapsed = min(self.window, max(time.monotonic() - self.started, 1e-6))
+        cutoff = time.time() - self.window
+        return sum(amount for when, recent_kind, amount in self.recent if recent_kind == kind and when >= cutoff) / elapsed
+
+    def snapshot(self):
+        queue_depth = self.counts['queued'] - self.counts['finished']
+        artwork_rate = self.rate('artwork')
+        return {
+            'elapsed': time.monotonic() - self.started,
+            'requests': self.counts['requests'],
+            'request_errors': self.counts['request_errors'],
+            'requests_per_second': self.rate('request'),
+            'bytes': self.bytes,
+            'bytes_per_second': self.rate('bytes'),
+            'pages': self.counts['pages'],
+            'details': self.counts['details'],
+            'cached_details': self.counts['cached_details'],
+            'filtered': dict(self.filtered),
+            'queued': self.counts['queued'],
+            'finished': self.counts['finished'],
+            'succeeded': self.counts['succeeded'],
+            'failed': self.counts['failed'],
+            'queue_depth': queue_depth,
+            'artworks_per_second': artwork_rate,
+            'eta': queue_depth / artwork_rate if queue_depth > 0 and artwork_rate > 0 else None,
+            'average_latency': sum(self.latencies) / len(self.latencies) if self.latencies else None,
+        }
+
+    def status_line(self):
+        stats = self.snapshot()
+        parts = [
+            f"请求 {stats['requests_per_second']:.1f}/s",
+            f"下载 {format_bytes(stats['bytes_per_second'])}/s",
+            f"作品 {stats['succeeded']}/{stats['queued']}",
+            f"队列 {stats['queue_depth']}",
+            f"已过滤 {sum(stats['filtered'].values())}",
+        ]
+        if stats['failed']:
+            parts.append(f"失败 {stats['failed']}")
+        if stats['eta'] is not None:
+            parts.append(f"预计剩余 {format_duration(stats['eta'])}")
+        parts.append(f"用时 {format_duration(stats['elapsed'])}")
+        return ' | '.join(parts)
+
+    def close(self):
+        self.bus.unsubscribe(self.subscriber)
+
+class ProgressReporter:
+    """命令行模式下定时把状态行输出到标准错误，与爬虫的标准输出分开"""
+
+    def __init__(self, interval=STATUS_INTERVAL, stream=None):
+        self.interval = interval
+        self.stream = stream if stream else sys.stderr
+        self.aggregator = ProgressAggregator()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='pixiv-progress', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def report(self):
+        self.aggregator.update()
+        print(f'[进度] {self.aggregator.status_line()}', file=self.stream, flush=True)
+
+    def stop(self):
+        """停止定时输出，并输出最终状态"""
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.report()
+        self.aggregator.close()
@@ -0,0 +1,688 @@
+import argparse
+import configparser
+import hmac
+import http.server
+import json
+import os
+import secrets
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+import requests
+
+from PixivCrawlerPool import default_workers
+from PixivCrawlerTag import PixivTagCrawler
+from PixivCrawlerArtist import PixivArtistCrawler
+from PixivCrawlerTransport import get_shared_transport
+from PixivCrawlerEvents import PAGE_FETCHED, ARTWORK_QUEUED
+from PixivCrawlerBatch import BatchJob, load_jobs, DEFAULT_MIN_BOOKMARKS, DEFAULT_MAX_PAGES
+
+DEFAULT_QUEUE_PATH = 'pixiv_queue.db'
+DEFAULT_PORT = 8765
+# 队列服务只在本机监听，需要其他机器连接时用 --host 指定
+DEFAULT_HOST = '127.0.0.1'
+# 队列服务的共享口令：请求头名称和未指定 --token 时读取的环境变量
+TOKEN_HEADER = 'X-Queue-Token'
+TOKEN_ENV = 'PIXIV_QUEUE_TOKEN'
+# 租约有效期（秒），工作进程每隔三分之一有效期续租一次
+LEASE_TIME = 300
+# 一个任务最多被领取的次数，超过后标记为失败
+MAX_ATTEMPTS = 5
+# 任务失败后重新可领取前的等待时间（秒），按失败次数倍增
+RETRY_DELAY = 30
+# 队列中暂时没有可领取的任务时，工作进程的轮询间隔（秒）
+POLL_INTERVAL = 1
+# 先领取作品任务，搜索页和画师任务产生的作品尽快被下载
+PRIORITIES = {'search': 0, 'artist': 0, 'artwork': 1}
+# 作品因不符合筛选条件而跳过时的任务结果前缀
+SKIPPED = '跳过'
+# 处理期间被收藏数条件更宽的任务再次添加的标记
+REOPENED = 'reopened'
+# 远程队列服务允许调用的方法
+REMOTE_METHODS = ('add_tasks', 'lease', 'extend', 'complete', 'fail', 'counts')
+
+class WorkQueue:
+    """SQLite文件中的持久化任务队列，多个工作进程通过租约领取任务
+
+    每个任务有唯一的键（如 artwork:12345），重复添加的任务被忽略，同一作品在整个队列中只处理一次。
+    领取任务时获得带有效期的租约，工作进程处理期间定时续租；进程退出或机器断网导致租约过期后，
+    任务重新回到队列由其他工作进程领取。完成和失败只对持有当前租约的工作进程生效。
+    """
+
+    def __init__(self, path=DEFAULT_QUEUE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        # 手动控制事务，领取任务时用 BEGIN IMMEDIATE 避免两个进程领到同一任务
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.create_tables()
+
+    def create_tables(self):
+        with self.lock:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL UNIQUE,
+                    payload TEXT NOT NULL,
+                    priority INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    available_at REAL NOT NULL,
+                    lease_owner TEXT,
+                    lease_token TEXT,
+                    lease_expires REAL,
+                    result TEXT,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS tasks_pending ON tasks (state, priority, id)')
+
+    @contextmanager
+    def transaction(self):
+        """写事务，同一时刻只有一个连接能修改队列"""
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+
+    def add_tasks(self, tasks):
+        """添加任务 [(类型, 键, 参数)]，返回新增（或重新排队）的任务数
+
+        键已存在的任务被忽略；例外是作品任务的收藏数条件更宽时（如画师任务遇到标签任务中的作品），
+        尚未处理或已因筛选跳过的任务改用新的参数重新排队，作品不会因为先被其他任务筛掉而漏下。
+        """
+        now = time.time()
+        added = 0
+        with self.transaction() as conn:
+            for kind, key, payload in tasks:
+                body = json.dumps(payload, ensure_ascii=False)
+                cursor = conn.execute('''
+                    INSERT OR IGNORE INTO tasks (kind, key, payload, priority, state, available_at, updated_at)
+                    VALUES (?, ?, ?, ?, 'pending', ?, ?)
+                ''', (kind, key, body, PRIORITIES.get(kind, 0), now, now))
+                if cursor.rowcount:
+                    added += 1
+                    continue
+                task_id, existing, state, result = conn.execute(
+                    'SELECT id, payload, state, result FROM tasks WHERE key = ?', (key,)
+                ).fetchone()
+                if payload.get('min_bookmarks', 0) >= json.loads(existing).get('min_bookmarks', 0):
+                    continue
+                if state == 'pending' or (state == 'done' and (result or '').startswith(SKIPPED)):
+                    conn.execute('''
+                        UPDATE tasks SET payload = ?, state = 'pending', attempts = 0, result = NULL,
+                            available_at = ?, updated_at = ?
+                        WHERE id = ?
+                    ''', (body, now, now, task_id))
+                    added += 1
+                elif state == 'leased':
+                    # 正在处理的任务如果因筛选被跳过，完成时按新的参数重新排队
+                    conn.execute(
+                        'UPDATE tasks SET payload = ?, result = ?, updated_at = ? WHERE id = ?', (body, REOPENED, now, task_id)
+                    )
+                    added += 1
+        return added
+
+    def requeue_expired(self, conn, now):
+        """把租约已过期的任务放回队列，领取次数用完的标记为失败"""
+        conn.execute('''
+            UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                result = CASE WHEN attempts >= ? THEN '租约过期次数过多' ELSE result END,
+                lease_owner = NULL, lease_token = NULL, lease_expires = NULL, updated_at = ?
+            WHERE state = 'leased' AND lease_expires < ?
+        ''', (MAX_ATTEMPTS, MAX_ATTEMPTS, now, now))
+
+    def lease(self, owner, count=1, lease_time=LEASE_TIME):
+        """领取最多count个任务，返回任务列表，每个任务带有本次租约的token"""
+        now = time.time()
+        token = uuid.uuid4().hex
+        with self.transaction() as conn:
+            self.requeue_expired(conn, now)
+            rows = conn.execute('''
+                SELECT id, kind, key, payload, attempts FROM tasks
+                WHERE state = 'pending' AND available_at <= ?
+                ORDER BY priority DESC, id LIMIT ?
+            ''', (now, count)).fetchall()
+            conn.executemany('''
+                UPDATE tasks SET state = 'leased', attempts = attempts + 1, result = NULL,
+                    lease_owner = ?, lease_token = ?, lease_expires = ?, updated_at = ?
+                WHERE id = ?
+            ''', [(owner, token, now + lease_time, now, row[0]) for row in rows])
+        return [
+            {'id': task_id, 'kind': kind, 'key': key, 'payload': json.loads(payload), 'attempts': attempts + 1, 'token': token}
+            for task_id, kind, key, payload, attempts in rows
+        ]
+
+    def extend(self, leases, lease_time=LEASE_TIME):
+        """为 [(任务ID, token)] 续租，返回仍然持有租约的任务数"""
+        now = time.time()
+        with self.transaction() as conn:
+            before = conn.total_changes
+            conn.executemany('''
+                UPDATE tasks SET lease_expires = ?, updated_at = ?
+                WHERE id = ? AND lease_token = ? AND state = 'leased'
+            ''', [(now + lease_time, now, task_id, token) for task_id, token in leases])
+            return conn.total_changes - before
+
+    def complete(self, task_id, token, result=None):
+        """标记任务完成；租约已过期并被其他进程领取时返回False"""
+        now = time.time()
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT result FROM tasks WHERE id = ? AND lease_token = ? AND state = 'leased'", (task_id, token)
+            ).fetchone()
+            if row is None:
+                return False
+            if row[0] == REOPENED and (result or '').startswith(SKIPPED):
+                state, attempts, result = 'pending', 0, None
+            else:
+                state, attempts = 'done', None
+            conn.execute('''
+                UPDATE tasks SET state = ?, attempts = COALESCE(?, attempts), result = ?, available_at = ?,
+                    lease_owner = NULL, lease_token = NULL, lease_expires = NULL, updated_at = ?
+                WHERE id = ?
+            ''', (state, attempts, result, now, now, task_id))
+            return True
+
+    def fail(self, task_id, token, error=None):
+        """任务失败：领取次数未用完时延迟后重新排队，否则标记为失败"""
+        now = time.time()
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT attempts FROM tasks WHERE id = ? AND lease_token = ? AND state = 'leased'", (task_id, token)
+            ).fetchone()
+            if row is None:
+                return False
+            attempts = row[0]
+            state = 'failed' if attempts >= MAX_ATTEMPTS else 'pending'
+            conn.execute('''
+                UPDATE tasks SET state = ?, result = ?, available_at = ?, lease_owner = NULL, lease_token = NULL,
+                    lease_expires = NULL, updated_at = ?
+                WHERE id = ?
+            ''', (state, error, now + RETRY_DELAY * 2 ** (attempts - 1), now, task_id))
+            return True
+
+    def counts(self):
+        """返回 {类型: {状态: 任务数}}"""
+        with self.transaction() as conn:
+            self.requeue_expired(conn, time.time())
+            rows = conn.execute('SELECT kind, state, COUNT(*) FROM tasks GROUP BY kind, state').fetchall()
+        counts = {}
+        for kind, state, count in rows:
+            counts.setdefault(kind, {})[state] = count
+        return counts
+
+    def retry_failed(self):
+        """把失败的任务重新放回队列，返回任务数"""
+        with self.transaction() as conn:
+            cursor = conn.execute('''
+                UPDATE tasks SET state = 'pending', attempts = 0, available_at = ?, updated_at = ?
+                WHERE state = 'failed'
+            ''', (time.time(), time.time()))
+            return cursor.rowcount
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class QueueRequestHandler(http.server.BaseHTTPRequestHandler):
+    """把 POST /方法名 的JSON参数转交给队列，返回 {"result": 返回值}；请求头中的口令不符时返回403"""
+
+    def do_POST(self):
+        token = self.headers.get(TOKEN_HEADER, '')
+        if not hmac.compare_digest(token.encode('utf-8'), self.server.token.encode('utf-8')):
+            self.send_error(403)
+            return
+        method = self.path.strip('/')
+        if method not in REMOTE_METHODS:
+            self.send_error(404)
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            kwargs = json.loads(self.rfile.read(length) or b'{}')
+            result = getattr(self.server.queue, method)(**kwargs)
+        except (TypeError, ValueError, AttributeError, KeyError,
+                sqlite3.InterfaceError, sqlite3.ProgrammingError) as e:
+            # 参数格式或类型不对
+            self.reply(400, {'error': str(e)})
+            return
+        except sqlite3.Error as e:
+            self.reply(500, {'error': str(e)})
+            return
+        self.reply(200, {'result': result})
+
+    def reply(self, status, payload):
+        # 错误信息放在JSON正文里，状态行只能是latin-1，放不下中文
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class QueueServer(http.server.ThreadingHTTPServer):
+    """在协调节点上通过HTTP提供队列，其他机器的工作进程不需要共享队列文件"""
+
+    daemon_threads = True
+
+    def __init__(self, queue, token, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        if not token:
+            raise ValueError('队列服务需要共享口令')
+        super().__init__((host, port), QueueRequestHandler)
+        self.queue = queue
+        self.token = token
+
+class RemoteQueue:
+    """QueueServer 的客户端，接口与 WorkQueue 相同"""
+
+    def __init__(self, url, token, timeout=30):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers[TOKEN_HEADER] = token
+
+    def call(self, method, **kwargs):
+        response = self.session.post(f'{self.url}/{method}', json=kwargs, timeout=self.timeout)
+        if response.status_code in (400, 500):
+            raise requests.HTTPError(f'{response.status_code} {method}: {response.json().get("error")}',
+                                     response=response)
+        response.raise_for_status()
+        return response.json()['result']
+
+    def add_tasks(self, tasks):
+        return self.call('add_tasks', tasks=[list(task) for task in tasks])
+
+    def lease(self, owner, count=1, lease_time=LEASE_TIME):
+        return self.call('lease', owner=owner, count=count, lease_time=lease_time)
+
+    def extend(self, leases, lease_time=LEASE_TIME):
+        return self.call('extend', leases=[list(lease) for lease in leases], lease_time=lease_time)
+
+    def complete(self, task_id, token, result=None):
+        return self.call('complete', task_id=task_id, token=token, result=result)
+
+    def fail(self, task_id, token, error=None):
+        return self.call('fail', task_id=task_id, token=token, error=error)
+
+    def counts(self):
+        return self.call('counts')
+
+    def close(self):
+        self.session.close()
+
+def is_remote(location):
+    return location.startswith(('http://', 'https://'))
+
+def open_queue(location, token=None):
+    """http:// 开头时用共享口令连接远程队列服务，否则打开本地SQLite队列文件"""
+    if is_remote(location):
+        return RemoteQueue(location, token)
+    return WorkQueue(location)
+
+class TaskError(Exception):
+    """任务处理失败，需要重新排队"""
+
+def folder_name(kind, target, date):
+    """与图形界面相同的保存目录名；标签中的路径分隔符和 .. 替换为下划线，保证是单层目录"""
+    name = f'{kind}_{target}_{date}'
+    for part in ('/', '\\', '..'):
+        name = name.replace(part, '_')
+    return name
+
+def save_dir(save_root, folder):
+    """返回任务参数中的目录在 save_root 下的路径；不是单层目录名时抛出TaskError"""
+    if (not isinstance(folder, str) or not folder or '..' in folder or os.path.isabs(folder)
+            or '/' in folder or '\\' in folder):
+        raise TaskError(f'非法的保存目录: {folder!r}')
+    root = os.path.abspath(save_root)
+    path = os.path.abspath(os.path.join(root, folder))
+    if path == root or os.path.commonpath([root, path]) != root:
+        raise TaskError(f'非法的保存目录: {folder!r}')
+    return path
+
+def job_tasks(job, date=None):
+    """把批量任务文件中的一项转换为队列任务：标签任务为每个搜索页一个任务，画师任务为一个作品列表任务"""
+    folder = folder_name(job.kind, job.target, date or datetime.now().strftime('%Y%m%d'))
+    if job.kind == 'artist':
+        return [('artist', f'artist:{job.target}', {'artist_id': job.target, 'incremental': job.incremental, 'folder': folder})]
+    options_key = json.dumps(job.search_options, sort_keys=True)
+    return [
+        ('search', f'search:{job.target}:{options_key}:{page}', {
+            'tag': job.target, 'page': page, 'min_bookmarks': job.min_bookmarks,
+            'search_options': job.search_options, 'folder': folder,
+        })
+        for page in range(1, job.max_pages + 1)
+    ]
+
+def count_summary(counts):
+    """把 counts() 的结果格式化为一行"""
+    parts = []
+    for kind in ('search', 'artist', 'artwork'):
+        states = counts.get(kind)
+        if states:
+            total = sum(states.values())
+            detail = ' '.join(f'{state} {states[state]}' for state in ('pending', 'leased', 'done', 'failed') if states.get(state))
+            parts.append(f'{kind} {total}（{detail}）')
+    return '，'.join(parts) or '队列为空'
+
+def is_finished(counts):
+    """没有等待和正在处理的任务时，队列已全部完成"""
+    return not any(states.get('pending') or states.get('leased') for states in counts.values())
+
+class QueueWorker:
+    """从队列领取任务并用已有的爬虫类处理
+
+    搜索页任务和画师任务只列出作品，作为作品任务加入队列；作品任务获取详情、筛选并下载，
+    文件保存在 save_root 下与图形界面相同命名的目录中。threads个线程同时处理任务，
+    每个作品的多页图片再由爬虫的下载线程池并发下载。
+    """
+
+    def __init__(self, queue, cookie, threads=default_workers, workers=default_workers, save_root='pixiv_images',
+                 lease_time=LEASE_TIME, transport=None, db=None, store=None):
+        self.queue = queue
+        self.cookie = cookie
+        self.threads = max(1, int(threads))
+        self.workers = workers
+        self.save_root = save_root
+        self.lease_time = lease_time
+        self.transport = transport if transport else get_shared_transport(cookie)
+        self.db = db
+        self.store = store
+        self.owner = f'{socket.gethostname()}-{os.getpid()}'
+        self.lock = threading.Lock()
+        self.crawlers = {}
+        # 正在处理的任务 {任务ID: token}，由续租线程定时续租
+        self.held = {}
+        self.stopped = threading.Event()
+        self.counts = {'done': 0, 'failed': 0, 'lost': 0}
+
+    def crawler(self, kind, folder, search_options=None):
+        """每个保存目录（和搜索参数）一个爬虫，多个线程共用"""
+        save_path = save_dir(self.save_root, folder)
+        key = (kind, folder, json.dumps(search_options, sort_keys=True))
+        with self.lock:
+            crawler = self.crawlers.get(key)
+            if crawler is None:
+                if kind == 'artist':
+                    crawler = PixivArtistCrawler(self.cookie, save_path, workers=self.workers,
+                                                 transport=self.transport, db=self.db, store=self.store)
+                else:
+                    crawler = PixivTagCrawler(self.cookie, save_path, workers=self.workers, transport=self.transport,
+                                              db=self.db, search_options=search_options, store=self.store)
+                self.crawlers[key] = crawler
+            return crawler
+
+    def handle_search(self, payload):
+        crawler = self.crawler('tag', payload['folder'], payload.get('search_options'))
+        tag, page = payload['tag'], payload['page']
+        print(f'正在获取标签 "{tag}" 第{page}页的作品...')
+        try:
+            response = crawler.transport.get(crawler.search_url(tag, page))
+            data = response.json() if response.status_code == 200 else None
+        except (requests.exceptions.RequestException, ValueError) as e:
+            raise TaskError(f'搜索页请求异常: {str(e)}')
+        if not data or data['error'] != False:
+            raise TaskError(f'搜索页请求失败: {response.status_code}')
+        artworks = data['body']['illustManga']['data']
+        crawler.events.publish(PAGE_FETCHED, page=page, count=len(artworks))
+        artwork_ids = crawler.select_candidates(artworks)
+        added = self.queue.add_tasks([
+            ('artwork', f'artwork:{artwork_id}', {
+                'artwork_id': artwork_id, 'tag': tag, 'min_bookmarks': payload['min_bookmarks'], 'folder': payload['folder'],
+            })
+            for artwork_id in artwork_ids
+        ])
+        return f'{len(artworks)} 个作品，新增 {added} 个作品任务'
+
+    def handle_artist(self, payload):
+        crawler = self.crawler('artist', payload['folder'])
+        artist_id = payload['artist_id']
+        print(f'正在获取作者 {artist_id} 的所有作品...')
+        try:
+            response = crawler.transport.get(f'https://www.pixiv.net/ajax/user/{artist_id}/profile/all')
+            data = response.json() if response.status_code == 200 else None
+        except (requests.exceptions.RequestException, ValueError) as e:
+            raise TaskError(f'作品列表请求异常: {str(e)}')
+        if not data or data['error'] != False:
+            raise TaskError(f'作品列表请求失败: {response.status_code}')
+        artwork_ids = list((data['body']['illusts'] or {}).keys())
+        crawler.events.publish(PAGE_FETCHED, page=1, count=len(artwork_ids))
+        if payload.get('incremental'):
+            recorded_ids = crawler.db.get_recorded_work_ids(artist_id)
+            artwork_ids = [artwork_id for artwork_id in artwork_ids if artwork_id not in recorded_ids]
+        # 批量接口得到的下载所需字段随任务一起保存，领取作品任务的工作进程不必再请求详情；
+        # 这些详情带有 guessed_original 标记，不会写入工作进程的详情缓存
+        batch_details = crawler.get_artwork_details_batch(artist_id, artwork_ids)
+        added = self.queue.add_tasks([
+            ('artwork', f'artwork:{artwork_id}', {
+                'artwork_id': artwork_id, 'artist_id': artist_id, 'folder': payload['folder'],
+                'details': batch_details.get(artwork_id),
+            })
+            for artwork_id in artwork_ids
+        ])
+        return f'{len(artwork_ids)} 个作品，新增 {added} 个作品任务'
+
+    def handle_artwork(self, payload):
+        artwork_id = payload['artwork_id']
+        if 'artist_id' in payload:
+            crawler = self.crawler('artist', payload['folder'])
+            details = payload.get('details') or crawler.get_artwork_details(artwork_id)
+            if not details:
+                raise TaskError(f'作品 {artwork_id} 详情获取失败')
+            crawler.events.publish(ARTWORK_QUEUED, artwork_id=artwork_id)
+            success = crawler.download_and_record(payload['artist_id'], artwork_id, details)
+        else:
+            crawler = self.crawler('tag', payload['folder'])
+            details = crawler.get_artwork_details(artwork_id)
+            if not details:
+                raise TaskError(f'作品 {artwork_id} 详情获取失败')
+            reason = crawler.check_artwork(artwork_id, details, payload['min_bookmarks'])
+            if reason is not None:
+                return f'{SKIPPED}: {reason}'
+            crawler.events.publish(ARTWORK_QUEUED, artwork_id=artwork_id)
+            success = crawler.download_and_report(artwork_id, details)
+        # 失败的下载由队列重新分配，不使用爬虫自己的重试队列
+        crawler.retry_queue.drain()
+        if not success:
+            raise TaskError(f'作品 {artwork_id} 下载失败')
+        return '下载完成'
+
+    def process(self, task):
+        handler = getattr(self, f"handle_{task['kind']}", None)
+        try:
+            if handler is None:
+                raise TaskError(f"未知的任务类型: {task['kind']}")
+            result = handler(task['payload'])
+        except Exception as e:
+            print(f"任务 {task['key']} 失败（第 {task['attempts']} 次）: {str(e)}")
+            self.queue.fail(task['id'], task['token'], str(e))
+            with self.lock:
+                self.counts['failed'] += 1
+            return
+        if self.queue.complete(task['id'], task['token'], result):
+            with self.lock:
+                self.counts['done'] += 1
+        else:
+            # 处理时间超过租约，任务已被其他工作进程领取
+            print(f"任务 {task['key']} 的租约已过期，结果未记录")
+            with self.lock:
+                self.counts['lost'] += 1
+
+    def worker(self):
+        while not self.stopped.is_set():
+            try:
+                tasks = self.queue.lease(self.owner, 1, self.lease_time)
+                if not tasks:
+                    if is_finished(self.queue.counts()):
+                        return
+                    # 其他工作进程的任务可能会产生新任务或因租约过期重新排队
+                    self.stopped.wait(POLL_INTERVAL)
+                    continue
+            except requests.exceptions.RequestException as e:
+                print(f'连接队列服务失败: {str(e)}')
+                self.stopped.wait(POLL_INTERVAL)
+                continue
+            task = tasks[0]
+            with self.lock:
+                self.held[task['id']] = task['token']
+            try:
+                self.process(task)
+            except requests.exceptions.RequestException as e:
+                # 完成或失败的结果无法提交，等租约过期后由其他工作进程重新处理
+                print(f'连接队列服务失败: {str(e)}')
+            finally:
+                with self.lock:
+                    del self.held[task['id']]
+
+    def heartbeat(self):
+        """定时为正在处理的任务续租"""
+        while not self.stopped.wait(self.lease_time / 3):
+            with self.lock:
+                leases = list(self.held.items())
+            if not leases:
+                continue
+            try:
+                self.queue.extend(leases, self.lease_time)
+            except requests.exceptions.RequestException as e:
+                print(f'续租失败: {str(e)}')
+
+    def run(self):
+        """处理任务直到队列全部完成，返回 {'done': 完成数, 'failed': 失败数, 'lost': 租约过期数}"""
+        heartbeat = threading.Thread(target=self.heartbeat, name='pixiv-queue-heartbeat', daemon=True)
+        heartbeat.start()
+        threads = [threading.Thread(target=self.worker, name=f'pixiv-queue-{i}') for i in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        finally:
+            self.stopped.set()
+            heartbeat.join()
+            for crawler in self.crawlers.values():
+                crawler.shutdown()
+        return dict(self.counts)
+
+def read_cookie(cookie):
+    if cookie:
+        return cookie
+    config = configparser.ConfigParser()
+    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.ini')
+    if os.path.exists(config_path):
+        config.read(config_path)
+        return config.get('Pixiv', 'cookie', fallback='')
+    return ''
+
+def main():
+    parser = argparse.ArgumentParser(description='Pixiv分布式爬取 - 协调节点把任务放入持久化队列，多台机器上的工作进程领取任务并下载')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    add_parser = subparsers.add_parser('add', help='把标签、画师或批量任务文件中的任务加入队列')
+    add_parser.add_argument('--queue', '-q', type=str, default=DEFAULT_QUEUE_PATH, help=f'队列文件或队列服务地址（默认: {DEFAULT_QUEUE_PATH}）')
+    add_parser.add_argument('--tag', '-t', type=str, action='append', default=[], help='要爬取的标签，可以多次指定')
+    add_parser.add_argument('--artist', '-a', type=str, action='append', default=[], help='要爬取的画师ID，可以多次指定')
+    add_parser.add_argument('--bookmarks', '-b', type=int, default=DEFAULT_MIN_BOOKMARKS, help=f'标签任务的最小收藏数（默认: {DEFAULT_MIN_BOOKMARKS}）')
+    add_parser.add_argument('--pages', '-p', type=int, default=DEFAULT_MAX_PAGES, help=f'标签任务的最大页数（默认: {DEFAULT_MAX_PAGES}）')
+    add_parser.add_argument('--incremental', '-i', action='store_true', help='画师任务只下载工作进程数据库中尚未记录的新作品')
+    add_parser.add_argument('--jobs', '-j', type=str, help='PixivCrawlerBatch.py 格式的JSON任务文件')
+
+    serve_parser = subparsers.add_parser('serve', help='通过HTTP提供队列，供其他机器上的工作进程连接')
+    serve_parser.add_argument('--queue', '-q', type=str, default=DEFAULT_QUEUE_PATH, help=f'队列文件（默认: {DEFAULT_QUEUE_PATH}）')
+    serve_parser.add_argument('--host', type=str, default=DEFAULT_HOST, help=f'监听地址，其他机器连接时设为 0.0.0.0 或本机的局域网地址（默认: {DEFAULT_HOST}）')
+    serve_parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'监听端口（默认: {DEFAULT_PORT}）')
+    serve_parser.add_argument('--interval', type=float, default=30, help='输出队列状态的间隔秒数（默认: 30）')
+
+    work_parser = subparsers.add_parser('work', help='领取并处理任务，队列全部完成后退出')
+    work_parser.add_argument('--queue', '-q', type=str, default=DEFAULT_QUEUE_PATH, help=f'队列文件或队列服务地址，如 http://10.0.0.1:{DEFAULT_PORT}（默认: {DEFAULT_QUEUE_PATH}）')
+    work_parser.add_argument('--cookie', '-c', type=str, help='Pixiv的Cookie，留空则使用配置文件中的值')
+    work_parser.add_argument('--threads', type=int, default=default_workers, help=f'同时处理的任务数（默认: {default_workers}）')
+    work_parser.add_argument('--workers', '-w', type=int, default=default_workers, help=f'每个作品的多页图片的下载线程数（默认: {default_workers}）')
+    work_parser.add_argument('--save-root', type=str, default='pixiv_images', help='保存目录（默认: pixiv_images）')
+    work_parser.add_argument('--lease-time', type=float, default=LEASE_TIME, help=f'租约有效期秒数，工作进程失联超过该时间后任务重新排队（默认: {LEASE_TIME}）')
+
+    status_parser = subparsers.add_parser('status', help='显示队列中各类任务的数量')
+    status_parser.add_argument('--queue', '-q', type=str, default=DEFAULT_QUEUE_PATH, help=f'队列文件或队列服务地址（默认: {DEFAULT_QUEUE_PATH}）')
+    status_parser.add_argument('--retry-failed', action='store_true', help='把失败的任务重新放回队列（只支持本地队列文件）')
+    for subparser in (add_parser, serve_parser, work_parser, status_parser):
+        subparser.add_argument('--token', type=str, default=os.environ.get(TOKEN_ENV),
+                               help=f'队列服务的共享口令，留空则使用环境变量 {TOKEN_ENV}；serve 未指定时随机生成')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        token = args.token
+        if not token:
+            token = secrets.token_urlsafe(16)
+            print(f'未指定口令，已生成: {token}（工作进程使用 --token 或环境变量 {TOKEN_ENV} 传入）')
+        queue = WorkQueue(args.queue)
+        server = QueueServer(queue, token, args.host, args.port)
+        threading.Thread(target=server.serve_forever, name='pixiv-queue-server', daemon=True).start()
+        print(f'队列服务已启动: http://{args.host}:{server.server_address[1]}，按 Ctrl+C 停止')
+        try:
+            while True:
+                print(f'[队列] {count_summary(queue.counts())}', file=sys.stderr)
+                time.sleep(args.interval)
+        except KeyboardInterrupt:
+            pass
+        server.shutdown()
+        server.server_close()
+        queue.close()
+        return
+
+    if is_remote(args.queue) and not args.token:
+        print(f'错误：连接队列服务需要口令，请通过 --token 或环境变量 {TOKEN_ENV} 提供')
+        return
+    queue = open_queue(args.queue, args.token)
+    try:
+        if args.command == 'add':
+            jobs = [BatchJob('tag', tag, args.bookmarks, args.pages) for tag in args.tag]
+            jobs += [BatchJob('artist', artist_id, incremental=args.incremental) for artist_id in args.artist]
+            if args.jobs:
+                try:
+                    jobs += load_jobs(args.jobs)
+                except (OSError, ValueError) as e:
+                    print(f'错误：无法读取任务文件 {args.jobs} ({str(e)})')
+                    return
+            if not jobs:
+                print('错误：请通过 --tag、--artist 或 --jobs 指定任务')
+                return
+            tasks = [task for job in jobs for task in job_tasks(job)]
+            added = queue.add_tasks(tasks)
+            print(f'已加入 {added} 个任务（{len(tasks) - added} 个已在队列中）')
+            print(count_summary(queue.counts()))
+        elif args.command == 'status':
+            if args.retry_failed:
+                if isinstance(queue, RemoteQueue):
+                    print('错误：--retry-failed 只支持本地队列文件')
+                    return
+                print(f'已重新排队 {queue.retry_failed()} 个失败任务')
+            print(count_summary(queue.counts()))
+        else:
+            cookie = read_cookie(args.cookie)
+            if not cookie:
+                print('错误：未找到Cookie配置。请在config.ini文件中设置cookie，或通过命令行参数提供。')
+                return
+            worker = QueueWorker(queue, cookie, args.threads, args.workers, args.save_root, args.lease_time)
+            print(f'工作进程 {worker.owner} 开始处理队列 {args.queue}')
+            started = time.monotonic()
+            counts = worker.run()
+            print(f"\n队列已全部完成，本进程处理 {counts['done']} 个任务，失败 {counts['failed']} 个，"
+                  f"租约过期 {counts['lost']} 个，用时 {time.monotonic() - started:.1f} 秒")
+    finally:
+        queue.close()
+
+if __name__ == '__main__':
+    main()
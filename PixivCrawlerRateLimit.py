@@ -0,0 +1,146 @@
+import threading
+import time
+from urllib.parse import urlparse
+
+# 各类接口的速率设置（每秒请求数）：初始速率、下限、上限
+ENDPOINT_RATES = {
+    'search': {'rate': 0.5, 'min_rate': 0.05, 'max_rate': 3.0},
+    'illust': {'rate': 2.0, 'min_rate': 0.1, 'max_rate': 10.0},
+    'image': {'rate': 10.0, 'min_rate': 0.5, 'max_rate': 50.0},
+}
+
+# 每秒成功请求带来的速率增量（加性增）
+INCREASE_PER_SECOND = 0.1
+# 被限流或出错时速率乘以的系数（乘性减）
+DECREASE_FACTOR = 0.5
+# 两次降速之间的最短间隔，避免同一波并发错误把速率连续减半多次
+DECREASE_INTERVAL = 2.0
+
+# 视为被限流或服务器异常的状态码；403 对API表示访问过于频繁，对图片CDN通常是Referer问题
+THROTTLE_STATUS = {429, 500, 502, 503, 504}
+API_THROTTLE_STATUS = THROTTLE_STATUS | {403}
+
+def classify_endpoint(url):
+    """按URL判断接口类别：search / illust / image，其他返回None"""
+    parsed = urlparse(url)
+    if parsed.hostname == 'i.pximg.net':
+        return 'image'
+    if parsed.path.startswith('/ajax/search/'):
+        return 'search'
+    if parsed.path.startswith('/ajax/'):
+        return 'illust'
+    return None
+
+class AdaptiveTokenBucket:
+    """速率自适应的令牌桶：成功时加性增加速率，被限流或出错时乘性降低速率"""
+
+    def __init__(self, rate, min_rate, max_rate, burst=1.0):
+        self.rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """预约一个令牌，返回需要等待的秒数；令牌可以透支，后来的请求依次排队"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def on_success(self):
+        with self.lock:
+            # 每秒约有 rate 次成功，每次增加 INCREASE_PER_SECOND / rate
+            self.rate = min(self.max_rate, self.rate + INCREASE_PER_SECOND / self.rate)
+
+    def on_throttle(self, retry_after=None):
+        with self.lock:
+            now = time.monotonic()
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+            if now - self.last_decrease < DECREASE_INTERVAL:
+                return
+            self.last_decrease = now
+            self.rate = max(self.min_rate, self.rate * DECREASE_FACTOR)
+            # 清空已积累的令牌，降速立即生效
+            self.tokens = min(self.tokens, 0.0)
+
+class AdaptiveRateLimiter:
+    """按接口类别（搜索、作品API、图片CDN）分别限速，所有爬虫线程共用"""
+
+    def __init__(self, rates=None):
+        settings = {endpoint: dict(values) for endpoint, values in ENDPOINT_RATES.items()}
+        if rates:
+            for endpoint, values in rates.items():
+                settings.setdefault(endpoint, {}).update(values)
+        self.buckets = {endpoint: AdaptiveTokenBucket(**values) for endpoint, values in settings.items()}
+        self.lock = threading.Lock()
+        # 各类接口因限速累计等待的秒数
+        self.sleep_seconds = {endpoint: 0.0 for endpoint in self.buckets}
+
+    def reserve(self, url):
+        """预约一次请求，返回 (接口类别, 需要等待的秒数)"""
+        endpoint = classify_endpoint(url)
+        bucket = self.buckets.get(endpoint)
+        if bucket is None:
+            return endpoint, 0.0
+        wait = bucket.reserve()
+        if wait > 0:
+            with self.lock:
+                self.sleep_seconds[endpoint] += wait
+        return endpoint, wait
+
+    def acquire(self, url):
+        """阻塞直到可以发送请求"""
+        _, wait = self.reserve(url)
+        if wait > 0:
+            time.sleep(wait)
+
+    def report(self, url, status=None, error=False, retry_after=None):
+        """根据响应状态调整速率；error为True表示连接错误或超时"""
+        endpoint = classify_endpoint(url)
+        bucket = self.buckets.get(endpoint)
+        if bucket is None:
+            return
+        throttle_status = THROTTLE_STATUS if endpoint == 'image' else API_THROTTLE_STATUS
+        if error or status in throttle_status:
+            bucket.on_throttle(retry_after)
+        else:
+            bucket.on_success()
+
+    def rates(self):
+        return {endpoint: bucket.rate for endpoint, bucket in self.buckets.items()}
+
+class UnlimitedRateLimiter(AdaptiveRateLimiter):
+    """从不等待的限速器，用于回放录制文件：请求间隔只由录制的耗时和回放速度决定，也不理会录制的Retry-After"""
+
+    def reserve(self, url):
+        return classify_endpoint(url), 0.0
+
+    def report(self, url, status=None, error=False, retry_after=None):
+        pass
+
+def parse_retry_after(value):
+    """解析 Retry-After 头（秒数形式），无法解析时返回None"""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+_shared_limiter = None
+_shared_lock = threading.Lock()
+
+def get_shared_limiter():
+    """返回进程内共享的限速器，所有传输对象和爬虫共用同一组令牌桶"""
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            _shared_limiter = AdaptiveRateLimiter()
+        return _shared_limiter
@@ -0,0 +1,220 @@
+import asyncio
+import collections
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+from PixivCrawlerRateLimit import parse_retry_after
+
+# 失败后的最大重试次数
+MAX_RETRIES = 4
+# 指数退避的基础延时和上限（秒）
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+
+# 连续失败多少次后断开主机，断开后暂停多久再放行一个试探请求（秒）
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30.0
+
+# 错误类别：可重试且说明主机状态不佳
+RETRYABLE_KINDS = {'throttle', 'server', 'network'}
+KIND_NAMES = {
+    'throttle': '请求过于频繁',
+    'server': '服务器错误',
+    'network': '网络错误',
+}
+
+# requests 中视为网络错误的异常
+NETWORK_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+def classify_status(status):
+    """按HTTP状态码分类：429为throttle，5xx为server，其他状态码不重试返回None"""
+    if status == 429:
+        return 'throttle'
+    if status is not None and 500 <= status < 600:
+        return 'server'
+    return None
+
+def backoff_delay(attempt, retry_after=None, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+    """第attempt次重试前的等待时间：带上限的指数退避加全抖动，不短于服务器给出的Retry-After"""
+    delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+    if retry_after:
+        delay = max(delay, min(retry_after, max_delay))
+    return delay
+
+class CircuitBreaker:
+    """单个主机的熔断器：连续失败达到阈值后暂停所有请求，超时后只放行一个试探请求"""
+
+    def __init__(self, host, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_at = 0.0
+        self.lock = threading.Lock()
+
+    def delay(self):
+        """返回发送请求前还需等待的秒数，0表示可以立即发送"""
+        with self.lock:
+            if self.state == 'closed':
+                return 0.0
+            now = time.monotonic()
+            if self.state == 'open':
+                remaining = self.opened_at + self.reset_timeout - now
+                if remaining > 0:
+                    return remaining
+                self.state = 'half_open'
+                self.probe_at = now
+                print(f'主机 {self.host} 暂停结束，发送试探请求')
+                return 0.0
+            # 半开状态：等待试探请求的结果，试探请求长时间没有结果时再放行一个
+            if now - self.probe_at > self.reset_timeout:
+                self.probe_at = now
+                return 0.0
+            return min(1.0, self.reset_timeout)
+
+    def wait(self):
+        """阻塞直到熔断器允许发送请求"""
+        while True:
+            delay = self.delay()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def record_success(self):
+        with self.lock:
+            if self.state != 'closed':
+                print(f'主机 {self.host} 已恢复')
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                print(f'主机 {self.host} 连续 {self.failures} 次失败，暂停 {self.reset_timeout:.0f} 秒')
+
+class RetryPolicy:
+    """统一的重试策略：错误分类、指数退避重试，以及按主机的熔断
+
+    time_scale缩放所有等待时间（退避、Retry-After和熔断暂停），回放录制文件时按回放速度缩短，0为不等待。
+    """
+
+    def __init__(self, max_retries=MAX_RETRIES, base_delay=BASE_DELAY, max_delay=MAX_DELAY,
+                 failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT, time_scale=1.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout * time_scale
+        self.time_scale = time_scale
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def breaker_for(self, url):
+        host = urlparse(url).hostname
+        with self.lock:
+            breaker = self.breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(host, self.failure_threshold, self.reset_timeout)
+                self.breakers[host] = breaker
+            return breaker
+
+    def next_delay(self, url, attempt, kind, max_retries, retry_after=None):
+        """记录一次请求结果，需要重试时返回等待秒数，否则返回None"""
+        breaker = self.breaker_for(url)
+        if kind not in RETRYABLE_KINDS:
+            breaker.record_success()
+            return None
+        breaker.record_failure()
+        if attempt >= max_retries:
+            return None
+        delay = backoff_delay(attempt + 1, retry_after, self.base_delay, self.max_delay) * self.time_scale
+        print(f'  {KIND_NAMES[kind]}，{delay:.1f} 秒后重试 ({attempt + 1}/{max_retries}): {url}')
+        return delay
+
+    def call(self, url, func, *args, max_retries=None, errors=NETWORK_ERRORS, **kwargs):
+        """调用func发送请求，按结果决定是否重试
+
+        func返回response或以response开头的元组；errors中的异常视为网络错误，
+        重试次数用完后返回最后一次结果或重新抛出异常。
+        """
+        if max_retries is None:
+            max_retries = self.max_retries
+        breaker = self.breaker_for(url)
+        attempt = 0
+        while True:
+            breaker.wait()
+            try:
+                result = func(*args, **kwargs)
+            except errors:
+                delay = self.next_delay(url, attempt, 'network', max_retries)
+                if delay is None:
+                    raise
+            else:
+                response = result[0] if isinstance(result, tuple) else result
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                delay = self.next_delay(url, attempt, classify_status(response.status_code), max_retries, retry_after)
+                if delay is None:
+                    return result
+            attempt += 1
+            if delay > 0:
+                time.sleep(delay)
+
+    async def call_async(self, url, func, errors, max_retries=None):
+        """call的协程版本：func为返回 (状态码, Retry-After, 结果) 的协程函数"""
+        if max_retries is None:
+            max_retries = self.max_retries
+        breaker = self.breaker_for(url)
+        attempt = 0
+        while True:
+            delay = breaker.delay()
+            while delay > 0:
+                await asyncio.sleep(delay)
+                delay = breaker.delay()
+            try:
+                status, retry_after, result = await func()
+            except errors:
+                delay = self.next_delay(url, attempt, 'network', max_retries)
+                if delay is None:
+                    raise
+            else:
+                delay = self.next_delay(url, attempt, classify_status(status), max_retries, retry_after)
+                if delay is None:
+                    return status, result
+            attempt += 1
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+class RetryQueue:
+    """重试队列：重试后仍然失败的作品或图片先记下来，爬取结束时再统一处理一轮"""
+
+    def __init__(self):
+        self.items = collections.deque()
+        self.lock = threading.Lock()
+
+    def put(self, description, func, *args):
+        with self.lock:
+            self.items.append((description, func, args))
+
+    def drain(self):
+        """取出并清空队列中的全部任务"""
+        with self.lock:
+            items = list(self.items)
+            self.items.clear()
+        return items
+
+    def __len__(self):
+        with self.lock:
+            return len(self.items)
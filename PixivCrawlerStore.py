@@ -0,0 +1,146 @@
+import os
+import shutil
+import threading
+
+from PixivCrawlerDB import file_sha1, PARTIAL_SUFFIXES
+
+# 内容寻址存储的目录，与各次爬取的保存目录位于同一文件系统时才能建立硬链接
+BLOB_ROOT = os.path.join('pixiv_images', '.blobs')
+
+# Linux的写时复制克隆（reflink）ioctl
+FICLONE = 0x40049409
+
+def reflink(source, dest):
+    """用写时复制克隆文件，文件系统不支持（或不是Linux）时返回False"""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        with open(source, 'rb') as src, open(dest, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        if os.path.exists(dest):
+            os.remove(dest)
+        return False
+
+def link_file(source, dest, allow_copy=True):
+    """在dest原子地创建与source内容相同的文件：优先硬链接，其次reflink，最后复制
+
+    返回使用的方式 'hardlink' / 'reflink' / 'copy'；allow_copy为False且无法链接时返回None，dest保持不变。
+    """
+    tmp_path = f'{dest}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        os.link(source, tmp_path)
+        method = 'hardlink'
+    except OSError:
+        if reflink(source, tmp_path):
+            method = 'reflink'
+        elif allow_copy:
+            shutil.copyfile(source, tmp_path)
+            method = 'copy'
+        else:
+            return None
+    os.replace(tmp_path, dest)
+    return method
+
+class BlobStore:
+    """按SHA1保存图片内容的存储，各次爬取的目录中的文件是指向存储的硬链接
+
+    同一作品出现在多个标签、画师目录或不同日期的目录中时，磁盘上只有一份内容。
+    文件系统不支持硬链接时用reflink，reflink不增加链接数，因此 prune 还需要已下载文件索引判断内容是否仍被引用。
+    """
+
+    def __init__(self, root=BLOB_ROOT):
+        self.root = root
+        self.lock = threading.Lock()
+        # 无法在存储和保存目录之间建立链接时只提示一次
+        self.warned = False
+
+    def blob_path(self, sha1):
+        return os.path.join(self.root, sha1[:2], sha1)
+
+    def add(self, path, sha1=None):
+        """把下载完成的文件放入存储
+
+        内容已存在时把path替换为指向已有内容的链接，返回 'deduplicated'；
+        否则把文件链接进存储，返回 'stored'；已经是同一个文件时返回 'linked'；无法链接时返回None。
+        """
+        if sha1 is None:
+            sha1 = file_sha1(path)
+        blob_path = self.blob_path(sha1)
+        with self.lock:
+            if os.path.exists(blob_path):
+                if os.path.samefile(blob_path, path):
+                    return 'linked'
+                if link_file(blob_path, path, allow_copy=False):
+                    return 'deduplicated'
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                # 存储中的文件是下载文件的硬链接，不额外占用空间
+                if link_file(path, blob_path, allow_copy=False):
+                    return 'stored'
+        if not self.warned:
+            self.warned = True
+            print(f'  无法在 {self.root} 与下载目录之间建立链接（可能不在同一文件系统），不进行去重')
+        return None
+
+    def prune(self, referenced=()):
+        """删除不再被任何目录引用的内容，返回 (删除的文件数, 释放的字节数)
+
+        referenced为仍被下载目录中的文件使用的SHA1集合；只删除不在其中且没有其他硬链接的内容。
+        """
+        removed, freed = 0, 0
+        if not os.path.isdir(self.root):
+            return removed, freed
+        with self.lock:
+            for dirpath, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    stat = os.stat(path)
+                    if stat.st_nlink <= 1 and filename not in referenced:
+                        os.remove(path)
+                        removed += 1
+                        freed += stat.st_size
+        return removed, freed
+
+    def dedupe_tree(self, root, referenced=None):
+        """把已有下载目录中的文件转换为指向存储的链接，返回统计信息；referenced不为None时把扫描到的文件的SHA1加入其中"""
+        stats = {'files': 0, 'stored': 0, 'deduplicated': 0, 'linked': 0, 'failed': 0, 'saved_bytes': 0}
+        blob_root = os.path.abspath(self.root)
+        for dirpath, dirnames, filenames in os.walk(root):
+            # 跳过存储目录本身
+            dirnames[:] = [name for name in dirnames if os.path.abspath(os.path.join(dirpath, name)) != blob_root]
+            for filename in filenames:
+                if filename.endswith(PARTIAL_SUFFIXES):
+                    continue
+                path = os.path.join(dirpath, filename)
+                if not os.path.isfile(path) or os.path.islink(path):
+                    continue
+                stats['files'] += 1
+                stat = os.stat(path)
+                sha1 = file_sha1(path)
+                if referenced is not None:
+                    referenced.add(sha1)
+                result = self.add(path, sha1)
+                if result is None:
+                    stats['failed'] += 1
+                    continue
+                stats[result] += 1
+                # 被替换的文件没有其他链接时，其占用的空间被释放
+                if result == 'deduplicated' and stat.st_nlink == 1:
+                    stats['saved_bytes'] += stat.st_size
+        return stats
+
+_shared_stores = {}
+_shared_lock = threading.Lock()
+
+def get_shared_store(root=BLOB_ROOT):
+    """按目录返回进程内共享的内容存储"""
+    with _shared_lock:
+        store = _shared_stores.get(root)
+        if store is None:
+            store = BlobStore(root)
+            _shared_stores[root] = store
+        return store
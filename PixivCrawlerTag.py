@@ -1,34 +1,71 @@
 import requests
-import json
 import os
-import time
-import re
 import argparse
 import configparser
+from urllib.parse import urlencode, quote
+from PixivCrawlerPool import default_workers
+from PixivCrawlerBase import PixivBaseCrawler
+from PixivCrawlerEvents import PAGE_FETCHED, DETAILS_FETCHED, ARTWORK_FILTERED, ARTWORK_QUEUED
+from PixivCrawlerProgress import ProgressReporter, STATUS_INTERVAL
+from PixivCrawlerMetrics import MetricsExporter, EXPORT_INTERVAL
+from PixivCrawlerCassette import cassette_transport, close_cassette_transport
+from PixivCrawlerStore import BlobStore
 
-sleep_time = 0.5
+# 直接交给Pixiv搜索接口处理的筛选条件，减少需要翻阅的页数
+DEFAULT_SEARCH_OPTIONS = {
+    'order': 'date_d',              # date_d 最新优先 / date 最早优先 / popular_d 热门优先（需要高级会员）
+    'mode': 'all',                  # all 全部 / safe 全年龄 / r18 仅R-18
+    'type': 'illust_and_ugoira',    # all / illust_and_ugoira / illust / manga / ugoira，漫画在客户端也会被过滤
+    'exclude_ai': True,             # 排除AI生成作品
+    'start_date': None,             # 投稿日期起点 YYYY-MM-DD
+    'end_date': None,               # 投稿日期终点 YYYY-MM-DD
+}
 
-class PixivTagCrawler:
-    def __init__(self, cookie, save_path=None):
-        self.session = requests.Session()
-        self.session.verify = False  # 禁用SSL验证
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36',
-            'Referer': 'https://www.pixiv.net/',
-            'Cookie': cookie
-        }
-        # 使用传入的保存路径或默认路径
-        self.save_path = save_path if save_path else 'pixiv_images'
-        if not os.path.exists(self.save_path):
-            os.makedirs(self.save_path)
+# 筛选和下载用到的作品详情字段，缓存中缺少任一字段时重新获取详情
+DETAIL_FIELDS = ('title', 'urls', 'pageCount', 'tags', 'bookmarkCount', 'aiType')
 
-    def get_artworks_by_tag(self, tag, min_bookmarks=1000, page=1):
+class PixivTagCrawler(PixivBaseCrawler):
+    def __init__(self, cookie, save_path=None, workers=default_workers, transport=None, db=None, search_options=None, store=None):
+        super().__init__(cookie, save_path, workers, transport, db, store)
+        # 搜索参数
+        self.search_options = dict(DEFAULT_SEARCH_OPTIONS)
+        if search_options:
+            self.search_options.update(search_options)
+
+    def search_url(self, tag, page):
+        """根据搜索参数生成搜索接口URL"""
+        options = self.search_options
+        params = {
+            'word': tag,
+            'order': options['order'],
+            'mode': options['mode'],
+            'p': page,
+            's_mode': 's_tag',
+            'type': options['type'],
+            'lang': 'zh',
+        }
+        if options['exclude_ai']:
+            params['ai_type'] = 1
+        if options['start_date']:
+            params['scd'] = options['start_date']
+        if options['end_date']:
+            params['ecd'] = options['end_date']
+        
         # URL编码标签名称
         encoded_tag = requests.utils.quote(tag)
-        url = f'https://www.pixiv.net/ajax/search/artworks/{encoded_tag}?word={encoded_tag}&order=date_d&mode=all&p={page}&s_mode=s_tag&type=all&lang=zh'
+        return f'https://www.pixiv.net/ajax/search/artworks/{encoded_tag}?{urlencode(params, quote_via=quote)}'
+
+    def get_artworks_by_tag(self, tag, min_bookmarks=1000, page=1):
+        """获取一页搜索结果并下载符合条件的作品，返回 (下载数, 作品总数)；页面获取失败时作品总数为None"""
+        url = self.search_url(tag, page)
         
         print(f'正在获取第{page}页的作品...')
-        response = self.session.get(url, headers=self.headers, verify=False)
+        try:
+            response = self.transport.get(url)
+        except requests.exceptions.RequestException as e:
+            print(f'第 {page} 页请求异常: {str(e)}')
+            self.retry_queue.put(f'第 {page} 页搜索结果', self.retry_search_page, tag, min_bookmarks, page)
+            return 0, None
         
         downloaded_count = 0
         
@@ -38,48 +75,25 @@ class PixivTagCrawler:
                 artworks = data['body']['illustManga']['data']
                 
                 print(f"本页共找到 {len(artworks)} 个作品")
+                self.events.publish(PAGE_FETCHED, page=page, count=len(artworks))
                 
-                # 获取所有作品ID并处理
-                artwork_ids = [artwork['id'] for artwork in artworks]
+                # 先用搜索结果中的字段初步筛选，只为通过的作品获取详情
+                artwork_ids = self.select_candidates(artworks)
                 
+                futures = []
                 for artwork_id in artwork_ids:
                     # 获取每个作品的详细信息以获取准确的收藏数
                     details = self.get_artwork_details(artwork_id)
-                    if details:
-                        if details.get('ai_detected', False):
-                            print(f"作品ID: {artwork_id} 被检测为AI生成")
-                            continue
-                        
-                        bookmark_count = details.get('bookmarkCount', 0)
-                        print(f"作品ID: {artwork_id}, 收藏数: {bookmark_count}")
-                        
-                        # 检查收藏数是否达到要求
-                        if bookmark_count >= min_bookmarks:
-                            # 检查是否为AI生成的作品
-                            tags = details.get('tags', {}).get('tags', [])
-                            
-                            # 检查是否为漫画作品（页数>10或包含漫画标签）
-                            is_manga = details.get('pageCount', 0) > 10 or self.has_manga_tags(tags)
-                            if is_manga:
-                                print(f"  ✗ 漫画作品，跳过下载")
-                                continue
-                            
-                            if not self.is_ai_generated_from_tags(tags):
-                                print(f"  ✓ 符合要求，开始下载...")
-                                # 立即下载符合条件的作品
-                                success = self.download_artwork(artwork_id, details)
-                                if success:
-                                    downloaded_count += 1
-                                    print(f"  ✓ 下载成功！")
-                                else:
-                                    print(f"  ✗ 下载失败")
-                            else:
-                                print(f"  ✗ AI生成作品")
-                        else:
-                            print(f"  ✗ 收藏数不足")
-                    
-                    # 添加延时避免请求过于频繁
-                    time.sleep(sleep_time)
+                    if not details:
+                        self.retry_queue.put(f'作品 {artwork_id} 详情', self.retry_artwork, artwork_id, min_bookmarks)
+                    elif self.check_artwork(artwork_id, details, min_bookmarks) is None:
+                        print(f"  ✓ 符合要求，加入下载队列...")
+                        self.events.publish(ARTWORK_QUEUED, artwork_id=artwork_id)
+                        # 交给下载线程池并发下载
+                        futures.append(self.pool.submit(self.download_and_report, artwork_id, details))
+                
+                # 等待本页所有下载任务完成
+                downloaded_count = self.pool.wait_all(futures)
                 
                 return downloaded_count, data['body']['illustManga']['total']
         
@@ -89,7 +103,88 @@ class PixivTagCrawler:
         except:
             print("无法解析响应")
         
-        return 0, 0
+        self.retry_queue.put(f'第 {page} 页搜索结果', self.retry_search_page, tag, min_bookmarks, page)
+        return 0, None
+
+    def retry_search_page(self, tag, min_bookmarks, page):
+        """重新获取失败的搜索结果页，页面获取成功时返回True"""
+        _, total = self.get_artworks_by_tag(tag, min_bookmarks, page)
+        return total is not None
+
+    def retry_artwork(self, artwork_id, min_bookmarks):
+        """重新获取详情失败的作品，筛选通过后下载"""
+        details = self.get_artwork_details(artwork_id)
+        if not details:
+            self.retry_queue.put(f'作品 {artwork_id} 详情', self.retry_artwork, artwork_id, min_bookmarks)
+            return False
+        if self.check_artwork(artwork_id, details, min_bookmarks) is not None:
+            return False
+        self.events.publish(ARTWORK_QUEUED, artwork_id=artwork_id)
+        return self.download_and_report(artwork_id, details)
+
+    def prefilter_search_item(self, item):
+        """用搜索结果列表中已有的字段（aiType、pageCount、tags）初步筛选，通过时返回None，否则返回原因"""
+        if 'id' not in item:
+            # 广告位等非作品条目
+            return 'not_artwork'
+        
+        artwork_id = item['id']
+        if item.get('aiType') == 2:
+            print(f"作品ID: {artwork_id} 搜索结果标记为AI生成，跳过")
+            return 'ai'
+        
+        if item.get('pageCount', 0) > 10 or self.has_manga_tags(item.get('tags', [])):
+            print(f"作品ID: {artwork_id} 搜索结果判断为漫画作品，跳过")
+            return 'manga'
+        
+        return None
+
+    def select_candidates(self, artworks):
+        """返回通过初步筛选、需要获取详情的作品ID列表"""
+        artwork_ids = []
+        for artwork in artworks:
+            reason = self.prefilter_search_item(artwork)
+            if reason is None:
+                artwork_ids.append(artwork['id'])
+            elif reason != 'not_artwork':
+                self.events.publish(ARTWORK_FILTERED, artwork_id=artwork['id'], reason=reason, stage='search')
+        print(f"初步筛选后 {len(artwork_ids)}/{len(artworks)} 个作品需要获取详情")
+        return artwork_ids
+
+    def check_artwork(self, artwork_id, details, min_bookmarks):
+        """检查作品是否符合下载条件，符合时返回None，否则返回不符合的原因并发布过滤事件"""
+        reason = self.filter_reason(artwork_id, details, min_bookmarks)
+        if reason is not None:
+            self.events.publish(ARTWORK_FILTERED, artwork_id=artwork_id, reason=reason, stage='details')
+        return reason
+
+    def filter_reason(self, artwork_id, details, min_bookmarks):
+        if details.get('ai_detected', False):
+            print(f"作品ID: {artwork_id} 被检测为AI生成")
+            return 'ai'
+        
+        bookmark_count = details.get('bookmarkCount', 0)
+        print(f"作品ID: {artwork_id}, 收藏数: {bookmark_count}")
+        
+        # 检查收藏数是否达到要求
+        if bookmark_count < min_bookmarks:
+            print(f"  ✗ 收藏数不足")
+            return 'bookmarks'
+        
+        tags = details.get('tags', {}).get('tags', [])
+        
+        # 检查是否为漫画作品（页数>10或包含漫画标签）
+        is_manga = details.get('pageCount', 0) > 10 or self.has_manga_tags(tags)
+        if is_manga:
+            print(f"  ✗ 漫画作品，跳过下载")
+            return 'manga'
+        
+        # 检查是否为AI生成的作品
+        if self.is_ai_generated_from_tags(tags):
+            print(f"  ✗ AI生成作品")
+            return 'ai'
+        
+        return None
 
     def is_ai_generated_from_tags(self, tags):
         # 这个方法已不再需要检查标签，因为我们直接使用aiType字段
@@ -100,7 +195,8 @@ class PixivTagCrawler:
         """检查作品标签中是否包含漫画相关标签"""
         manga_keywords = ['漫画', '4コマ', '4格漫画', 'comic', 'manga', 'Comics']
         for tag in tags:
-            tag_name = tag.get('tag', '').lower()
+            # 作品详情中的标签是字典，搜索结果中的标签是字符串
+            tag_name = (tag.get('tag', '') if isinstance(tag, dict) else tag).lower()
             for keyword in manga_keywords:
                 if keyword.lower() in tag_name:
                     print(f"  发现漫画标签: {tag_name}")
@@ -108,31 +204,45 @@ class PixivTagCrawler:
         return False
 
     def get_artwork_details(self, artwork_id):
-        url = f'https://www.pixiv.net/ajax/illust/{artwork_id}'
-        response = self.session.get(url, headers=self.headers)
-        if response.status_code == 200:
-            data = response.json()
-            if data['error'] == False:
-                # 获取详细信息
-                details = data['body']
-                
-                # 检查aiType字段，如果值为2则标记为AI生成
-                if details.get('aiType') == 2:
-                    print(f"  ✗ Pixiv标记为AI生成作品 (aiType=2)")
-                    details['ai_detected'] = True
-                    return details
-                        
-                return details
-        return None
+        with self.claim('details', artwork_id):
+            # 筛选需要最新的收藏数，缓存按统计字段的有效期判断
+            details = self.db.get_artwork_details(artwork_id, DETAIL_FIELDS)
+            if details is not None:
+                self.events.publish(DETAILS_FETCHED, artwork_id=artwork_id, cached=True)
+                return self.mark_ai_generated(details)
+        
+            url = f'https://www.pixiv.net/ajax/illust/{artwork_id}'
+            try:
+                response = self.transport.get(url)
+            except requests.exceptions.RequestException as e:
+                print(f'作品 {artwork_id} 详情请求异常: {str(e)}')
+                return None
+            if response.status_code == 200:
+                data = response.json()
+                if data['error'] == False:
+                    # 获取详细信息
+                    self.db.save_artwork_details(artwork_id, data['body'])
+                    self.events.publish(DETAILS_FETCHED, artwork_id=artwork_id, cached=False)
+                    return self.mark_ai_generated(data['body'])
+            return None
+
+    def mark_ai_generated(self, details):
+        # 检查aiType字段，如果值为2则标记为AI生成
+        if details.get('aiType') == 2:
+            print(f"  ✗ Pixiv标记为AI生成作品 (aiType=2)")
+            details['ai_detected'] = True
+        return details
+
+    def filename_suffix(self, details):
+        # 标签模式的单页作品文件名附带收藏数
+        return f"_{details.get('bookmarkCount', 0)}"
 
     def download_image(self, url, filename):
         try:
             print(f'开始下载: {url}')
-            response = self.session.get(url, headers=self.headers)
-            if response.status_code == 200:
-                file_path = os.path.join(self.save_path, filename)
-                with open(file_path, 'wb') as f:
-                    f.write(response.content)
+            file_path = os.path.join(self.save_path, filename)
+            response, size = self.transport.download(url, file_path)
+            if size is not None:
                 print(f'下载完成: {filename}')
                 return True
             else:
@@ -142,154 +252,6 @@ class PixivTagCrawler:
             print(f'下载出错: {filename}，错误: {str(e)}')
             return False
 
-    def download_artwork(self, artwork_id, details=None):
-        if details is None:
-            details = self.get_artwork_details(artwork_id)
-        
-        if details:
-            bookmark_count = details.get('bookmarkCount', 0)
-            try:
-                # 检查是否为多页作品
-                if details.get('pageCount', 1) > 1:
-                    # 多页作品需要使用不同的API端点
-                    return self.download_multi_page_artwork(artwork_id, details)
-                else:
-                    # 单页作品直接下载原图
-                    original_url = details['urls']['original']
-                    
-                    # 打印URL以便调试
-                    print(f"  原始图片URL: {original_url}")
-                    
-                    # 确保Referer头部正确设置
-                    custom_headers = {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36',
-                        'Referer': f'https://www.pixiv.net/artworks/{artwork_id}',
-                        'Accept': 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8',
-                        'Accept-Language': 'zh-CN,zh;q=0.9,en-US;q=0.8,en;q=0.7,ja;q=0.6',
-                        'sec-ch-ua': '"Chromium";v="96", "Google Chrome";v="96", ";Not A Brand";v="99"',
-                        'sec-ch-ua-mobile': '?0',
-                        'sec-ch-ua-platform': '"Windows"',
-                        'sec-fetch-dest': 'image',
-                        'sec-fetch-mode': 'no-cors',
-                        'sec-fetch-site': 'cross-site'
-                    }
-                    
-                    # 添加原始Cookie
-                    for key, value in [item.split('=', 1) for item in self.headers.get('Cookie', '').split('; ') if '=' in item]:
-                        custom_headers[key] = value
-                    
-                    title = details.get('title', artwork_id)
-                    # 移除文件名中的非法字符
-                    safe_title = re.sub(r'[\\/*?:"<>|]', "", title)
-                    filename = f"{artwork_id}_{safe_title}_{bookmark_count}.{original_url.split('.')[-1]}"
-                    
-                    # 限制文件名长度
-                    if len(filename) > 200:
-                        filename = f"{artwork_id}_{bookmark_count}.{original_url.split('.')[-1]}"
-                    
-                    print(f"  尝试下载: {filename}")
-                    try:
-                        # 使用会话保持cookie
-                        with requests.Session() as session:
-                            for key, value in custom_headers.items():
-                                session.headers[key] = value
-                                
-                            response = session.get(original_url, timeout=30)
-                            if response.status_code == 200:
-                                file_path = os.path.join(self.save_path, filename)
-                                with open(file_path, 'wb') as f:
-                                    f.write(response.content)
-                                print(f'  下载完成: {filename}, 大小: {len(response.content)} 字节')
-                                return True
-                            else:
-                                print(f'  下载失败: HTTP状态码 {response.status_code}')
-                                print(f'  响应头: {response.headers}')
-                                if response.status_code == 403:
-                                    print('  可能是Referer检查失败或Cookie无效')
-                    except requests.exceptions.RequestException as e:
-                        print(f'  请求异常: {str(e)}')
-            except Exception as e:
-                print(f'处理作品 {artwork_id} 时出错: {str(e)}')
-                import traceback
-                traceback.print_exc()
-        return False
-
-    def download_multi_page_artwork(self, artwork_id, details):
-        try:
-            # 获取多页作品的所有页面
-            page_count = details.get('pageCount', 0)
-            bookmark_count = details.get('bookmarkCount', 0)
-            title = details.get('title', artwork_id)
-            safe_title = re.sub(r'[\\/*?:"<>|]', "", title)
-            
-            # 打印调试信息
-            print(f"  多页作品, 共 {page_count} 页")
-            
-            # 确保Referer头部正确设置
-            custom_headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36',
-                'Referer': f'https://www.pixiv.net/artworks/{artwork_id}',
-                'Accept': 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8',
-                'Accept-Language': 'zh-CN,zh;q=0.9,en-US;q=0.8,en;q=0.7,ja;q=0.6',
-                'sec-ch-ua': '"Chromium";v="96", "Google Chrome";v="96", ";Not A Brand";v="99"',
-                'sec-ch-ua-mobile': '?0',
-                'sec-ch-ua-platform': '"Windows"',
-                'sec-fetch-dest': 'image',
-                'sec-fetch-mode': 'no-cors',
-                'sec-fetch-site': 'cross-site'
-            }
-            
-            # 添加原始Cookie
-            for key, value in [item.split('=', 1) for item in self.headers.get('Cookie', '').split('; ') if '=' in item]:
-                custom_headers[key] = value
-            
-            # 获取多页作品的图片URL模式
-            original_url = details['urls']['original']
-            print(f"  原始URL: {original_url}")
-            
-            base_url_parts = original_url.rsplit('_p0', 1)
-            if len(base_url_parts) != 2:  # 无法拆分URL
-                print(f"  无法获取多页作品 {artwork_id} 的URL模式")
-                return False
-            
-            base_url = base_url_parts[0]
-            extension = base_url_parts[1]  # 包括.jpg/.png等扩展名
-            
-            success = False
-            for i in range(page_count):
-                page_url = f"{base_url}_p{i}{extension}"
-                short_filename = f"{artwork_id}_p{i}{extension}"
-                
-                print(f"  尝试下载第 {i+1}/{page_count} 页: {page_url}")
-                
-                try:
-                    with requests.Session() as session:
-                        for key, value in custom_headers.items():
-                            session.headers[key] = value
-                        
-                        response = session.get(page_url, timeout=30)
-                        if response.status_code == 200:
-                            file_path = os.path.join(self.save_path, short_filename)
-                            with open(file_path, 'wb') as f:
-                                f.write(response.content)
-                            print(f'  下载完成: {short_filename}, 大小: {len(response.content)} 字节')
-                            success = True
-                        else:
-                            print(f'  下载失败: HTTP状态码 {response.status_code}')
-                            if response.status_code == 403:
-                                print('  可能是Referer检查失败或Cookie无效')
-                except requests.exceptions.RequestException as e:
-                    print(f'  请求异常: {str(e)}')
-                
-                time.sleep(sleep_time)  # 避免请求过快
-            
-            return success
-        except Exception as e:
-            print(f'处理多页作品 {artwork_id} 时出错: {str(e)}')
-            import traceback
-            traceback.print_exc()
-            return False
-
     def crawl_tag_artworks(self, tag, min_bookmarks=1000, max_pages=5):
         print(f'开始获取标签 "{tag}" 下收藏数超过 {min_bookmarks} 的非AI作品...')
         
@@ -301,7 +263,7 @@ class PixivTagCrawler:
             downloaded_count, total = self.get_artworks_by_tag(tag, min_bookmarks, page)
             total_downloaded += downloaded_count
             
-            if page == 1:
+            if page == 1 and total is not None:
                 total_artworks = total
                 print(f'该标签下共有 {total} 个作品，正在筛选并下载符合条件的作品...')
             
@@ -311,12 +273,13 @@ class PixivTagCrawler:
                 print(f'第 {page} 页没有找到符合条件的作品，尝试下一页')
             
             page += 1
-            time.sleep(3)  # 页面之间的延时
             
             if page > max_pages:
                 print(f'已达到设定的最大页数 {max_pages}')
                 break
         
+        # 重试失败队列中的作品和页面
+        self.retry_failed()
         print(f'爬取完成！共下载 {total_downloaded} 个作品')
 
 def main():
@@ -326,6 +289,21 @@ def main():
     parser.add_argument('--bookmarks', '-b', type=int, help='最小收藏数')
     parser.add_argument('--cookie', '-c', type=str, help='Pixiv的Cookie，留空则使用配置文件中的值')
     parser.add_argument('--pages', '-p', type=int, help='爬取的最大页数')
+    parser.add_argument('--workers', '-w', type=int, default=default_workers, help=f'并发下载线程数（默认: {default_workers}）')
+    parser.add_argument('--engine', '-e', choices=['sync', 'async', 'pipeline'], default='sync', help='爬取引擎：sync为多线程，async为asyncio（需要安装aiohttp），pipeline为分阶段流水线')
+    parser.add_argument('--detail-workers', type=int, default=2, help='流水线模式下获取作品详情的线程数（默认: 2）')
+    parser.add_argument('--order', choices=['date_d', 'date', 'popular_d'], default=DEFAULT_SEARCH_OPTIONS['order'], help='排序方式：date_d最新优先，date最早优先，popular_d热门优先（需要高级会员）')
+    parser.add_argument('--mode', choices=['all', 'safe', 'r18'], default=DEFAULT_SEARCH_OPTIONS['mode'], help='年龄限制：all全部，safe全年龄，r18仅R-18')
+    parser.add_argument('--type', choices=['all', 'illust_and_ugoira', 'illust', 'manga', 'ugoira'], default=DEFAULT_SEARCH_OPTIONS['type'], help='作品类型（默认: illust_and_ugoira）')
+    parser.add_argument('--include-ai', action='store_true', help='搜索时不排除AI生成作品（客户端仍会按aiType过滤）')
+    parser.add_argument('--start-date', type=str, help='投稿日期起点，格式 YYYY-MM-DD')
+    parser.add_argument('--end-date', type=str, help='投稿日期终点，格式 YYYY-MM-DD')
+    parser.add_argument('--progress-interval', type=float, default=STATUS_INTERVAL, help=f'在标准错误输出进度状态行的间隔秒数，0为不输出（默认: {STATUS_INTERVAL:g}）')
+    parser.add_argument('--metrics', type=str, help='指标文件路径，.json为JSON快照，其他扩展名为Prometheus文本格式')
+    parser.add_argument('--record', type=str, metavar='DIR', help='录制模式：把所有API和图片响应保存到指定目录，供之后离线回放')
+    parser.add_argument('--replay', type=str, metavar='DIR', help='回放模式：从录制目录返回响应，不访问Pixiv')
+    parser.add_argument('--replay-speed', type=float, default=1.0, help='回放速度倍数，1为按录制时的耗时，0为不等待（默认: 1）')
+    parser.add_argument('--metrics-interval', type=float, default=EXPORT_INTERVAL, help=f'爬取过程中写出指标文件的间隔秒数，0为只在结束时写出（默认: {EXPORT_INTERVAL:g}）')
     
     # 解析命令行参数
     args = parser.parse_args()
@@ -374,13 +352,61 @@ def main():
     # 如果命令行没有提供Cookie，使用配置文件中的值
     cookie = args.cookie if args.cookie else default_cookie
     
-    if not cookie:
+    if not cookie and not args.replay:
         print('错误：未找到Cookie配置。请在config.ini文件中设置cookie，或通过命令行参数提供。')
         return
     
     # 实例化爬虫并开始爬取
-    crawler = PixivTagCrawler(cookie)
-    crawler.crawl_tag_artworks(tag=tag, min_bookmarks=bookmarks, max_pages=pages)
+    search_options = {
+        'order': args.order,
+        'mode': args.mode,
+        'type': args.type,
+        'exclude_ai': not args.include_ai,
+        'start_date': args.start_date,
+        'end_date': args.end_date,
+    }
+    
+    # 录制或回放时使用单独的传输层和空数据库
+    transport = db = workdir = save_path = store = None
+    if args.record or args.replay:
+        if args.engine == 'async':
+            print('错误：录制和回放只支持 sync 和 pipeline 引擎')
+            return
+        transport, db, workdir = cassette_transport(cookie, args.record, args.replay, args.replay_speed)
+        if args.replay:
+            save_path = os.path.join(workdir, 'images')
+            store = BlobStore(os.path.join(workdir, '.blobs'))
+    
+    if args.engine == 'async':
+        try:
+            from PixivCrawlerTagAsync import AsyncPixivTagCrawler
+        except ImportError as e:
+            print(f'错误：异步引擎需要安装aiohttp ({str(e)})')
+            return
+        crawler = AsyncPixivTagCrawler(cookie, concurrency=args.workers, search_options=search_options)
+    else:
+        crawler = PixivTagCrawler(cookie, save_path, workers=args.workers, transport=transport, db=db, search_options=search_options, store=store)
+    
+    # 定时输出请求速率、下载速度、队列长度等进度信息
+    reporter = ProgressReporter(args.progress_interval).start() if args.progress_interval > 0 else None
+    # 按接口类别统计延迟、响应大小、状态码和限速等待时间
+    exporter = MetricsExporter(args.metrics, args.metrics_interval).start() if args.metrics else None
+    try:
+        if args.engine == 'pipeline':
+            from PixivCrawlerPipeline import TagPipeline
+            pipeline = TagPipeline(crawler, detail_workers=args.detail_workers, download_workers=args.workers)
+            pipeline.run(tag=tag, min_bookmarks=bookmarks, max_pages=pages)
+        else:
+            crawler.crawl_tag_artworks(tag=tag, min_bookmarks=bookmarks, max_pages=pages)
+    finally:
+        # 爬取出错时也要停止进度和指标线程，并写出最后一次指标
+        crawler.shutdown()
+        if reporter:
+            reporter.stop()
+        if exporter:
+            exporter.stop()
+        if workdir:
+            close_cassette_transport(transport, db, workdir)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
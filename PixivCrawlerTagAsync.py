@@ -0,0 +1,314 @@
+import asyncio
+import functools
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+
+import aiohttp
+
+from PixivCrawlerPool import default_workers
+from PixivCrawlerTag import PixivTagCrawler, DETAIL_FIELDS
+from PixivCrawlerTransport import (
+    HOST_LIMITS, CHUNK_SIZE, parse_content_range, load_part_meta, save_part_meta, remove_part,
+)
+from PixivCrawlerRateLimit import parse_retry_after, classify_endpoint
+from PixivCrawlerEvents import (
+    REQUEST_FINISHED, PAGE_FETCHED, DETAILS_FETCHED, ARTWORK_QUEUED, DOWNLOAD_STARTED, DOWNLOAD_FINISHED,
+    DISK_WRITE,
+)
+
+# aiohttp中视为网络错误、可以重试的异常
+NETWORK_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+# 同时处理的搜索页数，每页的作品全部处理完才开始下一页
+PAGE_CONCURRENCY = 2
+# 执行数据库读写、文件哈希和链接等阻塞操作的线程数，避免阻塞事件循环
+BLOCKING_WORKERS = 4
+
+class AsyncPixivTagCrawler(PixivTagCrawler):
+    """asyncio版标签爬虫：搜索页、作品详情和图片下载都作为协程在同一个事件循环中并发执行
+
+    筛选条件（最小收藏数、aiType、漫画判断）与 PixivTagCrawler 完全相同。
+    数据库、哈希和文件链接等阻塞操作在单独的线程池中执行；图片先写入 .part 文件，
+    与同步引擎使用相同的断点续传记录，中断后可以由任一引擎继续下载。
+    """
+
+    def __init__(self, cookie, save_path=None, concurrency=default_workers, transport=None, search_options=None, db=None, store=None):
+        super().__init__(cookie, save_path, transport=transport, search_options=search_options, db=db, store=store)
+        # 图片CDN的并发请求数，API请求仍按 HOST_LIMITS 限制
+        self.concurrency = max(1, int(concurrency))
+        self.aio_session = None
+        self.host_semaphores = {}
+        self.page_semaphore = None
+        self.executor = None
+        # 同一目标文件的下载在事件循环内互斥，避免两个协程写同一个分段文件
+        self.file_locks = {}
+
+    async def blocking(self, func, *args):
+        """在线程池中执行阻塞函数"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args))
+
+    @asynccontextmanager
+    async def host_slot(self, url):
+        """按限速器等待后占用目标主机的一个并发名额，未配置限制的主机不受约束"""
+        _, wait = self.transport.limiter.reserve(url)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        semaphore = self.host_semaphores.get(urlparse(url).hostname)
+        if semaphore is None:
+            yield
+            return
+        async with semaphore:
+            yield
+
+    def crawl_tag_artworks(self, tag, min_bookmarks=1000, max_pages=5):
+        total_downloaded = asyncio.run(self.crawl_tag_artworks_async(tag, min_bookmarks, max_pages))
+        # 失败队列中的任务用同步方式再重试一轮
+        self.retry_failed()
+        return total_downloaded
+
+    async def crawl_tag_artworks_async(self, tag, min_bookmarks=1000, max_pages=5):
+        print(f'开始获取标签 "{tag}" 下收藏数超过 {min_bookmarks} 的非AI作品（异步模式）...')
+
+        limits = dict(HOST_LIMITS)
+        limits['i.pximg.net'] = self.concurrency
+        self.host_semaphores = {host: asyncio.Semaphore(limit) for host, limit in limits.items()}
+        self.page_semaphore = asyncio.Semaphore(PAGE_CONCURRENCY)
+        self.file_locks = {}
+
+        connector = aiohttp.TCPConnector(limit=sum(limits.values()), ssl=False)  # 禁用SSL验证
+        timeout = aiohttp.ClientTimeout(sock_connect=self.transport.timeout, sock_read=self.transport.timeout)
+        self.executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix='pixiv-async-io')
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                self.aio_session = session
+                results = await asyncio.gather(*(
+                    self.get_artworks_by_tag_async(tag, min_bookmarks, page) for page in range(1, max_pages + 1)
+                ))
+        finally:
+            self.aio_session = None
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+        total_downloaded = sum(downloaded_count for downloaded_count, _ in results)
+        if results:
+            print(f'该标签下共有 {results[0][1]} 个作品')
+        print(f'已达到设定的最大页数 {max_pages}')
+        print(f'爬取完成！共下载 {total_downloaded} 个作品')
+        return total_downloaded
+
+    async def request(self, url, headers, read, ok_statuses=(200,)):
+        """按限速器、熔断器和重试策略发送请求，ok_statuses中的响应交给read协程读取，返回 (状态码, read的结果)
+
+        headers可以是每次重试前调用的函数，用于续传时按当前偏移生成Range请求头。
+        """
+        async def attempt():
+            async with self.host_slot(url):
+                started = time.monotonic()
+                request_headers = headers() if callable(headers) else headers
+                try:
+                    async with self.aio_session.get(self.transport.resolve(url), headers=request_headers) as response:
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                        self.transport.limiter.report(url, response.status, retry_after=retry_after)
+                        self.report_request(url, response.status, started, response.content_length)
+                        if response.status not in ok_statuses:
+                            return response.status, retry_after, None
+                        return response.status, retry_after, await read(response)
+                except NETWORK_ERRORS:
+                    self.transport.limiter.report(url, error=True)
+                    self.report_request(url, None, started, None)
+                    raise
+        return await self.transport.retry.call_async(url, attempt, NETWORK_ERRORS)
+
+    def report_request(self, url, status, started, size):
+        self.events.publish(REQUEST_FINISHED, url=url, endpoint=classify_endpoint(url),
+                            status=status, latency=time.monotonic() - started, bytes=size)
+
+    async def fetch_json(self, url):
+        """请求API并返回JSON，失败时返回None"""
+        async def read(response):
+            return await response.json(content_type=None)
+        try:
+            status, data = await self.request(url, self.transport.api_headers, read)
+        except (NETWORK_ERRORS + (ValueError,)) as e:
+            print(f"请求异常: {url} {str(e)}")
+            return None
+        if status != 200:
+            print(f"请求失败: {status} {url}")
+            return None
+        return data
+
+    async def get_artworks_by_tag_async(self, tag, min_bookmarks, page):
+        async with self.page_semaphore:
+            return await self.process_page(tag, min_bookmarks, page)
+
+    async def process_page(self, tag, min_bookmarks, page):
+        print(f'正在获取第{page}页的作品...')
+        data = await self.fetch_json(self.search_url(tag, page))
+        if not data or data['error'] != False:
+            print(f'第 {page} 页获取失败')
+            self.retry_queue.put(f'第 {page} 页搜索结果', self.retry_search_page, tag, min_bookmarks, page)
+            return 0, 0
+
+        artworks = data['body']['illustManga']['data']
+        print(f"第 {page} 页共找到 {len(artworks)} 个作品")
+        self.events.publish(PAGE_FETCHED, page=page, count=len(artworks))
+
+        results = await asyncio.gather(*(
+            self.process_artwork(artwork_id, min_bookmarks) for artwork_id in self.select_candidates(artworks)
+        ))
+        downloaded_count = sum(1 for success in results if success)
+        print(f'第 {page} 页已下载 {downloaded_count} 个符合条件的作品')
+        return downloaded_count, data['body']['illustManga']['total']
+
+    async def get_artwork_details_async(self, artwork_id):
+        details = await self.blocking(self.db.get_artwork_details, artwork_id, DETAIL_FIELDS)
+        if details is not None:
+            self.events.publish(DETAILS_FETCHED, artwork_id=artwork_id, cached=True)
+            return self.mark_ai_generated(details)
+        
+        data = await self.fetch_json(f'https://www.pixiv.net/ajax/illust/{artwork_id}')
+        if data and data['error'] == False:
+            await self.blocking(self.db.save_artwork_details, artwork_id, data['body'])
+            self.events.publish(DETAILS_FETCHED, artwork_id=artwork_id, cached=False)
+            return self.mark_ai_generated(data['body'])
+        return None
+
+    async def get_artwork_pages_async(self, artwork_id, details):
+        """get_artwork_pages 的协程版本，失败时返回None"""
+        data = await self.fetch_json(f'https://www.pixiv.net/ajax/illust/{artwork_id}/pages')
+        if data and data['error'] == False:
+            return await self.blocking(self.save_artwork_pages, artwork_id, details, data['body'])
+        return None
+
+    async def process_artwork(self, artwork_id, min_bookmarks):
+        """获取详情、筛选并下载一个作品，下载成功返回True；出错的作品计为失败，不影响其他作品"""
+        try:
+            return await self.process_artwork_once(artwork_id, min_bookmarks)
+        except Exception as e:
+            print(f'处理作品 {artwork_id} 时出错: {str(e)}')
+            traceback.print_exc()
+            self.report_artwork(artwork_id, False)
+            return False
+
+    async def process_artwork_once(self, artwork_id, min_bookmarks):
+        details = await self.get_artwork_details_async(artwork_id)
+        if not details:
+            self.retry_queue.put(f'作品 {artwork_id} 详情', self.retry_artwork, artwork_id, min_bookmarks)
+            return False
+        if self.check_artwork(artwork_id, details, min_bookmarks) is not None:
+            return False
+
+        if details.get('pageCount', 1) > 1 and 'pages' not in details:
+            # 在事件循环中获取分页信息，build_download_jobs 不再发送同步请求
+            details['pages'] = await self.get_artwork_pages_async(artwork_id, details)
+        jobs = self.build_download_jobs(artwork_id, details)
+        if not jobs:
+            print(f"  无法获取多页作品 {artwork_id} 的URL模式")
+            return False
+
+        self.events.publish(ARTWORK_QUEUED, artwork_id=artwork_id)
+        results = await asyncio.gather(*(
+            self.download_file_async(artwork_id, url, filename, page) for page, (url, filename) in enumerate(jobs)
+        ))
+        success = any(results)
+        self.report_artwork(artwork_id, success)
+        return success
+
+    async def download_file_async(self, artwork_id, url, filename, page=0):
+        """流式下载单个图片，与同步引擎相同地写入 .part 分段文件并支持断点续传，完成后原子重命名"""
+        file_path = os.path.join(self.save_path, filename)
+        lock = self.file_locks.setdefault(file_path, asyncio.Lock())
+        async with lock:
+            return await self.download_part_async(artwork_id, url, file_path, filename, page)
+
+    async def download_part_async(self, artwork_id, url, file_path, filename, page):
+        if await self.blocking(self.find_downloaded, artwork_id, page, file_path):
+            return True
+        part_path = file_path + '.part'
+        meta_path = part_path + '.json'
+        # 每次请求前读取分段文件的记录，重试时从已写入的偏移处继续
+        state = {}
+
+        def headers():
+            meta = load_part_meta(url, part_path, meta_path)
+            state['meta'] = meta
+            state['offset'] = os.path.getsize(part_path) if meta else 0
+            request_headers = dict(self.transport.image_headers_for(artwork_id))
+            # 续传按原始字节偏移计算，不接受压缩编码
+            request_headers['Accept-Encoding'] = 'identity'
+            if state['offset']:
+                request_headers['Range'] = f"bytes={state['offset']}-"
+                validator = meta.get('etag') or meta.get('last_modified')
+                if validator:
+                    request_headers['If-Range'] = validator
+            return request_headers
+
+        async def read(response):
+            offset = state['offset']
+            if response.status == 206:
+                start, total = parse_content_range(response.headers.get('Content-Range'))
+                if start != offset:
+                    remove_part(part_path, meta_path)
+                    raise aiohttp.ClientPayloadError(f'续传偏移不一致，重新下载: 请求 {offset}, 返回 {start}')
+                mode = 'ab'
+            else:
+                # 服务器不支持续传或文件已变化，从头下载
+                offset = 0
+                total = response.content_length
+                mode = 'wb'
+            meta = {
+                'url': url,
+                'offset': offset,
+                'total': total,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }
+            save_part_meta(meta_path, meta)
+            size = offset
+            write_time = 0.0
+            try:
+                with open(part_path, mode) as f:
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        write_started = time.monotonic()
+                        f.write(chunk)
+                        write_time += time.monotonic() - write_started
+                        size += len(chunk)
+            finally:
+                # 记录已写入的字节偏移，供后续续传
+                meta['offset'] = size
+                save_part_meta(meta_path, meta)
+            self.events.publish(DISK_WRITE, path=file_path, bytes=size - offset, latency=write_time)
+            if total is not None and size != total:
+                raise aiohttp.ClientPayloadError(f'下载不完整: 收到 {size} 字节, 应为 {total} 字节')
+            return size
+
+        self.events.publish(DOWNLOAD_STARTED, artwork_id=artwork_id, url=url)
+        started = time.monotonic()
+        status, size = None, None
+        try:
+            status, size = await self.request(url, headers, read, ok_statuses=(200, 206))
+            if status == 416 and state.get('offset') and state['offset'] == (state.get('meta') or {}).get('total'):
+                # 分段文件其实已经完整
+                status, size = 200, state['offset']
+            elif status == 416:
+                remove_part(part_path, meta_path)
+            if status in (200, 206):
+                await self.blocking(self.transport.finalize_download, file_path)
+                await self.blocking(self.record_downloaded, artwork_id, page, file_path, size)
+                print(f'  下载完成: {filename}, 大小: {size} 字节')
+                return True
+            print(f'  下载失败: {filename}, HTTP状态码 {status}')
+            if status == 403:
+                print('  可能是Referer检查失败或Cookie无效')
+        except (NETWORK_ERRORS + (OSError,)) as e:
+            # 分段文件保留，重试队列中的同步下载会从断点继续
+            print(f'  请求异常: {filename} {str(e)}')
+        finally:
+            self.events.publish(DOWNLOAD_FINISHED, artwork_id=artwork_id, url=url, bytes=size or 0,
+                                latency=time.monotonic() - started, success=status in (200, 206))
+        self.retry_queue.put(f'作品 {artwork_id} 第 {page} 页', self.download_file, artwork_id, url, filename, page)
+        return False
@@ -0,0 +1,115 @@
+import hashlib
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+# 预览缩略图的最大尺寸
+THUMBNAIL_SIZE = (400, 400)
+# 磁盘缩略图缓存目录
+THUMBNAIL_DIR = '.thumbnails'
+# 内存中最多保留的缩略图数量
+MEMORY_ITEMS = 64
+
+class ThumbnailLoader:
+    """在后台线程中生成预览缩略图
+
+    JPEG原图用draft模式按缩小后的分辨率解码，其他格式用thumbnail缩放。
+    生成的缩略图同时放入内存LRU缓存和磁盘缓存，再次预览同一张图片时不需要解码原图。
+    结果放入 results 队列，由图形界面主线程取出后创建 PhotoImage。
+    """
+
+    def __init__(self, size=THUMBNAIL_SIZE, cache_dir=THUMBNAIL_DIR, memory_items=MEMORY_ITEMS):
+        self.size = size
+        self.cache_dir = cache_dir
+        self.memory_items = memory_items
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self.worker, name='pixiv-thumbnail', daemon=True)
+        self.thread.start()
+
+    def cache_key(self, path):
+        """缓存键包含文件的修改时间和大小，原图变化后缓存自动失效"""
+        stat = os.stat(path)
+        raw = f'{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}|{self.size[0]}x{self.size[1]}'
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def request(self, path):
+        """请求生成缩略图；内存中已有时直接放入结果队列"""
+        try:
+            key = self.cache_key(path)
+        except OSError as e:
+            self.results.put((path, None, str(e)))
+            return
+        with self.lock:
+            image = self.memory.get(key)
+            if image is not None:
+                self.memory.move_to_end(key)
+        if image is not None:
+            self.results.put((path, image, None))
+        else:
+            self.requests.put((path, key))
+
+    def worker(self):
+        while True:
+            path, key = self.requests.get()
+            # 预览只关心最新的图片，跳过积压的旧请求
+            while True:
+                try:
+                    path, key = self.requests.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                image = self.load(path, key)
+            except Exception as e:
+                self.results.put((path, None, str(e)))
+                continue
+            with self.lock:
+                self.memory[key] = image
+                self.memory.move_to_end(key)
+                while len(self.memory) > self.memory_items:
+                    self.memory.popitem(last=False)
+            self.results.put((path, image, None))
+
+    def load(self, path, key):
+        """优先读取磁盘缓存，没有时解码原图并写入磁盘缓存"""
+        for extension in ('.jpg', '.png'):
+            cache_path = os.path.join(self.cache_dir, key + extension)
+            if os.path.exists(cache_path):
+                with Image.open(cache_path) as cached:
+                    cached.load()
+                    return cached.copy()
+
+        with Image.open(path) as image:
+            if image.format == 'JPEG':
+                # 按缩略图尺寸降低解码分辨率，大图解码量减少到原来的几十分之一
+                image.draft('RGB', self.size)
+            image.thumbnail(self.size, Image.Resampling.LANCZOS)
+            thumbnail = image.copy()
+
+        self.save(thumbnail, key)
+        return thumbnail
+
+    def save(self, thumbnail, key):
+        """写入磁盘缓存；带透明通道的图片保存为PNG，其余保存为JPEG"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if thumbnail.mode in ('RGBA', 'LA', 'P'):
+            cache_path = os.path.join(self.cache_dir, key + '.png')
+            image_format = 'PNG'
+        else:
+            cache_path = os.path.join(self.cache_dir, key + '.jpg')
+            image_format = 'JPEG'
+            if thumbnail.mode != 'RGB':
+                thumbnail = thumbnail.convert('RGB')
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        try:
+            thumbnail.save(tmp_path, image_format)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f'缩略图缓存写入失败: {str(e)}')
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -0,0 +1,333 @@
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from PixivCrawlerRateLimit import get_shared_limiter, parse_retry_after, classify_endpoint
+from PixivCrawlerRetry import RetryPolicy
+from PixivCrawlerEvents import get_event_bus, REQUEST_FINISHED, DOWNLOAD_STARTED, DOWNLOAD_FINISHED, DISK_WRITE
+
+# 每个主机允许的最大并发连接数
+HOST_LIMITS = {
+    'i.pximg.net': 8,
+    'www.pixiv.net': 2,
+}
+
+# 流式下载时每次读取的块大小
+CHUNK_SIZE = 64 * 1024
+
+# 下载中断或服务器出错后自动续传的次数
+RESUME_RETRIES = 3
+
+API_USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36'
+
+# 图片CDN请求使用的基础请求头
+IMAGE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36',
+    'Referer': 'https://www.pixiv.net/',
+    'Accept': 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8',
+    'Accept-Language': 'zh-CN,zh;q=0.9,en-US;q=0.8,en;q=0.7,ja;q=0.6',
+    'sec-ch-ua': '"Chromium";v="96", "Google Chrome";v="96", ";Not A Brand";v="99"',
+    'sec-ch-ua-mobile': '?0',
+    'sec-ch-ua-platform': '"Windows"',
+    'sec-fetch-dest': 'image',
+    'sec-fetch-mode': 'no-cors',
+    'sec-fetch-site': 'cross-site'
+}
+
+class IncompleteDownload(requests.exceptions.RequestException):
+    """下载的字节数与Content-Length不一致"""
+
+# 可以从断点续传重试的异常
+RESUMABLE_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    IncompleteDownload,
+)
+
+def parse_content_range(value):
+    """解析 'bytes 起始-结束/总长度'，返回 (起始, 总长度)，总长度未知时为None"""
+    match = re.match(r'bytes (\d+)-\d+/(\d+|\*)', value or '')
+    if not match:
+        return None, None
+    total = match.group(2)
+    return int(match.group(1)), (int(total) if total != '*' else None)
+
+def load_part_meta(url, part_path, meta_path):
+    """读取分段文件的记录；记录缺失或属于其他URL时丢弃分段文件"""
+    if not os.path.exists(part_path):
+        return None
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('url') == url:
+            return meta
+    except (OSError, ValueError):
+        pass
+    remove_part(part_path, meta_path)
+    return None
+
+def save_part_meta(meta_path, meta):
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+def remove_part(part_path, meta_path):
+    for path in (part_path, meta_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+class PixivTransport:
+    """两个爬虫共用的HTTP传输层：复用长连接池，请求头和Cookie只在初始化时构建一次"""
+
+    def __init__(self, cookie, host_limits=None, timeout=30, limiter=None, retry=None, host_overrides=None):
+        self.cookie = cookie
+        self.timeout = timeout
+        # 转发到其他地址的主机，如 {'i.pximg.net': 'http://127.0.0.1:8000'}，用于离线测试
+        self.host_overrides = dict(host_overrides) if host_overrides else {}
+        # 按接口类别自适应调整请求速率
+        self.limiter = limiter if limiter else get_shared_limiter()
+        # 失败重试与按主机熔断
+        self.retry = retry if retry else RetryPolicy()
+        # 请求和下载的进度事件
+        self.events = get_event_bus()
+
+        limits = dict(HOST_LIMITS)
+        if host_limits:
+            limits.update(host_limits)
+        self.host_semaphores = {host: threading.BoundedSemaphore(limit) for host, limit in limits.items()}
+        self.file_locks = [threading.Lock() for _ in range(64)]
+
+        # 共享会话，连接池大小与主机并发上限一致，连接保持复用
+        self.session = requests.Session()
+        self.session.verify = False  # 禁用SSL验证
+        self.pool_size = max(limits.values())
+        adapter = HTTPAdapter(pool_connections=len(limits), pool_maxsize=self.pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # API请求头
+        self.api_headers = {
+            'User-Agent': API_USER_AGENT,
+            'Referer': 'https://www.pixiv.net/',
+            'Cookie': cookie
+        }
+        # 图片请求头，附带同一个Cookie请求头（不能把每个Cookie拆成单独的请求头）
+        self.image_headers = dict(IMAGE_HEADERS)
+        self.image_headers['Cookie'] = cookie
+
+        self.host_headers = {
+            'www.pixiv.net': self.api_headers,
+            'i.pximg.net': self.image_headers,
+        }
+
+    def resolve(self, url):
+        """返回实际发送请求的地址；限速、熔断、并发限制和事件仍按原URL的主机计算"""
+        parsed = urlparse(url)
+        base = self.host_overrides.get(parsed.hostname)
+        if base is None:
+            return url
+        return base.rstrip('/') + url[len(f'{parsed.scheme}://{parsed.netloc}'):]
+
+    @contextmanager
+    def host_slot(self, url):
+        """占用目标主机的一个并发名额，未配置限制的主机不受约束"""
+        semaphore = self.host_semaphores.get(urlparse(url).hostname)
+        if semaphore is None:
+            yield
+            return
+        with semaphore:
+            yield
+
+    def get(self, url, headers=None, **kwargs):
+        """发送GET请求，默认使用目标主机对应的请求头；网络错误、429和5xx按重试策略自动重试"""
+        if headers is None:
+            headers = self.host_headers.get(urlparse(url).hostname, self.api_headers)
+        kwargs.setdefault('timeout', self.timeout)
+        return self.retry.call(url, self._get_once, url, headers, kwargs)
+
+    def _get_once(self, url, headers, kwargs):
+        self.limiter.acquire(url)
+        with self.host_slot(url):
+            started = time.monotonic()
+            try:
+                response = self.session.get(self.resolve(url), headers=headers, **kwargs)
+            except requests.exceptions.RequestException:
+                self.report_error(url, started)
+                raise
+        # 流式响应的大小由下载事件统计
+        self.report_response(url, response, started, None if kwargs.get('stream') else len(response.content))
+        return response
+
+    def report_response(self, url, response, started, size=None):
+        """把响应状态反馈给限速器，并发布请求事件"""
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        self.limiter.report(url, response.status_code, retry_after=retry_after)
+        self.events.publish(REQUEST_FINISHED, url=url, endpoint=classify_endpoint(url),
+                            status=response.status_code, latency=time.monotonic() - started, bytes=size)
+
+    def report_error(self, url, started):
+        self.limiter.report(url, error=True)
+        self.events.publish(REQUEST_FINISHED, url=url, endpoint=classify_endpoint(url),
+                            status=None, latency=time.monotonic() - started, bytes=None)
+
+    def image_headers_for(self, artwork_id=None):
+        """图片请求头，指定作品ID时Referer指向作品页面"""
+        if artwork_id is None:
+            return self.image_headers
+        headers = dict(self.image_headers)
+        headers['Referer'] = f'https://www.pixiv.net/artworks/{artwork_id}'
+        return headers
+
+    def file_lock(self, file_path):
+        """同一目标文件的下载在进程内互斥，避免并发写同一个分段文件"""
+        return self.file_locks[hash(file_path) % len(self.file_locks)]
+
+    def download(self, url, file_path, artwork_id=None, verify_length=True, chunk_size=CHUNK_SIZE, resume_retries=RESUME_RETRIES, finalize=True,
+                 missing_ok=False):
+        """断点续传下载图片
+
+        数据先写入 file_path.part，已下载的字节偏移和校验信息记录在 file_path.part.json；
+        网络中断后的重试以及之后的运行都会用Range请求从偏移处继续下载。
+        下载完成并校验总长度后原子重命名为file_path；finalize为False时保留完整的分段文件，
+        由调用方稍后调用 finalize_download 完成重命名。
+        返回 (response, 文件字节数)；下载失败（非200/206状态码）时文件字节数为None
+
+        missing_ok为True用于试探地址（如猜测原图扩展名）：404不算下载失败，不发布下载事件；
+        其他结果在下载结束后一起发布开始和结束事件。
+        """
+        with self.file_lock(file_path):
+            if not missing_ok:
+                self.events.publish(DOWNLOAD_STARTED, artwork_id=artwork_id, url=url)
+            started = time.monotonic()
+            size = None
+            missing = False
+            try:
+                # 中断后的重试按重试策略退避，每次都从分段文件的偏移处继续
+                response, size = self.retry.call(
+                    url, self._download_once, url, file_path, artwork_id, verify_length, chunk_size, finalize,
+                    max_retries=resume_retries, errors=RESUMABLE_ERRORS
+                )
+                missing = size is None and response.status_code == 404
+                return response, size
+            finally:
+                if missing_ok and not missing:
+                    self.events.publish(DOWNLOAD_STARTED, artwork_id=artwork_id, url=url)
+                if not (missing_ok and missing):
+                    self.events.publish(DOWNLOAD_FINISHED, artwork_id=artwork_id, url=url, bytes=size or 0,
+                                        latency=time.monotonic() - started, success=size is not None)
+
+    def _download_once(self, url, file_path, artwork_id, verify_length, chunk_size, finalize):
+        part_path = file_path + '.part'
+        meta_path = part_path + '.json'
+        meta = load_part_meta(url, part_path, meta_path)
+        offset = os.path.getsize(part_path) if meta else 0
+
+        headers = dict(self.image_headers_for(artwork_id))
+        # 续传按原始字节偏移计算，不接受压缩编码
+        headers['Accept-Encoding'] = 'identity'
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+            validator = meta.get('etag') or meta.get('last_modified')
+            if validator:
+                headers['If-Range'] = validator
+
+        self.limiter.acquire(url)
+        with self.host_slot(url):
+            started = time.monotonic()
+            try:
+                response = self.session.get(self.resolve(url), headers=headers, timeout=self.timeout, stream=True)
+            except requests.exceptions.RequestException:
+                self.report_error(url, started)
+                raise
+            self.report_response(url, response, started)
+            with response:
+                if response.status_code == 416 and offset:
+                    if offset == meta.get('total'):
+                        # 分段文件其实已经完整
+                        if finalize:
+                            self.finalize_download(file_path)
+                        return response, offset
+                    remove_part(part_path, meta_path)
+                    raise IncompleteDownload(f'续传范围无效，重新下载: 已有 {offset} 字节')
+
+                if response.status_code == 206:
+                    start, total = parse_content_range(response.headers.get('Content-Range'))
+                    if start != offset:
+                        remove_part(part_path, meta_path)
+                        raise IncompleteDownload(f'续传偏移不一致，重新下载: 请求 {offset}, 返回 {start}')
+                    mode = 'ab'
+                elif response.status_code == 200:
+                    # 服务器不支持续传或文件已变化，从头下载
+                    offset = 0
+                    length = response.headers.get('Content-Length')
+                    total = int(length) if length else None
+                    mode = 'wb'
+                else:
+                    return response, None
+
+                meta = {
+                    'url': url,
+                    'offset': offset,
+                    'total': total,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                }
+                save_part_meta(meta_path, meta)
+
+                size = offset
+                write_time = 0.0
+                try:
+                    with open(part_path, mode) as f:
+                        for chunk in response.iter_content(chunk_size):
+                            write_started = time.monotonic()
+                            f.write(chunk)
+                            write_time += time.monotonic() - write_started
+                            size += len(chunk)
+                finally:
+                    # 记录已写入的字节偏移，供后续续传
+                    meta['offset'] = size
+                    save_part_meta(meta_path, meta)
+
+                if verify_length and total is not None and size != total:
+                    self.report_write(file_path, size - offset, write_time)
+                    raise IncompleteDownload(f'下载不完整: 收到 {size} 字节, 应为 {total} 字节')
+
+                if finalize:
+                    write_started = time.monotonic()
+                    self.finalize_download(file_path)
+                    write_time += time.monotonic() - write_started
+                self.report_write(file_path, size - offset, write_time)
+        return response, size
+
+    def report_write(self, file_path, size, latency):
+        self.events.publish(DISK_WRITE, path=file_path, bytes=size, latency=latency)
+
+    def finalize_download(self, file_path):
+        """把下载完成的分段文件原子重命名为最终文件"""
+        part_path = file_path + '.part'
+        os.replace(part_path, file_path)
+        remove_part(part_path, part_path + '.json')
+
+    def close(self):
+        self.session.close()
+
+_shared_transports = {}
+_shared_lock = threading.Lock()
+
+def get_shared_transport(cookie):
+    """按Cookie返回进程内共享的传输对象"""
+    with _shared_lock:
+        transport = _shared_transports.get(cookie)
+        if transport is None:
+            transport = PixivTransport(cookie)
+            _shared_transports[cookie] = transport
+        return transport
@@ -0,0 +1,54 @@
+import contextlib
+import io
+
+import pytest
+
+from PixivCrawlerArtist import PixivArtistCrawler
+from PixivCrawlerBenchmark import MockPixivServer, BENCHMARK_ARTIST, UNLIMITED_RATES
+from PixivCrawlerDB import PixivDatabase
+from PixivCrawlerEvents import get_event_bus, drain, DOWNLOAD_STARTED, DOWNLOAD_FINISHED
+from PixivCrawlerMetrics import MetricsCollector
+from PixivCrawlerRateLimit import AdaptiveRateLimiter
+from PixivCrawlerStore import BlobStore
+from PixivCrawlerTransport import PixivTransport
+
+@pytest.fixture
+def server():
+    server = MockPixivServer(works=40, latency=0).start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def bus():
+    return get_event_bus()
+
+def test_wrong_extension_guesses_are_not_failed_downloads(server, bus, tmp_path):
+    events = bus.subscribe(maxsize=100000)
+    collector = MetricsCollector(bus, AdaptiveRateLimiter(UNLIMITED_RATES))
+    transport = PixivTransport('PHPSESSID=test', limiter=AdaptiveRateLimiter(UNLIMITED_RATES), host_overrides={
+        'www.pixiv.net': server.url,
+        'i.pximg.net': server.url,
+    })
+    db = PixivDatabase(str(tmp_path / 'pixiv_data.db'))
+    crawler = PixivArtistCrawler('PHPSESSID=test', str(tmp_path / 'images'), workers=4, transport=transport, db=db,
+                                 store=BlobStore(str(tmp_path / '.blobs')))
+    with contextlib.redirect_stdout(io.StringIO()):
+        crawler.get_artist_artworks(BENCHMARK_ARTIST)
+    crawler.shutdown()
+    transport.close()
+    db.close()
+
+    # 模拟服务器中有非jpg的单页作品，猜错扩展名时CDN返回404
+    assert server.counts[('image', 404)] > 0
+    received = drain(events)
+    finished = [event for event in received if event['type'] == DOWNLOAD_FINISHED]
+    assert finished and all(event['success'] for event in finished)
+    assert len([event for event in received if event['type'] == DOWNLOAD_STARTED]) == len(finished)
+
+    collector.update()
+    guessed = collector.counters['pixiv_guessed_originals_total']
+    assert guessed[(('result', 'hit'),)] > 0
+    assert collector.counters['pixiv_guess_misses_total'][()] == server.counts[('image', 404)]
+    assert 'pixiv_guessed_originals_total{result="hit"}' in collector.to_prometheus()
+    collector.close()
+    bus.unsubscribe(events)
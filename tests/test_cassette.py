@@ -0,0 +1,77 @@
+import contextlib
+import gzip
+import io
+import json
+import os
+import time
+
+import pytest
+
+import PixivCrawlerCassette
+import PixivCrawlerRateLimit
+import PixivCrawlerRetry
+from PixivCrawlerCassette import INDEX_FILE, Cassette, cassette_transport, close_cassette_transport
+
+ILLUST_URL = 'https://www.pixiv.net/ajax/illust/123'
+IMAGE_URL = 'https://i.pximg.net/img-original/img/2024/01/01/00/00/00/123_p0.png'
+IMAGE = b'\x89PNG' + b'\x00' * 1000
+
+@pytest.fixture
+def cassette_path(tmp_path):
+    """录制了被限流、服务器错误和网络异常后重试成功的一组响应，每个响应耗时5秒"""
+    path = str(tmp_path / 'cassette')
+    os.makedirs(path)
+    cassette = Cassette(path)
+    digest = cassette.save_blob(IMAGE)
+    json_headers = {'Content-Type': 'application/json; charset=utf-8'}
+    entries = [
+        {'url': ILLUST_URL, 'status': 429, 'reason': 'Too Many Requests', 'headers': dict(json_headers, **{'Retry-After': '60'}), 'body': '{}'},
+        {'url': ILLUST_URL, 'status': 503, 'reason': 'Service Unavailable', 'headers': json_headers, 'body': '{}'},
+        {'url': ILLUST_URL, 'status': 200, 'reason': 'OK', 'headers': json_headers,
+         'body': json.dumps({'error': False, 'body': {'illustId': '123'}})},
+        {'url': IMAGE_URL, 'error': 'ConnectionError'},
+        {'url': IMAGE_URL, 'status': 200, 'reason': 'OK',
+         'headers': {'Content-Type': 'image/png', 'Content-Length': str(len(IMAGE))}, 'blob': digest},
+    ]
+    with gzip.open(os.path.join(path, INDEX_FILE), 'wt', encoding='utf-8') as f:
+        for entry in entries:
+            f.write(json.dumps(dict(entry, method='GET', latency=5.0, duration=5.0)) + '\n')
+    return path
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    for module in (PixivCrawlerCassette, PixivCrawlerRateLimit, PixivCrawlerRetry):
+        monkeypatch.setattr(module.time, 'sleep', sleeps.append)
+    return sleeps
+
+def replay(path, speed, tmp_path):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        transport, db, workdir = cassette_transport('PHPSESSID=test', replay=path, speed=speed)
+        try:
+            response = transport.get(ILLUST_URL)
+            _, size = transport.download(IMAGE_URL, str(tmp_path / '123_p0.png'), '123')
+        finally:
+            close_cassette_transport(transport, db, workdir)
+    return response, size
+
+def test_replay_at_speed_zero_never_sleeps(cassette_path, sleeps, tmp_path):
+    started = time.monotonic()
+    response, size = replay(cassette_path, 0, tmp_path)
+    assert response.status_code == 200
+    assert response.json()['body']['illustId'] == '123'
+    assert size == len(IMAGE)
+    assert sleeps == []
+    assert time.monotonic() - started < 5
+
+def test_replay_speed_scales_recorded_time_and_retries(cassette_path, sleeps, tmp_path):
+    replay(cassette_path, 10, tmp_path)
+    # 5个响应各按录制耗时的1/10等待，重试的退避（含Retry-After）也按1/10缩短
+    recorded = [sleep for sleep in sleeps if sleep == pytest.approx(0.5)]
+    assert len(recorded) == 5
+    backoff = [sleep for sleep in sleeps if sleep != pytest.approx(0.5)]
+    assert len(backoff) == 3
+    assert max(backoff) <= PixivCrawlerRetry.MAX_DELAY / 10
+    # 429的Retry-After为60秒，按回放速度缩短，且不被限速器另外阻塞
+    assert backoff[0] == pytest.approx(6.0)
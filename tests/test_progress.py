@@ -0,0 +1,37 @@
+import time
+
+import pytest
+
+from PixivCrawlerEvents import EventBus, ARTWORK_FINISHED, DOWNLOAD_FINISHED
+from PixivCrawlerProgress import ProgressAggregator
+
+@pytest.fixture
+def aggregator():
+    aggregator = ProgressAggregator(EventBus(), window=10)
+    # 已运行超过一个窗口，吞吐量按整个窗口计算
+    aggregator.started -= 60
+    yield aggregator
+    aggregator.close()
+
+def finished(when, success=True):
+    return {'type': ARTWORK_FINISHED, 'time': when, 'artwork_id': '1', 'success': success}
+
+def test_rate_uses_event_time_not_drain_time(aggregator):
+    now = time.time()
+    # 在同一次输出间隔内一起取出，但只有最近10秒内发布的事件计入吞吐量
+    for when in (now - 30, now - 20, now - 5, now - 1):
+        aggregator.subscriber.put(finished(when))
+    aggregator.update()
+    assert aggregator.counts['finished'] == 4
+    assert aggregator.rate('artwork') == pytest.approx(2 / 10)
+    assert len(aggregator.recent) == 2
+
+def test_rate_decays_between_updates(aggregator):
+    now = time.time()
+    aggregator.handle(finished(now - 9.5))
+    aggregator.handle({'type': DOWNLOAD_FINISHED, 'time': now, 'artwork_id': '1', 'url': 'x', 'bytes': 1000,
+                       'latency': 0.1, 'success': True})
+    assert aggregator.rate('artwork') == pytest.approx(1 / 10)
+    assert aggregator.rate('bytes') == pytest.approx(100)
+    aggregator.recent[0] = (now - 11, 'artwork', 1)
+    assert aggregator.rate('artwork') == 0
@@ -0,0 +1,155 @@
+import os
+import threading
+
+import pytest
+import requests
+
+import PixivCrawlerQueue
+from PixivCrawlerQueue import (WorkQueue, QueueServer, RemoteQueue, TaskError, folder_name, save_dir,
+                               MAX_ATTEMPTS, RETRY_DELAY, SKIPPED)
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(PixivCrawlerQueue.time, 'time', clock)
+    return clock
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.db'))
+    yield queue
+    queue.close()
+
+def artwork_task(artwork_id, min_bookmarks=1000):
+    return ('artwork', f'artwork:{artwork_id}', {'artwork_id': artwork_id, 'min_bookmarks': min_bookmarks, 'folder': 'tag_a_20260101'})
+
+def test_add_tasks_ignores_duplicate_keys(queue, clock):
+    assert queue.add_tasks([artwork_task(1), artwork_task(2)]) == 2
+    assert queue.add_tasks([artwork_task(1)]) == 0
+    assert queue.counts() == {'artwork': {'pending': 2}}
+
+def test_lease_hands_out_each_task_once(queue, clock):
+    queue.add_tasks([artwork_task(1), artwork_task(2)])
+    first = queue.lease('a', count=1)
+    second = queue.lease('b', count=5)
+    assert [task['key'] for task in first + second] == ['artwork:1', 'artwork:2']
+    assert queue.lease('c') == []
+    assert first[0]['attempts'] == 1
+
+def test_expired_lease_is_requeued(queue, clock):
+    queue.add_tasks([artwork_task(1)])
+    task, = queue.lease('crashed', lease_time=60)
+    clock.now += 30
+    assert queue.lease('other') == []
+    clock.now += 31
+    retaken, = queue.lease('other', lease_time=60)
+    assert retaken['id'] == task['id']
+    assert retaken['attempts'] == 2
+    # 原持有者的租约已失效，完成和续租都不生效
+    assert queue.complete(task['id'], task['token'], '下载完成') is False
+    assert queue.extend([(task['id'], task['token'])]) == 0
+    assert queue.complete(retaken['id'], retaken['token'], '下载完成') is True
+    assert queue.counts() == {'artwork': {'done': 1}}
+
+def test_extend_keeps_lease_alive(queue, clock):
+    queue.add_tasks([artwork_task(1)])
+    task, = queue.lease('a', lease_time=60)
+    clock.now += 50
+    assert queue.extend([(task['id'], task['token'])], lease_time=60) == 1
+    clock.now += 50
+    assert queue.lease('b') == []
+    assert queue.complete(task['id'], task['token']) is True
+
+def test_expired_leases_fail_after_max_attempts(queue, clock):
+    queue.add_tasks([artwork_task(1)])
+    for _ in range(MAX_ATTEMPTS):
+        assert queue.lease('crashed', lease_time=10)
+        clock.now += 11
+    assert queue.counts() == {'artwork': {'failed': 1}}
+    assert queue.retry_failed() == 1
+    assert queue.lease('a')[0]['attempts'] == 1
+
+def test_fail_requeues_with_backoff(queue, clock):
+    queue.add_tasks([artwork_task(1)])
+    task, = queue.lease('a')
+    assert queue.fail(task['id'], task['token'], '下载失败') is True
+    assert queue.lease('a') == []
+    clock.now += RETRY_DELAY
+    task, = queue.lease('a')
+    assert queue.fail(task['id'], task['token'], '下载失败') is True
+    clock.now += RETRY_DELAY
+    assert queue.lease('a') == []
+    clock.now += RETRY_DELAY
+    assert queue.lease('a')[0]['attempts'] == 3
+
+def test_looser_filter_reopens_skipped_task(queue, clock):
+    queue.add_tasks([artwork_task(1, min_bookmarks=1000)])
+    task, = queue.lease('a')
+    queue.complete(task['id'], task['token'], f'{SKIPPED}: 收藏数不足')
+    assert queue.add_tasks([artwork_task(1, min_bookmarks=1000)]) == 0
+    assert queue.add_tasks([artwork_task(1, min_bookmarks=0)]) == 1
+    assert queue.lease('a')[0]['payload']['min_bookmarks'] == 0
+
+def test_looser_filter_reopens_task_being_processed(queue, clock):
+    queue.add_tasks([artwork_task(1, min_bookmarks=1000)])
+    task, = queue.lease('a')
+    assert queue.add_tasks([artwork_task(1, min_bookmarks=0)]) == 1
+    queue.complete(task['id'], task['token'], f'{SKIPPED}: 收藏数不足')
+    assert queue.counts() == {'artwork': {'pending': 1}}
+
+def test_folder_name_is_a_single_directory():
+    assert folder_name('tag', 'Fate/GrandOrder', '20260101') == 'tag_Fate_GrandOrder_20260101'
+    folder = folder_name('tag', '../..', '20260101')
+    assert '..' not in folder and '/' not in folder
+    save_dir('pixiv_images', folder)
+
+@pytest.mark.parametrize('folder', ['', '..', '../outside', 'a/b', 'a\\b', '/etc', 'tag_a..b', None])
+def test_save_dir_rejects_unsafe_folders(tmp_path, folder):
+    with pytest.raises(TaskError):
+        save_dir(str(tmp_path), folder)
+
+def test_save_dir_stays_under_root(tmp_path):
+    assert save_dir(str(tmp_path), 'tag_a_20260101') == os.path.join(str(tmp_path), 'tag_a_20260101')
+
+@pytest.fixture
+def server(queue):
+    server = QueueServer(queue, 'secret', '127.0.0.1', 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+def test_server_requires_token(server):
+    remote = RemoteQueue(server, 'secret')
+    assert remote.add_tasks([artwork_task(1)]) == 1
+    assert remote.counts() == {'artwork': {'pending': 1}}
+    for token in ('wrong', ''):
+        with pytest.raises(requests.exceptions.HTTPError) as error:
+            RemoteQueue(server, token).counts()
+        assert error.value.response.status_code == 403
+    response = requests.post(f'{server}/counts', json={}, timeout=10)
+    assert response.status_code == 403
+
+def test_server_answers_bad_calls(server):
+    headers = {'X-Queue-Token': 'secret'}
+    # 列表作键时 SQLite 无法绑定参数，应得到400而不是断开连接
+    for tasks in ([['artwork', [1], {}]], [[{'bad': 1}, 'artwork:1', {}]], 'oops'):
+        response = requests.post(f'{server}/add_tasks', json={'tasks': tasks}, headers=headers, timeout=10)
+        assert response.status_code == 400
+        assert response.json()['error']
+    remote = RemoteQueue(server, 'secret')
+    with pytest.raises(requests.exceptions.HTTPError) as error:
+        remote.add_tasks([('artwork', [1], {})])
+    assert error.value.response.status_code == 400
+    assert remote.counts() == {}
+
+def test_server_needs_a_token(queue):
+    with pytest.raises(ValueError):
+        QueueServer(queue, '', '127.0.0.1', 0)
@@ -0,0 +1,103 @@
+import pytest
+
+import PixivCrawlerRateLimit
+from PixivCrawlerRateLimit import (AdaptiveRateLimiter, AdaptiveTokenBucket, classify_endpoint, parse_retry_after,
+                                   DECREASE_INTERVAL)
+
+SEARCH_URL = 'https://www.pixiv.net/ajax/search/artworks/tag?p=1'
+ILLUST_URL = 'https://www.pixiv.net/ajax/illust/123'
+IMAGE_URL = 'https://i.pximg.net/img-original/img/2024/01/01/00/00/00/123_p0.png'
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(PixivCrawlerRateLimit.time, 'monotonic', clock)
+    return clock
+
+def test_classify_endpoint():
+    assert classify_endpoint(SEARCH_URL) == 'search'
+    assert classify_endpoint(ILLUST_URL) == 'illust'
+    assert classify_endpoint(IMAGE_URL) == 'image'
+    assert classify_endpoint('https://www.pixiv.net/users/1') is None
+
+def test_bucket_queues_overdrawn_requests(clock):
+    bucket = AdaptiveTokenBucket(rate=2.0, min_rate=0.1, max_rate=10.0)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(0.5)
+    assert bucket.reserve() == pytest.approx(1.0)
+    clock.now += 1.0
+    # 一秒补充两个令牌，透支的两个刚好还清
+    assert bucket.reserve() == pytest.approx(0.5)
+
+def test_bucket_success_increases_rate_up_to_max(clock):
+    bucket = AdaptiveTokenBucket(rate=1.0, min_rate=0.1, max_rate=1.5)
+    bucket.on_success()
+    assert bucket.rate == pytest.approx(1.1)
+    for _ in range(100):
+        bucket.on_success()
+    assert bucket.rate == 1.5
+
+def test_bucket_throttle_halves_rate_once_per_interval(clock):
+    bucket = AdaptiveTokenBucket(rate=4.0, min_rate=0.5, max_rate=10.0)
+    bucket.on_throttle()
+    assert bucket.rate == 2.0
+    # 同一波错误不会连续降速
+    bucket.on_throttle()
+    assert bucket.rate == 2.0
+    clock.now += DECREASE_INTERVAL
+    bucket.on_throttle()
+    assert bucket.rate == 1.0
+    for _ in range(10):
+        clock.now += DECREASE_INTERVAL
+        bucket.on_throttle()
+    assert bucket.rate == 0.5
+
+def test_bucket_throttle_drops_saved_tokens(clock):
+    bucket = AdaptiveTokenBucket(rate=1.0, min_rate=0.1, max_rate=10.0, burst=5.0)
+    bucket.on_throttle()
+    assert bucket.reserve() == pytest.approx(2.0)
+
+def test_bucket_retry_after_blocks_requests(clock):
+    bucket = AdaptiveTokenBucket(rate=10.0, min_rate=0.1, max_rate=20.0)
+    bucket.on_throttle(retry_after=30)
+    assert bucket.reserve() == pytest.approx(30.0)
+    clock.now += 30.0
+    assert bucket.reserve() == 0.0
+
+def test_limiter_separates_endpoints(clock):
+    limiter = AdaptiveRateLimiter()
+    for _ in range(5):
+        limiter.report(SEARCH_URL, status=429)
+        clock.now += DECREASE_INTERVAL
+    rates = limiter.rates()
+    assert rates['search'] == 0.05
+    assert rates['illust'] == 2.0
+    assert rates['image'] == 10.0
+
+def test_limiter_forbidden_throttles_api_but_not_images(clock):
+    limiter = AdaptiveRateLimiter()
+    limiter.report(ILLUST_URL, status=403)
+    limiter.report(IMAGE_URL, status=403)
+    rates = limiter.rates()
+    assert rates['illust'] == 1.0
+    assert rates['image'] > 10.0
+
+def test_limiter_counts_sleep_seconds(clock):
+    limiter = AdaptiveRateLimiter({'search': {'rate': 1.0}})
+    assert limiter.reserve(SEARCH_URL) == ('search', 0.0)
+    assert limiter.reserve(SEARCH_URL) == ('search', pytest.approx(1.0))
+    assert limiter.sleep_seconds['search'] == pytest.approx(1.0)
+    assert limiter.reserve('https://www.pixiv.net/') == (None, 0.0)
+
+def test_parse_retry_after():
+    assert parse_retry_after('12') == 12.0
+    assert parse_retry_after('-3') == 0.0
+    assert parse_retry_after('Wed, 21 Oct 2026 07:28:00 GMT') is None
+    assert parse_retry_after(None) is None
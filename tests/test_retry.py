@@ -0,0 +1,174 @@
+import asyncio
+
+import pytest
+import requests
+
+import PixivCrawlerRetry
+from PixivCrawlerRetry import CircuitBreaker, RetryPolicy, RetryQueue, backoff_delay, classify_status
+from PixivCrawlerBase import PixivBaseCrawler
+
+URL = 'https://www.pixiv.net/ajax/illust/123'
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(PixivCrawlerRetry.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(PixivCrawlerRetry.time, 'sleep', clock.sleep)
+    # 去掉抖动，退避时间取上限
+    monkeypatch.setattr(PixivCrawlerRetry.random, 'uniform', lambda low, high: high)
+    return clock
+
+def responses(*statuses):
+    results = iter(statuses)
+
+    def send():
+        status = next(results)
+        if isinstance(status, Exception):
+            raise status
+        return FakeResponse(status)
+    return send
+
+def test_classify_status():
+    assert classify_status(429) == 'throttle'
+    assert classify_status(503) == 'server'
+    assert classify_status(200) is None
+    assert classify_status(404) is None
+    assert classify_status(None) is None
+
+def test_backoff_delay_is_capped_and_respects_retry_after(clock):
+    assert backoff_delay(1) == 2.0
+    assert backoff_delay(10, max_delay=60.0) == 60.0
+    assert backoff_delay(0, retry_after=15) == 15
+    assert backoff_delay(0, retry_after=600, max_delay=60.0) == 60.0
+
+def test_breaker_opens_after_threshold_and_probes(clock):
+    breaker = CircuitBreaker('www.pixiv.net', failure_threshold=3, reset_timeout=30.0)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == 'closed'
+    assert breaker.delay() == 0.0
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert breaker.delay() == pytest.approx(30.0)
+
+    clock.now += 30.0
+    # 暂停结束后只放行一个试探请求
+    assert breaker.delay() == 0.0
+    assert breaker.state == 'half_open'
+    assert breaker.delay() > 0
+
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.failures == 0
+    assert breaker.delay() == 0.0
+
+def test_breaker_failed_probe_reopens(clock):
+    breaker = CircuitBreaker('i.pximg.net', failure_threshold=1, reset_timeout=10.0)
+    breaker.record_failure()
+    clock.now += 10.0
+    assert breaker.delay() == 0.0
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert breaker.delay() == pytest.approx(10.0)
+
+def test_policy_retries_server_errors_until_success(clock):
+    policy = RetryPolicy(max_retries=4, failure_threshold=10)
+    response = policy.call(URL, responses(503, 429, 200))
+    assert response.status_code == 200
+    assert clock.sleeps == [2.0, 4.0]
+    assert policy.breaker_for(URL).failures == 0
+
+def test_policy_does_not_retry_client_errors(clock):
+    policy = RetryPolicy()
+    assert policy.call(URL, responses(404)).status_code == 404
+    assert clock.sleeps == []
+
+def test_policy_returns_last_response_when_retries_run_out(clock):
+    policy = RetryPolicy(max_retries=2, failure_threshold=10)
+    assert policy.call(URL, responses(503, 503, 503)).status_code == 503
+    assert len(clock.sleeps) == 2
+
+def test_policy_reraises_network_errors_when_retries_run_out(clock):
+    policy = RetryPolicy(max_retries=1, failure_threshold=10)
+    error = requests.exceptions.ConnectionError('reset')
+    with pytest.raises(requests.exceptions.ConnectionError):
+        policy.call(URL, responses(error, error))
+
+def test_policy_honours_retry_after(clock):
+    policy = RetryPolicy(failure_threshold=10)
+    results = iter([FakeResponse(429, {'Retry-After': '20'}), FakeResponse(200)])
+    assert policy.call(URL, lambda: next(results)).status_code == 200
+    assert clock.sleeps == [20.0]
+
+def test_policy_shares_breaker_per_host(clock):
+    policy = RetryPolicy()
+    assert policy.breaker_for(URL) is policy.breaker_for('https://www.pixiv.net/ajax/search/artworks/a')
+    assert policy.breaker_for(URL) is not policy.breaker_for('https://i.pximg.net/img-original/1_p0.png')
+
+def test_policy_call_async_retries(clock, monkeypatch):
+    async def no_sleep(seconds):
+        clock.sleeps.append(seconds)
+    monkeypatch.setattr(PixivCrawlerRetry.asyncio, 'sleep', no_sleep)
+    statuses = iter([503, 200])
+
+    async def send():
+        return next(statuses), None, b'ok'
+    policy = RetryPolicy(failure_threshold=10)
+    assert asyncio.run(policy.call_async(URL, send, errors=())) == (200, b'ok')
+    assert clock.sleeps == [2.0]
+
+class RetryingCrawler(PixivBaseCrawler):
+    """只使用重试队列的爬虫，不创建传输层、数据库和线程池"""
+
+    def __init__(self):
+        self.retry_queue = RetryQueue()
+
+def test_retry_failed_counts_only_true_results():
+    crawler = RetryingCrawler()
+    crawler.retry_queue.put('成功', lambda: True)
+    crawler.retry_queue.put('非布尔的真值', lambda: (0, 0))
+    crawler.retry_queue.put('失败', lambda: False)
+    assert crawler.retry_failed() == 1
+    assert len(crawler.retry_queue) == 0
+
+def test_retry_failed_runs_requeued_items_in_later_rounds():
+    crawler = RetryingCrawler()
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 2:
+            crawler.retry_queue.put('不稳定', flaky)
+            return False
+        return True
+    crawler.retry_queue.put('不稳定', flaky)
+    assert crawler.retry_failed() == 1
+    assert len(attempts) == 2
+
+def test_retry_failed_gives_up_after_rounds(capsys):
+    crawler = RetryingCrawler()
+
+    def always_fails():
+        crawler.retry_queue.put('总是失败', always_fails)
+        return False
+    crawler.retry_queue.put('总是失败', always_fails)
+    assert crawler.retry_failed(rounds=2) == 0
+    assert len(crawler.retry_queue) == 0
+    assert '仍有 1 个任务失败' in capsys.readouterr().out
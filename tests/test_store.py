@@ -0,0 +1,84 @@
+import os
+import shutil
+
+import pytest
+
+import PixivCrawlerStore
+from PixivCrawlerDB import file_sha1
+from PixivCrawlerStore import BlobStore
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+    return str(path)
+
+@pytest.fixture
+def store(tmp_path):
+    return BlobStore(str(tmp_path / '.blobs'))
+
+@pytest.fixture
+def reflink_only(monkeypatch):
+    """模拟不支持硬链接、只支持reflink的文件系统：reflink得到的文件链接数不增加"""
+    def no_link(source, dest):
+        raise OSError('hard links not supported')
+
+    def fake_reflink(source, dest):
+        shutil.copyfile(source, dest)
+        return True
+    monkeypatch.setattr(PixivCrawlerStore.os, 'link', no_link)
+    monkeypatch.setattr(PixivCrawlerStore, 'reflink', fake_reflink)
+
+def test_add_stores_then_deduplicates(store, tmp_path):
+    first = write(tmp_path / 'tag_a' / '1_p0.png', b'image')
+    second = write(tmp_path / 'artist_b' / '1_p0.png', b'image')
+    assert store.add(first) == 'stored'
+    assert store.add(second) == 'deduplicated'
+    assert store.add(first) == 'linked'
+    blob = store.blob_path(file_sha1(first))
+    assert os.path.samefile(first, blob)
+    assert os.path.samefile(second, blob)
+    assert os.stat(blob).st_nlink == 3
+
+def test_add_keeps_different_content_apart(store, tmp_path):
+    first = write(tmp_path / 'a' / '1_p0.png', b'one')
+    second = write(tmp_path / 'a' / '2_p0.png', b'two')
+    assert store.add(first) == 'stored'
+    assert store.add(second) == 'stored'
+    assert not os.path.samefile(first, second)
+
+def test_prune_removes_only_unreferenced_hardlinked_blobs(store, tmp_path):
+    kept = write(tmp_path / 'a' / '1_p0.png', b'kept')
+    removed = write(tmp_path / 'b' / '2_p0.png', b'removed!')
+    store.add(kept)
+    store.add(removed)
+    os.remove(removed)
+    assert store.prune() == (1, len(b'removed!'))
+    assert os.path.exists(store.blob_path(file_sha1(kept)))
+    assert store.prune() == (0, 0)
+
+def test_prune_keeps_referenced_reflinked_blobs(store, tmp_path, reflink_only):
+    path = write(tmp_path / 'a' / '1_p0.png', b'reflinked')
+    sha1 = file_sha1(path)
+    assert store.add(path, sha1) == 'stored'
+    blob = store.blob_path(sha1)
+    assert os.stat(blob).st_nlink == 1
+    # 链接数为1但仍被下载目录中的文件使用
+    assert store.prune({sha1}) == (0, 0)
+    assert os.path.exists(blob)
+    assert store.prune(set()) == (1, len(b'reflinked'))
+    assert not os.path.exists(blob)
+
+def test_dedupe_tree_collects_referenced_hashes(store, tmp_path):
+    root = tmp_path
+    write(root / 'a' / '1_p0.png', b'same')
+    write(root / 'b' / '1_p0.png', b'same')
+    write(root / 'b' / '2_p0.png', b'other')
+    write(root / 'b' / '3_p0.png.part', b'partial')
+    referenced = set()
+    stats = store.dedupe_tree(str(root), referenced)
+    assert stats['files'] == 3
+    assert stats['stored'] == 2
+    assert stats['deduplicated'] == 1
+    assert stats['saved_bytes'] == len(b'same')
+    assert referenced == {file_sha1(str(root / 'a' / '1_p0.png')), file_sha1(str(root / 'b' / '2_p0.png'))}
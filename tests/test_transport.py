@@ -0,0 +1,23 @@
+import requests
+
+from PixivCrawlerTransport import PixivTransport
+
+COOKIE = 'PHPSESSID=123_abc; device_token=xyz'
+IMAGE_URL = 'https://i.pximg.net/img-original/img/2024/01/01/00/00/00/123_p0.png'
+
+def prepared_headers(transport, url, headers):
+    return transport.session.prepare_request(requests.Request('GET', url, headers=headers)).headers
+
+def test_image_requests_send_one_cookie_header():
+    transport = PixivTransport(COOKIE)
+    headers = prepared_headers(transport, IMAGE_URL, transport.image_headers_for('123'))
+    assert headers['Cookie'] == COOKIE
+    assert 'PHPSESSID' not in headers
+    assert 'device_token' not in headers
+    assert headers['Referer'] == 'https://www.pixiv.net/artworks/123'
+
+def test_api_requests_send_cookie_header():
+    transport = PixivTransport(COOKIE)
+    headers = prepared_headers(transport, 'https://www.pixiv.net/ajax/illust/123', transport.api_headers)
+    assert headers['Cookie'] == COOKIE
+    assert 'PHPSESSID' not in headers